@@ -2,15 +2,21 @@
 Shark-no-Ninsho-Mon - OAuth2 Authentication Gateway with Reverse Proxy Route Manager
 """
 from flask import Flask, render_template, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import atexit
+import hashlib
+import json
 import logging
 from datetime import datetime
 import os
+import signal
+import sys
 import threading
 from pathlib import Path
 from dotenv import load_dotenv
-from typing import Any, Dict, Set
+from typing import Any, Dict, Mapping, Set
 import collections
 import re
 
@@ -19,8 +25,9 @@ from config import get_settings
 # Load environment variables from .env file
 load_dotenv()
 
-from routes_db import RouteManager
-from caddy_manager import CaddyManager
+from routes_db import HEALTH_FIELDS, LOAD_BALANCING_FIELDS, TRANSPORT_FIELDS, RouteConflictError, RouteManager
+from route_storage import FileWatcher
+from caddy_manager import CaddyManager, CaddyMetricsCollector, CaddySyncWorker
 
 # In-memory log storage for the web interface
 log_entries = collections.deque(maxlen=200)  # Keep only last 200 entries to save memory
@@ -52,8 +59,19 @@ memory_handler = MemoryLogHandler()
 memory_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 logger.addHandler(memory_handler)
 
+class RouteJSONProvider(DefaultJSONProvider):
+    """JSON provider that also serializes read-only route views"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = RouteJSONProvider(app)
 
 settings = get_settings()
 app.config['SECRET_KEY'] = settings.secret_key
@@ -74,8 +92,53 @@ limiter = Limiter(
 )
 
 # Initialize route manager and Caddy manager
-route_manager = RouteManager(settings.routes_db_path)
-caddy_mgr = CaddyManager()  # uses http://caddy:2019 and :8080 by default
+route_manager = RouteManager(
+    settings.routes_db_path,
+    status_flush_interval=settings.status_flush_interval,
+    health_snapshot=settings.health_state_snapshot,
+    backend=settings.routes_db_backend,
+    multiprocess=settings.routes_multiprocess,
+)
+caddy_mgr = CaddyManager(  # uses http://caddy:2019 and :8080 by default
+    metrics=settings.caddy_metrics_interval > 0,
+    stream_close_delay=settings.caddy_stream_close_delay,
+    active_health=settings.health_check_enabled and settings.health_check_mode == 'caddy',
+    health_interval=settings.health_check_interval or 30,
+    health_timeout=settings.http_timeout_sec,
+    health_expect_status=settings.caddy_health_expect_status,
+)
+# Route changes only mark Caddy dirty; the worker coalesces them into syncs
+caddy_sync = CaddySyncWorker(
+    caddy_mgr,
+    lambda: route_manager.get_all_routes(),
+    debounce=settings.caddy_sync_debounce_ms / 1000,
+    max_backoff=settings.caddy_sync_max_backoff,
+    reconcile_interval=settings.caddy_reconcile_interval,
+)
+
+# Real traffic figures scraped from Caddy's /metrics
+caddy_metrics = CaddyMetricsCollector(caddy_mgr, interval=settings.caddy_metrics_interval or 30)
+
+# Route search result limits (admin search-as-you-type)
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Route listing: largest page a client may request, and the result size
+# above which responses are streamed instead of built in memory
+ROUTES_MAX_PAGE = 1000
+ROUTES_STREAM_THRESHOLD = 500
+
+# Largest number of operations accepted by one batch or import request
+BATCH_MAX_OPERATIONS = 1000
+
+
+@atexit.register
+def _flush_route_status():
+    """Make sure buffered health results reach disk on shutdown."""
+    try:
+        route_manager.flush_status()
+    except Exception as e:
+        logger.error(f"STATUS_FLUSH_ERROR - {str(e)}")
 
 def is_valid_email(email: str) -> bool:
     """Validate email format using regex"""
@@ -141,6 +204,15 @@ def parse_bool(value: Any, default: bool = False) -> bool:
     return str(value).strip().lower() in {'1', 'true', 't', 'yes', 'on'}
 
 
+def if_match_tags():
+    """Return the strong tags of an If-Match header, or None if absent."""
+    if 'If-Match' not in request.headers:
+        return None
+    if request.if_match.star_tag:
+        return ['*']
+    return list(request.if_match.as_set())
+
+
 def get_user_email():
     """Get user email from OAuth2 proxy headers"""
     # Try multiple header variations that oauth2-proxy might use
@@ -168,6 +240,78 @@ def is_authorized():
     return email in AUTHORIZED_EMAILS
 
 
+def parse_route_list_args(args) -> Dict[str, Any]:
+    """Parse /api/routes query parameters into RouteManager.list_routes options"""
+    options: Dict[str, Any] = {
+        'sort': args.get('sort', 'name'),
+        'state': None,
+        'enabled': None,
+        'cursor': args.get('cursor') or None,
+        'limit': None,
+        'fields': None,
+    }
+    if args.get('state'):
+        options['state'] = [s.strip() for s in args['state'].split(',') if s.strip()]
+    if args.get('enabled'):
+        value = args['enabled'].lower()
+        if value not in ('true', 'false'):
+            raise ValueError("enabled must be 'true' or 'false'")
+        options['enabled'] = value == 'true'
+    if args.get('limit'):
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        options['limit'] = max(1, min(limit, ROUTES_MAX_PAGE))
+    if args.get('fields'):
+        # The id is always included so clients can address the route
+        options['fields'] = ['id'] + [f.strip() for f in args['fields'].split(',') if f.strip() and f.strip() != 'id']
+    return options
+
+
+# (etag, body) of the last serialized full route list
+_route_list_json = (None, '')
+
+
+def full_route_list_json(snap) -> str:
+    """Serialize every route once per snapshot version and reuse the result"""
+    global _route_list_json
+    etag, body = _route_list_json
+    if etag != snap.etag:
+        body = app.json.dumps(list(snap.routes))
+        _route_list_json = (snap.etag, body)
+    return body
+
+
+def routes_json_response(routes, fields=None, envelope=None) -> Response:
+    """Serialize routes (optionally projected to ``fields``) as JSON.
+
+    Small results are built with jsonify. Large ones are streamed route by
+    route so the full payload never has to exist in memory at once. With an
+    ``envelope`` the routes are returned under its ``routes`` key.
+    """
+    def project(route):
+        if fields is None:
+            return route
+        return {field: route[field] for field in fields if field in route}
+
+    if len(routes) <= ROUTES_STREAM_THRESHOLD:
+        items = [project(route) for route in routes]
+        return jsonify({**envelope, 'routes': items} if envelope is not None else items)
+
+    def generate():
+        if envelope is not None:
+            head = app.json.dumps(envelope)
+            yield head[:-1] + (', ' if envelope else '') + '"routes": ['
+        else:
+            yield '['
+        for index, route in enumerate(routes):
+            yield (',' if index else '') + app.json.dumps(project(route))
+        yield ']}' if envelope is not None else ']'
+
+    return Response(generate(), mimetype='application/json')
+
+
 # ============================================================================
 # MAIN ROUTES
 # ============================================================================
@@ -186,7 +330,9 @@ def index():
     
     logger.info(f"ACCESS - User: {email} | Path: /")
     
-    return render_template('index.html', email=email, routes=routes)
+    traffic = caddy_metrics.status()['traffic'] if caddy_metrics.running else {}
+
+    return render_template('index.html', email=email, routes=routes, traffic=traffic)
 
 
 @app.route('/admin')
@@ -307,8 +453,108 @@ def api_get_routes():
     if not is_authorized():
         return jsonify({'error': 'Unauthorized'}), 403
     
-    routes = route_manager.get_all_routes()
-    return jsonify(routes)
+    snap = route_manager.snapshot()
+    etag = snap.etag
+    if request.args:
+        # Different queries over the same version are different entities
+        etag = f"{etag}-{hashlib.sha1(request.query_string).hexdigest()[:12]}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if not request.args:
+        response = app.response_class(full_route_list_json(snap), mimetype='application/json')
+    else:
+        try:
+            options = parse_route_list_args(request.args)
+            fields = options.pop('fields')
+            page = route_manager.list_routes(**options)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if options['limit'] is None and options['cursor'] is None:
+            response = routes_json_response(page.routes, fields)
+        else:
+            response = routes_json_response(page.routes, fields, envelope={
+                'version': snap.version,
+                'total': page.total,
+                'count': len(page.routes),
+                'next_cursor': page.next_cursor,
+            })
+
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/api/routes/search', methods=['GET'])
+@limiter.limit("60 per minute")
+def api_search_routes():
+    """Search routes by name, path, target IP or port"""
+    email = get_user_email()
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    query = request.args.get('q', '').strip()
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit must be an integer'}), 400
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    results = route_manager.search_routes(query, limit) if query else []
+    return jsonify({'query': query, 'count': len(results), 'routes': results})
+
+
+@app.route('/api/caddy/sync', methods=['GET'])
+@limiter.limit("60 per minute")
+def api_caddy_sync_status():
+    """Get the state of the background Caddy sync"""
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    status = caddy_sync.status()
+    status['admin_calls'] = caddy_mgr.admin_stats()
+    status['history'] = caddy_mgr.history()
+    return jsonify(status)
+
+
+@app.route('/api/caddy/metrics', methods=['GET'])
+@limiter.limit("60 per minute")
+def api_caddy_metrics():
+    """Get real traffic rates and latency scraped from Caddy's metrics"""
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    if settings.caddy_metrics_interval <= 0:
+        return jsonify({'error': 'Caddy metrics are disabled'}), 404
+
+    return jsonify(caddy_metrics.status())
+
+
+@app.route('/api/routes/changes', methods=['GET'])
+@limiter.limit("30 per minute")
+def api_get_route_changes():
+    """Get routes added, updated or deleted since a given version"""
+    email = get_user_email()
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        since = int(request.args.get('since', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'since must be an integer version'}), 400
+
+    changes = route_manager.get_changes(since)
+
+    # Versions from another process lifetime cannot be compared
+    epoch = request.args.get('epoch')
+    if epoch and epoch != changes['epoch']:
+        changes.update(full_reload=True, changes=[])
+
+    return jsonify(changes)
 
 
 @app.route('/api/routes', methods=['POST'])
@@ -337,19 +583,21 @@ def api_create_route():
             health_check=parse_bool(data.get('health_check', True), True),
             timeout=data.get('timeout', 30),
             preserve_host=parse_bool(data.get('preserve_host', False)),
-            websocket=parse_bool(data.get('websocket', False))
+            websocket=parse_bool(data.get('websocket', False)),
+            **{field: data[field] for field in LOAD_BALANCING_FIELDS + TRANSPORT_FIELDS if field in data}
         )
         
         logger.info(f"ROUTE_ADD - User: {email} | Path: {route['path']} | Target: {route['target_ip']}:{route['target_port']}")
         
         # After DB change, resync Caddy
-        try:
-            routes = route_manager.get_all_routes()
-            caddy_mgr.sync(routes)
-        except Exception as e:
-            logger.exception("CADDY_SYNC after add failed: %s", e)
-        
-        return jsonify(route), 201
+        caddy_sync.request('add')
+
+        body = dict(route)
+        # Nested mounts are allowed but easy to create by accident
+        warnings = route_manager.mount_warnings(route['path'], route['id'])
+        if warnings:
+            body['warnings'] = warnings
+        return jsonify(body), 201
     
     except ValueError as e:
         logger.error(f"ROUTE_ADD_ERROR - User: {email} | Error: {str(e)}")
@@ -360,6 +608,109 @@ def api_create_route():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+def apply_route_batch(operations, email: str):
+    """Apply a batch of route operations and resync Caddy once"""
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+
+    try:
+        applied, results = route_manager.apply_batch(operations)
+    except Exception as e:
+        logger.error(f"ROUTE_BATCH_ERROR - User: {email} | Error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+    if not applied:
+        errors = sum(1 for r in results if r['status'] == 'error')
+        logger.error(f"ROUTE_BATCH_REJECTED - User: {email} | Operations: {len(operations)} | Errors: {errors}")
+        return jsonify({'applied': False, 'results': results}), 400
+
+    counts = collections.Counter(r['status'] for r in results)
+    logger.info(f"ROUTE_BATCH - User: {email} | " + ' | '.join(f"{k}: {v}" for k, v in sorted(counts.items())))
+
+    if results:
+        # After DB change, resync Caddy (once for the whole batch)
+        caddy_sync.request('batch')
+
+    return jsonify({'applied': True, 'results': results})
+
+
+@app.route('/api/routes/batch', methods=['POST'])
+@limiter.limit("30 per hour")
+def api_batch_routes():
+    """Create, update, toggle and delete several routes in one transaction"""
+    email = get_user_email()
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else data
+
+    if not isinstance(operations, list):
+        return jsonify({'error': "Request body must be a JSON list of operations or {'operations': [...]}"}), 400
+
+    return apply_route_batch(operations, email)
+
+
+@app.route('/api/routes/export', methods=['GET'])
+@limiter.limit("30 per hour")
+def api_export_routes():
+    """Stream every route's configuration as NDJSON"""
+    email = get_user_email()
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    routes = route_manager.snapshot().routes
+    logger.info(f"ROUTE_EXPORT - User: {email} | Routes: {len(routes)}")
+
+    def generate():
+        for route in routes:
+            config = {k: v for k, v in route.items() if k not in HEALTH_FIELDS}
+            yield json.dumps(config, separators=(',', ':')) + '\n'
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=routes.ndjson'
+    return response
+
+
+@app.route('/api/routes/import', methods=['POST'])
+@limiter.limit("10 per hour")
+def api_import_routes():
+    """Import routes from NDJSON (one route per line) in a single batch
+
+    Lines whose path already exists update that route; all others create
+    new routes.
+    """
+    email = get_user_email()
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    operations = []
+    for line_number, line in enumerate(request.stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if len(operations) >= BATCH_MAX_OPERATIONS:
+            return jsonify({'error': f'At most {BATCH_MAX_OPERATIONS} routes per import'}), 400
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            return jsonify({'error': f'Line {line_number} is not valid JSON'}), 400
+        if not isinstance(fields, dict):
+            return jsonify({'error': f'Line {line_number} must be a JSON object'}), 400
+
+        fields = {k: v for k, v in fields.items() if k not in ('id', 'created_at', 'updated_at')}
+        existing = route_manager.get_route_by_path(str(fields.get('path') or ''))
+        if existing:
+            operations.append({'op': 'update', 'id': existing['id'], 'changes': fields})
+        else:
+            operations.append({'op': 'create', 'route': fields})
+
+    return apply_route_batch(operations, email)
+
+
 @app.route('/api/routes/<route_id>', methods=['GET'])
 @limiter.limit("100 per hour")
 def api_get_route(route_id):
@@ -369,12 +720,21 @@ def api_get_route(route_id):
     if not is_authorized():
         return jsonify({'error': 'Unauthorized'}), 403
     
+    etag = route_manager.route_etag(route_id)
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
     route = route_manager.get_route_by_id(route_id)
     
     if not route:
         return jsonify({'error': 'Route not found'}), 404
     
-    return jsonify(route)
+    response = jsonify(route)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
 
 
 @app.route('/api/routes/<route_id>', methods=['PUT'])
@@ -428,25 +788,38 @@ def api_update_route(route_id):
         if 'health_check' in data:
             updates['health_check'] = parse_bool(data['health_check'])
 
+        # Upstreams, balancing and transport options are validated by the route manager
+        for field in LOAD_BALANCING_FIELDS + TRANSPORT_FIELDS:
+            if field in data:
+                updates[field] = data[field]
+
         if not updates:
             return jsonify({'error': 'No valid fields provided'}), 400
 
-        success = route_manager.update_route(route_id, updates)
+        success = route_manager.update_route(route_id, updates, if_match=if_match_tags())
         
         if success:
             logger.info(f"ROUTE_UPDATE - User: {email} | Route: {route_id} | Changes: {list(updates.keys())}")
             
             # After DB change, resync Caddy
-            try:
-                routes = route_manager.get_all_routes()
-                caddy_mgr.sync(routes)
-            except Exception as e:
-                logger.exception("CADDY_SYNC after update failed: %s", e)
+            caddy_sync.request('update')
             
-            return jsonify({'success': True, 'route': route_manager.get_route_by_id(route_id)})
+            body = {'success': True, 'route': route_manager.get_route_by_id(route_id)}
+            if 'path' in updates:
+                warnings = route_manager.mount_warnings(updates['path'], route_id)
+                if warnings:
+                    body['warnings'] = warnings
+            response = jsonify(body)
+            etag = route_manager.route_etag(route_id)
+            if etag is not None:  # the route may have been deleted meanwhile
+                response.set_etag(etag)
+            return response
         else:
             return jsonify({'error': 'Route not found'}), 404
     
+    except RouteConflictError as e:
+        return jsonify({'error': str(e)}), 412
+
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     
@@ -464,17 +837,16 @@ def api_delete_route(route_id):
     if not is_authorized():
         return jsonify({'error': 'Unauthorized'}), 403
     
-    success = route_manager.delete_route(route_id)
+    try:
+        success = route_manager.delete_route(route_id, if_match=if_match_tags())
+    except RouteConflictError as e:
+        return jsonify({'error': str(e)}), 412
     
     if success:
         logger.info(f"ROUTE_DELETE - User: {email} | Route: {route_id}")
         
         # After DB change, resync Caddy
-        try:
-            routes = route_manager.get_all_routes()
-            caddy_mgr.sync(routes)
-        except Exception as e:
-            logger.exception("CADDY_SYNC after delete failed: %s", e)
+        caddy_sync.request('delete')
         
         return jsonify({'success': True})
     else:
@@ -497,10 +869,15 @@ def api_test_route(route_id):
     result = caddy_mgr.test_connection(route)
     
     # Update route status in database
-    if result.get('success'):
-        route_manager.update_route_status(route_id, result['status'])
-    else:
-        route_manager.update_route_status(route_id, result.get('status', 'error'))
+    route_manager.update_route_status(
+        route_id,
+        status=result.get('status', 'error'),
+        state=result.get('state'),
+        reason=result.get('reason'),
+        http_status=result.get('status_code'),
+        duration_ms=result.get('response_time'),
+        last_error=result.get('error') or result.get('detail')
+    )
     
     logger.info(f"ROUTE_TEST - User: {email} | Route: {route_id} | Result: {result.get('status', 'error')}")
     
@@ -522,18 +899,21 @@ def api_toggle_route(route_id):
         return jsonify({'error': 'Route not found'}), 404
     
     new_enabled = not route.get('enabled', True)
-    route_manager.update_route(route_id, {'enabled': new_enabled})
+    try:
+        route_manager.update_route(route_id, {'enabled': new_enabled}, if_match=if_match_tags())
+    except RouteConflictError as e:
+        return jsonify({'error': str(e)}), 412
     
     logger.info(f"ROUTE_TOGGLE - User: {email} | Route: {route_id} | Enabled: {new_enabled}")
     
     # After DB change, resync Caddy
-    try:
-        routes = route_manager.get_all_routes()
-        caddy_mgr.sync(routes)
-    except Exception as e:
-        logger.exception("CADDY_SYNC after toggle failed: %s", e)
+    caddy_sync.request('toggle')
     
-    return jsonify({'success': True, 'enabled': new_enabled})
+    response = jsonify({'success': True, 'enabled': new_enabled})
+    etag = route_manager.route_etag(route_id)
+    if etag is not None:  # the route may have been deleted meanwhile
+        response.set_etag(etag)
+    return response
 
 
 # ============================================================================
@@ -756,14 +1136,8 @@ def api_check_route_status(route_path):
     if not route_path.startswith('/'):
         route_path = '/' + route_path
     
-    # Check if this route exists and is enabled
-    routes = route_manager.get_all_routes()
-    matching_route = None
-    
-    for route in routes:
-        if route['path'] == route_path or route['path'].rstrip('/') == route_path.rstrip('/'):
-            matching_route = route
-            break
+    # Find the route mounted at (or above) this path
+    matching_route = route_manager.match_route(route_path)
     
     if matching_route:
         enabled = matching_route.get('enabled', True)
@@ -797,14 +1171,8 @@ def check_route_status(route_path):
     if not route_path.startswith('/'):
         route_path = '/' + route_path
     
-    # Check if this route exists in our database
-    routes = route_manager.get_all_routes()
-    matching_route = None
-    
-    for route in routes:
-        if route['path'] == route_path or route['path'].rstrip('/') == route_path.rstrip('/'):
-            matching_route = route
-            break
+    # Check if this path belongs to a route in our database
+    matching_route = route_manager.match_route(route_path)
     
     if matching_route:
         # Check if route is disabled
@@ -865,9 +1233,14 @@ def health_check_worker(stop_event: threading.Event, interval: int):
     while not stop_event.is_set():
         try:
             routes = route_manager.get_all_routes()
+            # In caddy mode Caddy probes the upstreams; one admin call reads its verdicts
+            upstreams = caddy_mgr.upstream_health() if settings.health_check_mode == 'caddy' else None
             for route in routes:
                 if route.get('health_check', False) and route.get('enabled', True):
-                    result = caddy_mgr.test_connection(route)
+                    result = caddy_mgr.classify_upstreams(route, upstreams) if upstreams is not None else None
+                    if result is None:
+                        # Caddy has no verdict (no failures, unknown route): probe it ourselves
+                        result = caddy_mgr.test_connection(route)
                     
                     # Update with new enhanced status fields
                     route_manager.update_route_status(
@@ -880,6 +1253,9 @@ def health_check_worker(stop_event: threading.Event, interval: int):
                         last_error=result.get('error') or result.get('detail')
                     )
 
+            # Group-commit the whole sweep in one write
+            route_manager.flush_status()
+
             logger.info(f"HEALTH_CHECK - Checked {len(routes)} routes")
 
         except Exception as e:
@@ -915,24 +1291,78 @@ def start_health_check_worker():
         health_thread.start()
 
 
+# ============================================================================
+# ROUTE FILE WATCHER
+# ============================================================================
+
+route_watch_stop_event = threading.Event()
+route_watch_thread = None
+
+
+def route_watch_worker(stop_event: threading.Event, interval: int):
+    """Reload routes edited on disk (e.g. a restored routes.json) and resync Caddy"""
+    watcher = FileWatcher(route_manager.storage.watch_paths())
+    logger.info(f"ROUTE_WATCH - Watching {', '.join(str(p) for p in watcher.paths)} every {interval}s")
+
+    while not stop_event.wait(interval):
+        try:
+            # Changes are only reported once the files stop changing
+            if not watcher.poll():
+                continue
+
+            changes = route_manager.reload()
+            if not changes:
+                continue  # our own write, or nothing that affects routes
+
+            counts = collections.Counter(op for _, op in changes)
+            logger.info("ROUTES_RELOADED - Changed on disk | " + ' | '.join(f"{k}: {v}" for k, v in sorted(counts.items())))
+
+            caddy_sync.request('reload')
+        except Exception as e:
+            logger.error(f"ROUTE_WATCH_ERROR - {str(e)}")
+
+
+def start_route_watch_worker():
+    """Start the route file watcher if enabled."""
+    global route_watch_thread
+
+    interval = settings.routes_watch_interval
+    if interval <= 0:
+        logger.info("ROUTE_WATCH - Watcher disabled by configuration")
+        return
+
+    if route_watch_thread and route_watch_thread.is_alive():
+        return
+
+    route_watch_stop_event.clear()
+    route_watch_thread = threading.Thread(
+        target=route_watch_worker,
+        args=(route_watch_stop_event, interval),
+        daemon=True
+    )
+    route_watch_thread.start()
+
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
 if __name__ == '__main__':
+    # Docker stops containers with SIGTERM; exit cleanly so atexit handlers run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     port = int(os.environ.get('PORT', 8000))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
     if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
         start_health_check_worker()
+        start_route_watch_worker()
+        if settings.caddy_metrics_interval > 0:
+            caddy_metrics.start()
         
-        # Sync routes to Caddy on startup
-        try:
-            routes = route_manager.get_all_routes()
-            caddy_mgr.sync(routes)
-            logger.info("CADDY_SYNC: completed on startup")
-        except Exception as e:
-            logger.exception("CADDY_SYNC on startup failed: %s", e)
+        # Sync routes to Caddy on startup; retried in the background until Caddy is reachable
+        caddy_sync.start()
+        caddy_sync.request('startup')
 
     logger.info(f"Starting Shark-no-Ninsho-Mon on port {port}")
     logger.info(f"Authorized emails: {len(AUTHORIZED_EMAILS)}")
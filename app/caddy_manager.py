@@ -4,20 +4,229 @@ Caddy Manager - Syncs route configuration to Caddy Admin API
 
 import os
 import json
+import hashlib
 import logging
 import time
 import socket
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+import re
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, List, Dict, Any, NamedTuple, Optional, Tuple
 from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
 
 log = logging.getLogger(__name__)
 
+ROUTES_CONFIG_PATH = "/config/apps/http/servers/srv0/routes"
+
+# Admin calls are serialized by the sync worker; a few spare connections
+# cover the drift check and inline syncs
+ADMIN_POOL_SIZE = 4
+ADMIN_TIMEOUT = 10
+
+# Collapse per-route ids and array indexes so admin call stats stay bounded
+_ADMIN_PATH_IDS = re.compile(r"(/id)/[^/]+|/\d+(?=/|$)")
+
+# Caddy @id of the catch-all Flask portal route (always last)
+PORTAL_ROUTE_ID = "flask-portal"
+
+# Route fields that feed into the generated Caddy fragment
+FRAGMENT_FIELDS = (
+    "id",
+    "path",
+    "name",
+    "enabled",
+    "target_ip",
+    "target_port",
+    "protocol",
+    "preserve_host",
+    "no_upstream_compression",
+    "force_content_encoding",
+    "sni",
+    "insecure_skip_verify",
+    "upstreams",
+    "lb_policy",
+    "lb_try_duration",
+    "lb_retries",
+    "fail_duration",
+    "max_fails",
+    "health_check",
+    "timeout",
+    "target_path",
+    "dial_timeout",
+    "response_header_timeout",
+    "keepalive",
+    "keepalive_idle_conns_per_host",
+    "max_conns_per_host",
+    "upstream_http_version",
+    "max_request_body_mb",
+    "websocket",
+)
+
+# Route lb_policy -> Caddy reverse_proxy selection policy
+LB_SELECTION_POLICIES = {
+    "round_robin": "round_robin",
+    "least_conn": "least_conn",
+    "weighted": "weighted_round_robin",
+    "ip_hash": "ip_hash",
+}
+
+# Route upstream_http_version -> Caddy http transport versions, per upstream protocol
+UPSTREAM_HTTP_VERSIONS = {
+    ("1.1", "http"): ["1.1"],
+    ("1.1", "https"): ["1.1"],
+    ("2", "http"): ["h2c", "2"],
+    ("2", "https"): ["2"],
+}
+
+
+# Caddy's HTTP metrics (apps.http.metrics) as exposed on the admin /metrics endpoint
+METRICS_PATH = "/metrics"
+METRICS_CONFIG_PATH = "/config/apps/http/metrics"
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+_METRIC_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)(?:\s+-?\d+)?$")
+_METRIC_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+_LABEL_ESCAPES = {"\\\\": "\\", '\\"': '"', "\\n": "\n"}
+
+
+class MetricSample(NamedTuple):
+    name: str
+    labels: Dict[str, str]
+    value: float
+
+
+def parse_prometheus_text(text: str) -> List[MetricSample]:
+    """Parse the Prometheus text exposition format; comments and bad lines are skipped."""
+    samples: List[MetricSample] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        m = _METRIC_LINE.match(line)
+        if not m:
+            continue
+        try:
+            value = float(m.group(3))
+        except ValueError:
+            continue
+        labels = {
+            key: re.sub(r"\\.", lambda e: _LABEL_ESCAPES.get(e.group(0), e.group(0)), raw)
+            for key, raw in _METRIC_LABEL.findall(m.group(2) or "")
+        }
+        samples.append(MetricSample(m.group(1), labels, value))
+    return samples
+
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """Estimate a quantile from cumulative (upper bound, count) buckets, as PromQL does."""
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for upper, count in buckets:
+        if count >= rank:
+            if upper == float("inf"):
+                return lower  # beyond the largest finite bucket
+            if count == below:
+                return upper
+            return lower + (upper - lower) * (rank - below) / (count - below)
+        lower, below = upper, count
+    return lower
+
+
+class CaddyConfigError(ValueError):
+    """Raised when a generated routes array fails validation and is not pushed."""
+
+
+class AppliedConfig(NamedTuple):
+    """A routes array Caddy accepted, kept for rollback."""
+
+    fingerprint: str
+    routes: List[dict]
+    deployed: List[Tuple[Optional[str], str]]
+    applied_at: str
+    mode: str
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    """urllib3 connection that talks HTTP over a Unix domain socket."""
+
+    def __init__(self, *args, socket_path: str, **kwargs):
+        self.socket_path = socket_path
+        super().__init__(*args, **kwargs)
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """
+    Transport adapter sending every request of a session to one Unix socket,
+    e.g. Caddy's admin endpoint configured as `unix//run/caddy/admin.sock`.
+    """
+
+    def __init__(self, socket_path: str, pool_maxsize: int = ADMIN_POOL_SIZE, **kwargs):
+        self.socket_path = socket_path
+        super().__init__(pool_connections=1, pool_maxsize=pool_maxsize, **kwargs)
+        self._unix_pool = HTTPConnectionPool(
+            "localhost",
+            maxsize=pool_maxsize,
+            block=False,
+        )
+        self._unix_pool.ConnectionCls = _UnixHTTPConnection
+        self._unix_pool.conn_kw["socket_path"] = socket_path
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._unix_pool
+
+    def get_connection(self, url, proxies=None):
+        return self._unix_pool
+
+    def close(self):
+        super().close()
+        self._unix_pool.close()
+
+
+def parse_admin_address(admin_url: str) -> Tuple[str, Optional[str]]:
+    """
+    Split a Caddy admin address into (HTTP base URL, Unix socket path).
+
+    Accepts Caddy's own `unix//path/to/admin.sock` notation as well as
+    `unix:///path/to/admin.sock`; anything else is used as an HTTP URL.
+    """
+    for prefix in ("unix://", "unix/"):
+        if admin_url.startswith(prefix):
+            socket_path = admin_url[len(prefix):]
+            if not socket_path.startswith("/"):
+                socket_path = "/" + socket_path
+            return "http://localhost", socket_path
+    return admin_url.rstrip("/"), None
+
 
 class CaddyManager:
     """
     Pushes a computed Caddy JSON config to the Admin API.
     We build the full desired config from your route DB and update /config/apps/http/servers/srv0/routes.
+
+    Every generated route carries a stable @id, so once a full sync has gone through,
+    later syncs only send targeted /id/<@id> calls for the routes that changed.
+
+    Admin calls go through one keep-alive session, over TCP or over Caddy's Unix
+    admin socket (CADDY_ADMIN=unix//run/caddy/admin.sock), and are timed per call.
     """
 
     def __init__(
@@ -25,14 +234,65 @@ class CaddyManager:
         admin_url: Optional[str] = None,
         listen_port: int = 8080,
         flask_upstream: str = "app:8000",
+        history_size: int = 5,
+        metrics: bool = False,
+        stream_close_delay: int = 300,
+        active_health: bool = False,
+        health_interval: int = 30,
+        health_timeout: int = 5,
+        health_expect_status: int = 0,
     ):
         self.admin_url = admin_url or os.getenv("CADDY_ADMIN", "http://caddy:2019")
         self.listen_port = int(os.getenv("EDGE_PORT", listen_port))
         self.flask_upstream = flask_upstream
 
+        # Ask Caddy to collect HTTP metrics (CADDY_METRICS_INTERVAL > 0)
+        self.metrics = metrics
+
+        # Seconds streaming connections survive a config reload (websocket routes)
+        self.stream_close_delay = max(0, int(stream_close_delay))
+
+        # Active health checks run by Caddy itself (HEALTH_CHECK_MODE=caddy)
+        self.active_health = active_health
+        self.health_interval = max(1, int(health_interval))
+        self.health_timeout = max(1, int(health_timeout))
+        self.health_expect_status = int(health_expect_status or 0)
+
+        # Persistent admin API session (connection reuse instead of a TCP handshake per call)
+        self.admin_base, self.admin_socket = parse_admin_address(self.admin_url)
+        self.session = requests.Session()
+        if self.admin_socket:
+            self.session.trust_env = False  # never route the local socket through a proxy
+            self.session.mount(f"{self.admin_base}/", UnixSocketAdapter(self.admin_socket))
+        else:
+            self.session.mount(
+                f"{self.admin_base}/",
+                HTTPAdapter(pool_connections=1, pool_maxsize=ADMIN_POOL_SIZE),
+            )
+        self._call_stats: Dict[str, Dict[str, Any]] = {}
+        self._stats_lock = threading.Lock()
+
+        # Memoized route fragments keyed by content hash
+        self._fragments: Dict[str, dict] = {}
+        # (@id, hash) of the routes array as last pushed; None forces a full sync
+        self._deployed: Optional[List[Tuple[Optional[str], str]]] = None
+        # Fingerprint of the routes array Caddy is known to run
+        self._fingerprint: Optional[str] = None
+        # Last applied routes arrays, newest last; the rollback target on failure
+        self._history: Deque[AppliedConfig] = deque(maxlen=max(1, history_size))
+
     def sync(self, routes: List[Dict[str, Any]]) -> dict:
         """
-        Build a full config and replace the routes array in Caddy.
+        Bring Caddy's routes array in line with `routes`.
+
+        Nothing is sent when the built config matches the last applied one. The
+        first sync (and any sync after a failed one) replaces the whole array unless
+        Caddy already runs the same config; after that only routes whose fragment
+        changed are sent, addressed by @id.
+
+        The routes array is validated before anything is sent, and every push is
+        a single atomic admin call. If applying fails, the last good config is
+        restored and the error re-raised.
 
         routes: list of dicts like:
           {
@@ -48,11 +308,305 @@ class CaddyManager:
             "enabled": true
           }
         """
-        cfg = self._build_config(routes)
+        desired = self._desired_routes(routes)
+        routes_array = [fragment for _, _, fragment in desired]
+        self.validate_routes(routes_array)
+        fingerprint = self.fingerprint(routes_array)
+
+        if self._deployed is not None and fingerprint == self._fingerprint:
+            log.info("CADDY_SYNC config unchanged (%s), nothing to push", fingerprint[:12])
+            return {"ok": True, "mode": "noop", "fingerprint": fingerprint}
+
+        if self._deployed is None and self.live_fingerprint() == fingerprint:
+            # e.g. after our own restart: Caddy already runs exactly this config
+            self._mark_applied(desired, fingerprint, "adopted")
+            log.info("CADDY_SYNC Caddy already up to date (%s)", fingerprint[:12])
+            return {"ok": True, "mode": "noop", "fingerprint": fingerprint}
+
+        ops = self._plan_incremental(desired)
+        if ops is not None:
+            if self._apply_incremental(ops):
+                self._mark_applied(desired, fingerprint, "incremental")
+                log.info("CADDY_SYNC completed with %d targeted call(s)", len(ops))
+                return {"ok": True, "mode": "incremental", "operations": len(ops), "fingerprint": fingerprint}
+            log.warning("CADDY_SYNC targeted update failed, falling back to full sync")
+
+        self.invalidate()
+        try:
+            self._replace_routes(routes_array)
+        except Exception:
+            self._rollback()
+            raise
+        self._mark_applied(desired, fingerprint, "full")
+        return {"ok": True, "mode": "full", "fingerprint": fingerprint}
+
+    @property
+    def applied_fingerprint(self) -> Optional[str]:
+        """Fingerprint of the routes array last pushed to (or found in) Caddy."""
+        return self._fingerprint
+
+    def fingerprint(self, routes_array: List[dict]) -> str:
+        """Content hash of a Caddy routes array, as built by _build_config."""
+        return self._digest(routes_array)
+
+    def fetch_routes(self) -> List[dict]:
+        """GET the routes array Caddy is currently running."""
+        r = self.admin_request("GET", ROUTES_CONFIG_PATH)
+        if r.status_code in (400, 404):
+            return []  # no srv0 routes at all, e.g. Caddy started without --resume
+        r.raise_for_status()
+        return r.json() or []
+
+    def live_fingerprint(self) -> Optional[str]:
+        """Fingerprint of Caddy's live routes, or None when Caddy can't be read."""
+        try:
+            return self.fingerprint(self.fetch_routes())
+        except (requests.RequestException, ValueError) as e:
+            log.debug("CADDY_SYNC could not read live routes: %s", e)
+            return None
+
+    def check_drift(self) -> Optional[bool]:
+        """
+        Compare Caddy's live routes with the last applied config.
+
+        Returns True when they differ (the baseline is dropped, so the next sync
+        pushes the full array), False when they match, None when unknown.
+        """
+        if self._fingerprint is None:
+            return None
+        live = self.live_fingerprint()
+        if live is None:
+            return None
+        if live == self._fingerprint:
+            return False
+        log.warning(
+            "CADDY_DRIFT live routes %s differ from applied config %s",
+            live[:12],
+            self._fingerprint[:12],
+        )
+        self.invalidate()
+        return True
 
-        # Extract just the routes array
-        routes_array = cfg["apps"]["http"]["servers"]["srv0"]["routes"]
-        url = f"{self.admin_url}/config/apps/http/servers/srv0/routes"
+    def invalidate(self) -> None:
+        """Forget what Caddy holds so the next sync pushes the full routes array."""
+        self._deployed = None
+        self._fingerprint = None
+
+    def _mark_applied(self, desired: List[Tuple[Optional[str], str, dict]], fingerprint: str, mode: str) -> None:
+        self._deployed = [(caddy_id, digest) for caddy_id, digest, _ in desired]
+        self._fingerprint = fingerprint
+        if not self._history or self._history[-1].fingerprint != fingerprint:
+            self._history.append(
+                AppliedConfig(
+                    fingerprint=fingerprint,
+                    routes=[fragment for _, _, fragment in desired],
+                    deployed=self._deployed,
+                    applied_at=datetime.now().isoformat(),
+                    mode=mode,
+                )
+            )
+
+    def history(self) -> List[dict]:
+        """Summary of the configs kept for rollback, newest first."""
+        return [
+            {
+                "fingerprint": entry.fingerprint,
+                "applied_at": entry.applied_at,
+                "mode": entry.mode,
+                "routes": len(entry.routes),
+            }
+            for entry in reversed(self._history)
+        ]
+
+    def _rollback(self) -> bool:
+        """
+        Put the last good routes array back after a failed apply. Returns True
+        when Caddy runs it again (it usually still does: Caddy rejects a bad
+        load as a whole, but a partly applied targeted update may have landed).
+        """
+        if not self._history:
+            log.error("CADDY_ROLLBACK no previously applied config to restore")
+            return False
+
+        good = self._history[-1]
+        if self.live_fingerprint() != good.fingerprint:
+            try:
+                self._replace_routes(good.routes)
+            except Exception as e:
+                log.error("CADDY_ROLLBACK to %s failed: %s", good.fingerprint[:12], e)
+                return False
+            log.warning("CADDY_ROLLBACK restored config %s from %s", good.fingerprint[:12], good.applied_at)
+        else:
+            log.info("CADDY_ROLLBACK Caddy still runs last good config %s", good.fingerprint[:12])
+
+        self._deployed = good.deployed
+        self._fingerprint = good.fingerprint
+        return True
+
+    @staticmethod
+    def validate_routes(routes_array: List[dict]) -> None:
+        """
+        Sanity-check a generated routes array before it goes anywhere near Caddy.
+        Raises CaddyConfigError listing every problem found.
+        """
+        problems: List[str] = []
+        seen_ids = set()
+
+        if not routes_array or routes_array[-1].get("@id") != PORTAL_ROUTE_ID:
+            problems.append("the Flask portal route must be last")
+
+        for index, route in enumerate(routes_array):
+            label = route.get("@id") or f"#{index}"
+            caddy_id = route.get("@id")
+            if caddy_id is not None:
+                if caddy_id in seen_ids:
+                    problems.append(f"{label}: duplicate @id")
+                seen_ids.add(caddy_id)
+
+            for match in route.get("match") or []:
+                for path in match.get("path") or []:
+                    if not isinstance(path, str) or not path.startswith("/"):
+                        problems.append(f"{label}: invalid match path {path!r}")
+
+            handlers = route.get("handle")
+            if not handlers:
+                problems.append(f"{label}: no handlers")
+                continue
+            for handler in handlers:
+                if handler.get("handler") != "reverse_proxy":
+                    continue
+                upstreams = handler.get("upstreams") or []
+                if not upstreams:
+                    problems.append(f"{label}: reverse_proxy without upstreams")
+                for upstream in upstreams:
+                    host, _, port = str(upstream.get("dial", "")).rpartition(":")
+                    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+                        problems.append(f"{label}: invalid upstream {upstream.get('dial')!r}")
+
+        try:
+            json.dumps(routes_array)
+        except (TypeError, ValueError) as e:
+            problems.append(f"not JSON serializable: {e}")
+
+        if problems:
+            raise CaddyConfigError("Invalid Caddy routes: " + "; ".join(problems))
+
+    def admin_request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send one admin API call over the pooled session and record its timing."""
+        kwargs.setdefault("timeout", ADMIN_TIMEOUT)
+        key = f"{method} {_ADMIN_PATH_IDS.sub(lambda m: (m.group(1) or '') + '/*', path)}"
+        start = time.perf_counter()
+        status = None
+        try:
+            response = self.session.request(method, f"{self.admin_base}{path}", **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record_call(key, elapsed_ms, status)
+            log.debug("CADDY_ADMIN %s %s -> %s in %.1f ms", method, path, status, elapsed_ms)
+
+    def _record_call(self, key: str, elapsed_ms: float, status: Optional[int]) -> None:
+        with self._stats_lock:
+            stats = self._call_stats.setdefault(
+                key, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+            )
+            stats["count"] += 1
+            if status is None or status >= 400:
+                stats["errors"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["last_ms"] = elapsed_ms
+
+    def admin_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-call timing of admin API requests, keyed by method and path pattern."""
+        with self._stats_lock:
+            return {
+                key: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 2),
+                    "max_ms": round(stats["max_ms"], 2),
+                    "last_ms": round(stats["last_ms"], 2),
+                }
+                for key, stats in sorted(self._call_stats.items())
+            }
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _plan_incremental(self, desired: List[Tuple[Optional[str], str, dict]]) -> Optional[List[Tuple[str, str, Optional[dict]]]]:
+        """
+        Diff the desired routes against what was last pushed.
+
+        Returns (method, admin path, body) calls, or None when a full sync is needed:
+        nothing pushed yet, a route without an id, or surviving routes that
+        changed their relative order (a path edit that moves it in the
+        longest-first ordering).
+        """
+        if self._deployed is None or any(caddy_id is None for caddy_id, _, _ in desired):
+            return None
+
+        deployed = dict(self._deployed)
+        wanted = {caddy_id for caddy_id, _, _ in desired}
+
+        kept = [caddy_id for caddy_id, _ in self._deployed if caddy_id in wanted]
+        if kept != [caddy_id for caddy_id, _, _ in desired if caddy_id in deployed]:
+            return None
+
+        # Deletions first, then inserts in ascending final position, so each
+        # index is valid against the array as it stands at that point.
+        ops: List[Tuple[str, str, Optional[dict]]] = [
+            ("DELETE", f"/id/{caddy_id}", None)
+            for caddy_id, _ in self._deployed
+            if caddy_id not in wanted
+        ]
+        for index, (caddy_id, digest, fragment) in enumerate(desired):
+            if caddy_id not in deployed:
+                ops.append(("PUT", f"{ROUTES_CONFIG_PATH}/{index}", fragment))
+            elif deployed[caddy_id] != digest:
+                ops.append(("PATCH", f"/id/{caddy_id}", fragment))
+
+        # A full replace is one call; don't trade it for a flood of small ones
+        if len(ops) >= len(desired):
+            return None
+        return ops
+
+    def _apply_incremental(self, ops: List[Tuple[str, str, Optional[dict]]]) -> bool:
+        """
+        Send targeted admin calls. Returns False on the first failure; Caddy's
+        state is then unknown (e.g. it restarted, or another worker synced)
+        and the caller replaces the whole array.
+        """
+        headers = {"Content-Type": "application/json"}
+        for method, path, body in ops:
+            log.info("CADDY_SYNC %s %s", method, path)
+            try:
+                r = self.admin_request(method, path, json=body, headers=headers)
+            except requests.RequestException as e:
+                log.warning("CADDY_SYNC %s %s error: %s", method, path, e)
+                return False
+            if not r.ok:
+                log.warning(
+                    "CADDY_SYNC %s %s failed (%s): %s",
+                    method,
+                    path,
+                    r.status_code,
+                    r.text[:400],
+                )
+                return False
+        return True
+
+    def _replace_routes(self, routes_array: List[dict]) -> None:
+        """
+        Atomically replace the whole srv0 routes array in Caddy.
+
+        Caddy applies each admin change as a complete config reload and keeps the
+        running config when that fails, so a single PATCH either fully lands or
+        changes nothing. When the routes key does not exist yet (e.g. Caddy started
+        without --resume), the array is installed with one POST /load of the running
+        config instead; there is never a moment without routes.
+        """
         log.info(
             "CADDY_SYNC replacing %d backend routes + 1 flask route",
             max(0, len(routes_array) - 1),
@@ -61,67 +615,123 @@ class CaddyManager:
 
         headers = {"Content-Type": "application/json"}
 
-        # Strategy:
-        # 1) Try PATCH with the full array (works on modern Caddy)
-        # 2) If that fails (409/4xx), DELETE the key then PUT to recreate it
-        r = requests.patch(url, json=routes_array, headers=headers, timeout=10)
+        r = self.admin_request("PATCH", ROUTES_CONFIG_PATH, json=routes_array, headers=headers)
         if not r.ok:
             log.warning(
-                "CADDY_SYNC PATCH failed (%s). Falling back to DELETE+PUT. Body: %s",
+                "CADDY_SYNC PATCH failed (%s). Loading the full config instead. Body: %s",
                 r.status_code,
                 r.text[:400],
             )
-            # Best-effort delete of the existing routes key
-            try:
-                d = requests.delete(url, timeout=10)
-                log.info("CADDY_SYNC DELETE routes -> %s", d.status_code)
-            except Exception as e:
-                log.warning("CADDY_SYNC DELETE error: %s", e)
-
-            r = requests.put(url, json=routes_array, headers=headers, timeout=10)
+            r = self._load_with_routes(routes_array)
 
         if not r.ok:
             log.error("CADDY_SYNC final attempt failed: %s - %s", r.status_code, r.text)
         r.raise_for_status()
         log.info("CADDY_SYNC completed successfully")
-        return {"ok": True}
+
+    def _load_with_routes(self, routes_array: List[dict]) -> requests.Response:
+        """POST /load the running config with srv0's routes replaced."""
+        current = self.admin_request("GET", "/config/")
+        current.raise_for_status()
+        config = current.json() or {}
+
+        base = self._build_config([])
+        config.setdefault("admin", base["admin"])
+        http = config.setdefault("apps", {}).setdefault("http", {})
+        if "metrics" in base["apps"]["http"]:
+            http.setdefault("metrics", base["apps"]["http"]["metrics"])
+        servers = http.setdefault("servers", {})
+        server = servers.setdefault("srv0", {})
+        for key, value in base["apps"]["http"]["servers"]["srv0"].items():
+            server.setdefault(key, value)
+        server["routes"] = routes_array
+
+        return self.admin_request("POST", "/load", json=config, headers={"Content-Type": "application/json"})
 
     def _build_config(self, routes: List[Dict[str, Any]]) -> dict:
         # Base server (root portal -> Flask UI)
         server = {
             "listen": [f":{self.listen_port}"],
             "allow_h2c": True,
-            "routes": [],
+            "routes": [fragment for _, _, fragment in self._desired_routes(routes)],
+        }
+
+        http: Dict[str, Any] = {"servers": {"srv0": server}}
+        if self.metrics:
+            http["metrics"] = {}
+
+        return {
+            "admin": {"listen": ":2019"},
+            "apps": {"http": http},
         }
 
+    def _desired_routes(self, routes: List[Dict[str, Any]]) -> List[Tuple[Optional[str], str, dict]]:
+        """
+        Ordered (caddy @id, content hash, fragment) triples for the routes array.
+        Fragments are memoized by content hash so unchanged routes are not rebuilt.
+        """
+        desired: List[Tuple[Optional[str], str, dict]] = []
+        fragments: Dict[str, dict] = {}
+
         # 1) Add backend routes FIRST (longest mount first)
-        backend_routes_added = 0
         sorted_routes = sorted(
             routes,
-            key=lambda x: len((x.get("path") or x.get("route_path") or "")),
+            key=lambda x: len(x.get("path") or ""),
             reverse=True,
         )
 
         for r in sorted_routes:
-            enabled = r.get("enabled", True)
-            mount = r.get("path") or r.get("route_path")
-
-            log.info("Processing route: path=%s, enabled=%s", mount, enabled)
-
+            mount = r.get("path")
             if not mount or not isinstance(mount, str) or not mount.startswith("/"):
                 log.warning("Skipping invalid route path: %s", mount)
                 continue
 
-            if not enabled:
-                # Add a redirect to the route-disabled page for disabled routes
-                route_name = r.get("name", "")
-                log.info("Adding disabled route redirect: %s -> /route-disabled", mount)
-                server["routes"].append(
-                    self._disabled_route_redirect(mount, route_name)
-                )
-                backend_routes_added += 1
-                continue
+            digest = self._fragment_hash(r)
+            fragment = self._fragments.get(digest)
+            if fragment is None:
+                fragment = self._route_fragment(r)
+            fragments[digest] = fragment
+            desired.append((fragment.get("@id"), digest, fragment))
+
+        log.info("Added %d backend routes to Caddy config", len(desired))
 
+        # 2) Add Flask portal route LAST (catch-all for root and static)
+        portal = self._flask_portal_route()
+        portal["@id"] = PORTAL_ROUTE_ID
+        desired.append((PORTAL_ROUTE_ID, self._digest(portal), portal))
+
+        # Only keep fragments for routes that still exist
+        self._fragments = fragments
+        return desired
+
+    @staticmethod
+    def caddy_route_id(route: Dict[str, Any]) -> Optional[str]:
+        """Stable Caddy @id for a route, derived from the route id."""
+        route_id = route.get("id")
+        return f"route-{route_id}" if route_id else None
+
+    @staticmethod
+    def _digest(content: Any) -> str:
+        payload = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _fragment_hash(self, route: Dict[str, Any]) -> str:
+        """Content hash over the route fields that shape its Caddy fragment."""
+        return self._digest({k: route.get(k) for k in FRAGMENT_FIELDS})
+
+    def _route_fragment(self, r: Dict[str, Any]) -> dict:
+        """Build the Caddy route for one (valid) route and tag it with its @id."""
+        enabled = r.get("enabled", True)
+        mount = r["path"]
+
+        log.info("Processing route: path=%s, enabled=%s", mount, enabled)
+
+        if not enabled:
+            # Add a redirect to the route-disabled page for disabled routes
+            route_name = r.get("name", "")
+            log.info("Adding disabled route redirect: %s -> /route-disabled", mount)
+            fragment = self._disabled_route_redirect(mount, route_name)
+        else:
             target_ip = r["target_ip"]
             target_port = r["target_port"]
             protocol = str(r.get("protocol", "http")).lower()
@@ -130,6 +740,11 @@ class CaddyManager:
             sni = r.get("sni")
             insecure_skip_verify = bool(r.get("insecure_skip_verify", False))
             force_content_encoding = r.get("force_content_encoding")  # "gzip" or "br" or None
+            upstreams = [
+                (f"{u['ip']}:{u['port']}", int(u.get("weight", 1)))
+                for u in r.get("upstreams") or []
+            ]
+            streaming = bool(r.get("websocket", False))
 
             log.info(
                 "Adding backend route: %s -> %s://%s:%s",
@@ -139,29 +754,37 @@ class CaddyManager:
                 target_port,
             )
 
-            server["routes"].append(
-                self._subdir_reverse_proxy_route(
-                    mount=mount,
-                    protocol=protocol,
-                    hostport=f"{target_ip}:{target_port}",
-                    preserve_host=preserve_host,
-                    no_upstream_compression=no_upstream_compression,
-                    sni=sni,
-                    insecure_skip_verify=insecure_skip_verify,
-                    force_content_encoding=force_content_encoding,
-                )
+            fragment = self._subdir_reverse_proxy_route(
+                mount=mount,
+                protocol=protocol,
+                hostport=f"{target_ip}:{target_port}",
+                preserve_host=preserve_host,
+                no_upstream_compression=no_upstream_compression,
+                sni=sni,
+                insecure_skip_verify=insecure_skip_verify,
+                force_content_encoding=force_content_encoding,
+                upstreams=upstreams or None,
+                lb_policy=r.get("lb_policy") or "round_robin",
+                lb_try_duration=int(r.get("lb_try_duration") or 0),
+                lb_retries=int(r.get("lb_retries") or 0),
+                fail_duration=int(r.get("fail_duration") or 0),
+                max_fails=int(r.get("max_fails") or 1),
+                active_health=self._active_health_check(r),
+                dial_timeout=int(r.get("dial_timeout") or 0),
+                response_header_timeout=int(r.get("response_header_timeout") or 0),
+                keepalive=bool(r.get("keepalive", True)),
+                keepalive_idle_conns_per_host=int(r.get("keepalive_idle_conns_per_host") or 0),
+                max_conns_per_host=int(r.get("max_conns_per_host") or 0),
+                http_versions=UPSTREAM_HTTP_VERSIONS.get((r.get("upstream_http_version"), protocol)),
+                max_request_body=int(r.get("max_request_body_mb") or 0) * 1024 * 1024,
+                streaming=streaming,
+                stream_close_delay=self.stream_close_delay,
             )
-            backend_routes_added += 1
 
-        log.info("Added %d backend routes to Caddy config", backend_routes_added)
-
-        # 2) Add Flask portal route LAST (catch-all for root and static)
-        server["routes"].append(self._flask_portal_route())
-
-        return {
-            "admin": {"listen": ":2019"},
-            "apps": {"http": {"servers": {"srv0": server}}},
-        }
+        caddy_id = self.caddy_route_id(r)
+        if caddy_id:
+            fragment["@id"] = caddy_id
+        return fragment
 
     def _flask_portal_route(self) -> dict:
         """
@@ -240,10 +863,31 @@ class CaddyManager:
         sni: Optional[str] = None,
         insecure_skip_verify: bool = False,
         force_content_encoding: Optional[str] = None,  # e.g. "gzip" or "br"
+        upstreams: Optional[List[Tuple[str, int]]] = None,  # (dial, weight); replaces hostport
+        lb_policy: str = "round_robin",
+        lb_try_duration: int = 0,  # seconds to keep trying other upstreams
+        lb_retries: int = 0,
+        fail_duration: int = 0,  # seconds a failed upstream stays marked down (0 = no passive health)
+        max_fails: int = 1,
+        active_health: Optional[Dict[str, Any]] = None,  # Caddy health_checks.active block
+        dial_timeout: int = 0,  # seconds; 0 = Caddy default
+        response_header_timeout: int = 0,  # seconds to wait for the upstream's response headers
+        keepalive: bool = True,
+        keepalive_idle_conns_per_host: int = 0,
+        max_conns_per_host: int = 0,  # 0 = unlimited
+        http_versions: Optional[List[str]] = None,  # transport versions, e.g. ["h2c", "2"]
+        max_request_body: int = 0,  # bytes; 0 = unlimited
+        streaming: bool = False,  # websocket / SSE / media: flush at once, survive reloads
+        stream_close_delay: int = 0,  # seconds streams are kept open after a config reload
     ) -> dict:
         """
         Build a Caddy reverse_proxy route for a subdirectory mount.
         Passes the full path to the backend - apps should be configured with Base URL.
+        With several upstreams, Caddy load-balances between them using lb_policy.
+        Timeouts and connection limits go on the http transport; a body limit
+        adds a request_body handler in front of the proxy. Streaming routes
+        flush every write to the client and keep their connections open for
+        stream_close_delay when a sync reloads Caddy's config.
         """
 
         match = {"path": [mount, f"{mount}/*"]}
@@ -276,12 +920,54 @@ class CaddyManager:
                 }
             }
 
+        dials = upstreams or [(hostport, 1)]
         handler: Dict[str, Any] = {
             "handler": "reverse_proxy",
-            "upstreams": [{"dial": hostport}],
+            "upstreams": [{"dial": dial} for dial, _ in dials],
             "headers": headers_block,
         }
 
+        if streaming:
+            # No response buffering: flush each chunk (SSE, media) as soon as it arrives
+            handler["flush_interval"] = -1
+            if stream_close_delay:
+                handler["stream_close_delay"] = f"{stream_close_delay}s"
+
+        if len(dials) > 1 or lb_try_duration or lb_retries:
+            selection: Dict[str, Any] = {"policy": LB_SELECTION_POLICIES.get(lb_policy, "round_robin")}
+            if selection["policy"] == "weighted_round_robin":
+                selection["weights"] = [weight for _, weight in dials]
+            load_balancing: Dict[str, Any] = {"selection_policy": selection}
+            if lb_try_duration:
+                load_balancing["try_duration"] = f"{lb_try_duration}s"
+            if lb_retries:
+                load_balancing["retries"] = lb_retries
+            handler["load_balancing"] = load_balancing
+
+        # Passive health: take an upstream out of rotation after failed requests
+        health_checks: Dict[str, Any] = {}
+        if fail_duration:
+            health_checks["passive"] = {"fail_duration": f"{fail_duration}s", "max_fails": max_fails}
+        # Active health: Caddy probes every upstream itself
+        if active_health:
+            health_checks["active"] = active_health
+        if health_checks:
+            handler["health_checks"] = health_checks
+
+        transport: Dict[str, Any] = {"protocol": "http"}
+        if dial_timeout:
+            transport["dial_timeout"] = f"{dial_timeout}s"
+        if response_header_timeout:
+            transport["response_header_timeout"] = f"{response_header_timeout}s"
+        if not keepalive:
+            transport["keep_alive"] = {"enabled": False}
+        elif keepalive_idle_conns_per_host:
+            transport["keep_alive"] = {"max_idle_conns_per_host": keepalive_idle_conns_per_host}
+        if max_conns_per_host:
+            transport["max_conns_per_host"] = max_conns_per_host
+        if http_versions:
+            transport["versions"] = list(http_versions)
+
         # Honor HTTPS upstreams by enabling TLS on the transport
         if protocol == "https":
             tls_cfg: Dict[str, Any] = {}
@@ -289,9 +975,109 @@ class CaddyManager:
                 tls_cfg["server_name"] = sni
             if insecure_skip_verify:
                 tls_cfg["insecure_skip_verify"] = True
-            handler["transport"] = {"protocol": "http", "tls": tls_cfg}
+            transport["tls"] = tls_cfg
+
+        if len(transport) > 1:
+            handler["transport"] = transport
+
+        handle: List[Dict[str, Any]] = [handler]
+        if max_request_body:
+            handle.insert(0, {"handler": "request_body", "max_size": max_request_body})
+
+        return {"match": [match], "handle": handle, "terminal": True}
+
+    def _active_health_check(self, r: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Caddy active health check for a route, derived from health_check and timeout."""
+        if not self.active_health or not r.get("health_check", True):
+            return None
+        uri = str(r.get("target_path") or "/")
+        if not uri.startswith("/"):
+            uri = "/" + uri
+        # Same cap as the app's own probes: min(route timeout, HTTP_TIMEOUT_SEC)
+        timeout = max(1, min(int(r.get("timeout") or 30), self.health_timeout))
+        active: Dict[str, Any] = {
+            "uri": uri,
+            "interval": f"{self.health_interval}s",
+            "timeout": f"{timeout}s",
+        }
+        if self.health_expect_status:
+            active["expect_status"] = self.health_expect_status
+        return active
+
+    def enable_metrics(self) -> bool:
+        """Turn on Caddy's HTTP metrics in the running config; True when it had to be changed."""
+        r = self.admin_request("GET", METRICS_CONFIG_PATH)
+        if r.ok and r.json() is not None:
+            return False
+        r = self.admin_request("PUT", METRICS_CONFIG_PATH, json={}, headers={"Content-Type": "application/json"})
+        if r.status_code == 409:
+            return False  # enabled concurrently
+        r.raise_for_status()
+        log.info("CADDY_METRICS enabled HTTP metrics in the running config")
+        return True
+
+    def scrape_metrics(self) -> List[MetricSample]:
+        """Fetch and parse Caddy's Prometheus metrics from the admin endpoint."""
+        r = self.admin_request("GET", METRICS_PATH)
+        r.raise_for_status()
+        return parse_prometheus_text(r.text)
+
+    def upstream_health(self) -> Dict[str, dict]:
+        """Caddy's view of every reverse_proxy upstream, keyed by dial address."""
+        r = self.admin_request("GET", "/reverse_proxy/upstreams")
+        r.raise_for_status()
+        return {u.get("address"): u for u in r.json() or []}
+
+    @staticmethod
+    def _upstream_healthy(upstream: Dict[str, Any]) -> Optional[bool]:
+        # Older Caddy versions report "healthy" directly. Otherwise only a
+        # failure counted by passive health says anything: active check
+        # results are not exposed, so zero fails is no proof of health
+        healthy = upstream.get("healthy")
+        if isinstance(healthy, bool):
+            return healthy
+        return False if upstream.get("fails") else None
+
+    def classify_upstreams(self, route: Dict[str, Any], upstreams: Dict[str, dict]) -> Optional[dict]:
+        """
+        Turn Caddy's upstream state into a route status, shaped like test_connection's result.
 
-        return {"match": [match], "handle": [handler], "terminal": True}
+        DEGRADED when some upstreams are unhealthy, DOWN when all are, UP only when
+        Caddy flags every upstream healthy. Returns None when Caddy cannot tell:
+        the route's upstreams are not known to it (yet), or nothing has failed and
+        no health flag is reported. The caller then probes the route itself.
+        """
+        dials = [f"{u['ip']}:{u['port']}" for u in route.get("upstreams") or []]
+        if not dials:
+            dials = [f"{route.get('target_ip')}:{route.get('target_port')}"]
+        known = [dial for dial in dials if dial in upstreams]
+        if not known:
+            return None
+
+        health = {dial: self._upstream_healthy(upstreams[dial]) for dial in known}
+        down = [dial for dial in known if health[dial] is False]
+        if not down and any(healthy is None for healthy in health.values()):
+            return None
+        if not down:
+            state, reason, status = "UP", "online", "online"
+            detail = f"{len(known)} upstream(s) healthy in Caddy"
+        elif len(down) < len(known):
+            state, reason, status = "DEGRADED", "partial", "slow"
+            detail = f"{len(down)}/{len(known)} upstreams unhealthy in Caddy: {', '.join(down)}"
+        else:
+            state, reason, status = "DOWN", "unhealthy", "offline"
+            detail = f"Caddy marked {', '.join(down)} unhealthy"
+
+        result = {
+            "success": state in ("UP", "DEGRADED"),
+            "status": status,  # Legacy field
+            "state": state,
+            "reason": reason,
+            "detail": detail,
+        }
+        if state == "DOWN":
+            result["error"] = detail
+        return result
 
     def classify_service_status(self, url: str, timeout_sec: int = 3, slow_ms: int = 2000) -> Tuple[str, str, Optional[str], Optional[int], Optional[int]]:
         """
@@ -421,3 +1207,382 @@ class CaddyManager:
             result["error"] = detail
 
         return result
+
+
+class CaddySyncWorker:
+    """
+    Coalesces sync requests into background syncs of the whole route set.
+
+    Every request() bumps a generation number. The worker waits until a burst
+    of requests settles (debounce, capped at max_delay), then syncs the routes
+    as they are at that point; a sync covers every generation requested before
+    it started. Syncs are serialized, and a failed one stays pending and is
+    retried with exponential backoff. Until start() is called, request() syncs
+    inline so one-off scripts and tests behave as before.
+
+    While idle, the worker also compares Caddy's live routes with the last
+    applied fingerprint every reconcile_interval seconds and re-pushes when
+    they differ (Caddy restarted without --resume, or edited by hand).
+    """
+
+    def __init__(
+        self,
+        manager: CaddyManager,
+        get_routes: Callable[[], List[Dict[str, Any]]],
+        debounce: float = 0.2,
+        max_delay: float = 2.0,
+        retry_base: float = 1.0,
+        max_backoff: float = 60.0,
+        reconcile_interval: float = 0.0,
+    ):
+        self.manager = manager
+        self.get_routes = get_routes
+        self.debounce = max(0.0, debounce)
+        self.max_delay = max(self.debounce, max_delay)
+        self.retry_base = max(0.01, retry_base)
+        self.max_backoff = max(self.retry_base, max_backoff)
+        self.reconcile_interval = max(0.0, reconcile_interval)
+
+        self._cond = threading.Condition()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._requested = 0  # generation of the latest request
+        self._applied = 0  # newest generation Caddy is known to reflect
+        self._first_pending_at: Optional[float] = None
+        self._last_request_at = 0.0
+        self._failures = 0  # consecutive failed syncs
+        self._retry_at: Optional[float] = None
+
+        self._last_success: Optional[str] = None
+        self._last_error: Optional[str] = None
+        self._last_error_at: Optional[str] = None
+        self._last_duration_ms: Optional[int] = None
+        self._last_mode: Optional[str] = None
+        self._fingerprint: Optional[str] = None
+        self._last_reconcile: Optional[str] = None
+        self._drift_count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the background worker (idempotent)."""
+        with self._cond:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._worker, name="caddy-sync", daemon=True)
+            self._thread.start()
+        log.info("CADDY_SYNC worker started (debounce %.0f ms)", self.debounce * 1000)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the worker; requests made afterwards sync inline again."""
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def request(self, reason: str = "") -> int:
+        """Mark Caddy out of date and return the generation that will fix it."""
+        with self._cond:
+            self._requested += 1
+            generation = self._requested
+            now = time.monotonic()
+            self._last_request_at = now
+            if self._first_pending_at is None:
+                self._first_pending_at = now
+            running = self.running
+            self._cond.notify()
+
+        log.debug("CADDY_SYNC requested generation %d (%s)", generation, reason or "unspecified")
+        if not running:
+            self._run_sync()
+        return generation
+
+    def status(self) -> dict:
+        """Snapshot of the sync state for the status endpoint."""
+        with self._cond:
+            retry_in = None
+            if self._retry_at is not None and self._requested > self._applied:
+                retry_in = round(max(0.0, self._retry_at - time.monotonic()), 3)
+            return {
+                "running": self.running,
+                "pending": self._requested > self._applied,
+                "requested_generation": self._requested,
+                "applied_generation": self._applied,
+                "failures": self._failures,
+                "retry_in": retry_in,
+                "last_success": self._last_success,
+                "last_error": self._last_error,
+                "last_error_at": self._last_error_at,
+                "last_duration_ms": self._last_duration_ms,
+                "last_mode": self._last_mode,
+                "fingerprint": self._fingerprint,
+                "last_reconcile": self._last_reconcile,
+                "drift_detected": self._drift_count,
+            }
+
+    def _run_sync(self) -> bool:
+        """Sync the current routes once; True when Caddy is up to date."""
+        with self._sync_lock:
+            with self._cond:
+                generation = self._requested
+                if generation <= self._applied:
+                    return True
+
+            start = time.perf_counter()
+            try:
+                result = self.manager.sync(self.get_routes())
+            except Exception as e:
+                with self._cond:
+                    self._failures += 1
+                    backoff = min(self.max_backoff, self.retry_base * 2 ** (self._failures - 1))
+                    self._retry_at = time.monotonic() + backoff
+                    self._last_error = str(e)
+                    self._last_error_at = datetime.now().isoformat()
+                    failures = self._failures
+                log.error(
+                    "CADDY_SYNC generation %d failed (attempt %d, retry in %.1fs): %s",
+                    generation,
+                    failures,
+                    backoff,
+                    e,
+                )
+                return False
+
+            with self._cond:
+                self._applied = max(self._applied, generation)
+                if self._applied >= self._requested:
+                    self._first_pending_at = None
+                self._failures = 0
+                self._retry_at = None
+                self._last_success = datetime.now().isoformat()
+                self._last_duration_ms = int((time.perf_counter() - start) * 1000)
+                if isinstance(result, dict):
+                    self._last_mode = result.get("mode")
+                    self._fingerprint = result.get("fingerprint")
+            return True
+
+    def _reconcile(self) -> None:
+        """Re-push when Caddy's live routes no longer match what we applied."""
+        with self._sync_lock:
+            try:
+                drift = self.manager.check_drift()
+            except Exception as e:
+                log.error("CADDY_RECONCILE failed: %s", e)
+                drift = None
+            with self._cond:
+                self._last_reconcile = datetime.now().isoformat()
+                if drift:
+                    self._drift_count += 1
+        if drift:
+            self.request("drift")
+
+    def _next_sync_at(self) -> Optional[float]:
+        """Monotonic time the pending sync is due, or None when nothing is pending."""
+        if self._requested <= self._applied:
+            return None
+        due = min(self._last_request_at + self.debounce, self._first_pending_at + self.max_delay)
+        if self._retry_at is not None:
+            due = max(due, self._retry_at)
+        return due
+
+    def _worker(self) -> None:
+        interval = self.reconcile_interval
+        next_reconcile = time.monotonic() + interval if interval > 0 else None
+        while True:
+            with self._cond:
+                while not self._stop.is_set():
+                    now = time.monotonic()
+                    due = self._next_sync_at()
+                    if due is not None:
+                        if due <= now:
+                            break
+                        self._cond.wait(due - now)
+                    elif next_reconcile is None:
+                        self._cond.wait()
+                    elif next_reconcile <= now:
+                        break
+                    else:
+                        self._cond.wait(next_reconcile - now)
+                if self._stop.is_set():
+                    return
+                pending = self._next_sync_at() is not None
+
+            if pending:
+                self._run_sync()
+            else:
+                self._reconcile()
+                next_reconcile = time.monotonic() + interval
+
+
+class CaddyMetricsCollector:
+    """
+    Periodically scrapes Caddy's /metrics and turns counters into traffic rates.
+
+    Each scrape is diffed against the previous one, so every figure describes
+    real requests over the last interval: request and 5xx rate, bytes in and
+    out, and latency quantiles estimated from the duration histogram. Caddy
+    labels its HTTP metrics by server and handler, not by route, so traffic is
+    reported per (server, handler) pair; "reverse_proxy" is the proxied traffic.
+    """
+
+    def __init__(self, manager: CaddyManager, interval: float = 30.0):
+        self.manager = manager
+        self.interval = max(1.0, interval)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._enabled = False
+
+        self._previous: Optional[Tuple[float, Dict[Tuple[str, ...], float]]] = None
+        self._traffic: Dict[str, Dict[str, Any]] = {}
+        self._last_scrape: Optional[str] = None
+        self._last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the background collector (idempotent)."""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._worker, name="caddy-metrics", daemon=True)
+            self._thread.start()
+        log.info("CADDY_METRICS collector started (every %.0fs)", self.interval)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def status(self) -> dict:
+        """Latest traffic figures for the metrics endpoint."""
+        with self._lock:
+            return {
+                "running": self.running,
+                "interval": self.interval,
+                "last_scrape": self._last_scrape,
+                "last_error": self._last_error,
+                "traffic": {key: dict(row) for key, row in self._traffic.items()},
+            }
+
+    def collect(self) -> bool:
+        """Scrape once and update the traffic figures; True on success."""
+        try:
+            if not self._enabled:
+                self.manager.enable_metrics()
+                self._enabled = True
+            samples = self.manager.scrape_metrics()
+        except Exception as e:
+            self._enabled = False  # Caddy may have restarted without our config
+            with self._lock:
+                self._last_error = str(e)
+            log.error("CADDY_METRICS scrape failed: %s", e)
+            return False
+
+        now = time.monotonic()
+        counters, in_flight = self._counters(samples)
+        with self._lock:
+            previous = self._previous
+            self._previous = (now, counters)
+            if previous is not None and now > previous[0]:
+                self._traffic = self._rates(previous[1], counters, now - previous[0], in_flight)
+            self._last_scrape = datetime.now().isoformat()
+            self._last_error = None
+        return True
+
+    @staticmethod
+    def _counters(samples: List[MetricSample]) -> Tuple[Dict[Tuple[str, ...], float], Dict[str, float]]:
+        """
+        Sum the HTTP series per (server/handler, measure, detail).
+
+        Measures are "requests" and "errors" (detail = ""), "bytes_in"/"bytes_out"
+        and "latency_sum" (detail = ""), and "bucket" (detail = upper bound).
+        """
+        counters: Dict[Tuple[str, ...], float] = {}
+        in_flight: Dict[str, float] = {}
+
+        def add(key: Tuple[str, ...], value: float) -> None:
+            counters[key] = counters.get(key, 0.0) + value
+
+        for name, labels, value in samples:
+            if not name.startswith("caddy_http_"):
+                continue
+            row = f"{labels.get('server', '')}/{labels.get('handler', '')}"
+            if name == "caddy_http_request_duration_seconds_count":
+                add((row, "requests", ""), value)
+                if labels.get("code", "").startswith("5"):
+                    add((row, "errors", ""), value)
+            elif name == "caddy_http_request_duration_seconds_sum":
+                add((row, "latency_sum", ""), value)
+            elif name == "caddy_http_request_duration_seconds_bucket":
+                add((row, "bucket", labels.get("le", "+Inf")), value)
+            elif name == "caddy_http_request_size_bytes_sum":
+                add((row, "bytes_in", ""), value)
+            elif name == "caddy_http_response_size_bytes_sum":
+                add((row, "bytes_out", ""), value)
+            elif name == "caddy_http_requests_in_flight":
+                in_flight[row] = in_flight.get(row, 0.0) + value
+        return counters, in_flight
+
+    @staticmethod
+    def _rates(
+        before: Dict[Tuple[str, ...], float],
+        after: Dict[Tuple[str, ...], float],
+        elapsed: float,
+        in_flight: Dict[str, float],
+    ) -> Dict[str, Dict[str, Any]]:
+        """Per-row rates between two scrapes; a counter that went down was reset."""
+        deltas: Dict[str, Dict[str, Any]] = {}
+        for key, value in after.items():
+            row, measure, detail = key
+            old = before.get(key, 0.0)
+            delta = value - old if value >= old else value
+            entry = deltas.setdefault(row, {"buckets": []})
+            if measure == "bucket":
+                entry["buckets"].append((float(detail), delta))
+            else:
+                entry[measure] = delta
+
+        traffic: Dict[str, Dict[str, Any]] = {}
+        for row, d in sorted(deltas.items()):
+            count = d.get("requests", 0.0)
+            errors = d.get("errors", 0.0)
+            stats: Dict[str, Any] = {
+                "requests": int(count),
+                "requests_per_sec": round(count / elapsed, 3),
+                "errors_per_sec": round(errors / elapsed, 3),
+                "error_rate": round(errors / count, 4) if count else 0.0,
+                "bytes_in_per_sec": round(d.get("bytes_in", 0.0) / elapsed, 1),
+                "bytes_out_per_sec": round(d.get("bytes_out", 0.0) / elapsed, 1),
+                "in_flight": int(in_flight.get(row, 0)),
+                "latency_mean_ms": round(d.get("latency_sum", 0.0) / count * 1000, 1) if count else None,
+                "latency_histogram": [
+                    {"le": "+Inf" if le == float("inf") else le, "count": int(count)}
+                    for le, count in sorted(d["buckets"])
+                ],
+            }
+            for q in LATENCY_QUANTILES:
+                value = histogram_quantile(q, d["buckets"])
+                stats[f"latency_p{int(q * 100)}_ms"] = round(value * 1000, 1) if value is not None else None
+            traffic[row] = stats
+        return traffic
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            self.collect()
+            if self._stop.wait(self.interval):
+                return
@@ -22,12 +22,24 @@ class Settings:
 
     secret_key: str
     routes_db_path: str
+    routes_db_backend: str
+    routes_multiprocess: bool
+    routes_watch_interval: int
     emails_file: str
     health_check_enabled: bool
     health_check_interval: int
+    health_check_mode: str
+    caddy_health_expect_status: int
+    status_flush_interval: int
+    health_state_snapshot: bool
     upstream_ssl_verify: bool
     http_timeout_sec: int
     slow_threshold_ms: int
+    caddy_sync_debounce_ms: int
+    caddy_sync_max_backoff: int
+    caddy_reconcile_interval: int
+    caddy_metrics_interval: int
+    caddy_stream_close_delay: int
     # Flask session configuration
     session_cookie_secure: bool
     session_cookie_httponly: bool
@@ -47,6 +59,18 @@ def get_settings() -> Settings:
     default_routes_path = base_dir / "routes.json"
     routes_db_path = env.get("ROUTES_DB_PATH", str(default_routes_path))
 
+    routes_db_backend = env.get("ROUTES_DB_BACKEND", "tinydb").strip().lower()
+    if routes_db_backend not in {"tinydb", "sqlite", "journal"}:
+        routes_db_backend = "tinydb"
+
+    routes_multiprocess = _to_bool(env.get("ROUTES_MULTIPROCESS"), default=False)
+
+    try:
+        routes_watch_interval = int(env.get("ROUTES_WATCH_INTERVAL", 2))
+    except (TypeError, ValueError):
+        routes_watch_interval = 2
+    routes_watch_interval = max(0, routes_watch_interval)
+
     default_emails_path = root_dir / "emails.txt"
     emails_file = env.get("EMAILS_FILE", str(default_emails_path))
 
@@ -58,6 +82,25 @@ def get_settings() -> Settings:
         interval = 300
     health_check_interval = max(0, interval)
 
+    # "app" probes backends from Python, "caddy" lets Caddy probe and reads its upstream state
+    health_check_mode = env.get("HEALTH_CHECK_MODE", "app").strip().lower()
+    if health_check_mode not in {"app", "caddy"}:
+        health_check_mode = "app"
+
+    try:
+        caddy_health_expect_status = int(env.get("CADDY_HEALTH_EXPECT_STATUS", 0))
+    except (TypeError, ValueError):
+        caddy_health_expect_status = 0
+    caddy_health_expect_status = max(0, min(caddy_health_expect_status, 599))
+
+    try:
+        status_flush_interval = int(env.get("STATUS_FLUSH_INTERVAL", 30))
+    except (TypeError, ValueError):
+        status_flush_interval = 30
+    status_flush_interval = max(0, status_flush_interval)
+
+    health_state_snapshot = _to_bool(env.get("HEALTH_STATE_SNAPSHOT"), default=True)
+
     upstream_ssl_verify = _to_bool(env.get("UPSTREAM_SSL_VERIFY"), default=False)
 
     try:
@@ -72,6 +115,36 @@ def get_settings() -> Settings:
         slow_threshold_ms = 2000
     slow_threshold_ms = max(100, slow_threshold_ms)  # Minimum 100ms
 
+    try:
+        caddy_sync_debounce_ms = int(env.get("CADDY_SYNC_DEBOUNCE_MS", 200))
+    except (TypeError, ValueError):
+        caddy_sync_debounce_ms = 200
+    caddy_sync_debounce_ms = max(0, caddy_sync_debounce_ms)
+
+    try:
+        caddy_sync_max_backoff = int(env.get("CADDY_SYNC_MAX_BACKOFF", 60))
+    except (TypeError, ValueError):
+        caddy_sync_max_backoff = 60
+    caddy_sync_max_backoff = max(1, caddy_sync_max_backoff)
+
+    try:
+        caddy_reconcile_interval = int(env.get("CADDY_RECONCILE_INTERVAL", 60))
+    except (TypeError, ValueError):
+        caddy_reconcile_interval = 60
+    caddy_reconcile_interval = max(0, caddy_reconcile_interval)
+
+    try:
+        caddy_metrics_interval = int(env.get("CADDY_METRICS_INTERVAL", 30))
+    except (TypeError, ValueError):
+        caddy_metrics_interval = 30
+    caddy_metrics_interval = max(0, caddy_metrics_interval)
+
+    try:
+        caddy_stream_close_delay = int(env.get("CADDY_STREAM_CLOSE_DELAY", 300))
+    except (TypeError, ValueError):
+        caddy_stream_close_delay = 300
+    caddy_stream_close_delay = max(0, caddy_stream_close_delay)
+
     # Flask session configuration
     session_cookie_secure = _to_bool(env.get("SESSION_COOKIE_SECURE"), default=True)
     session_cookie_httponly = _to_bool(env.get("SESSION_COOKIE_HTTPONLY"), default=True)
@@ -87,12 +160,24 @@ def get_settings() -> Settings:
     return Settings(
         secret_key=secret_key,
         routes_db_path=routes_db_path,
+        routes_db_backend=routes_db_backend,
+        routes_multiprocess=routes_multiprocess,
+        routes_watch_interval=routes_watch_interval,
         emails_file=emails_file,
         health_check_enabled=health_check_enabled,
         health_check_interval=health_check_interval,
+        health_check_mode=health_check_mode,
+        caddy_health_expect_status=caddy_health_expect_status,
+        status_flush_interval=status_flush_interval,
+        health_state_snapshot=health_state_snapshot,
         upstream_ssl_verify=upstream_ssl_verify,
         http_timeout_sec=http_timeout_sec,
         slow_threshold_ms=slow_threshold_ms,
+        caddy_sync_debounce_ms=caddy_sync_debounce_ms,
+        caddy_sync_max_backoff=caddy_sync_max_backoff,
+        caddy_reconcile_interval=caddy_reconcile_interval,
+        caddy_metrics_interval=caddy_metrics_interval,
+        caddy_stream_close_delay=caddy_stream_close_delay,
         session_cookie_secure=session_cookie_secure,
         session_cookie_httponly=session_cookie_httponly,
         session_cookie_samesite=session_cookie_samesite,
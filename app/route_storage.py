@@ -0,0 +1,668 @@
+"""
+Route Storage - Persistence backends used by RouteManager
+
+RouteManager keeps the authoritative copy of the routes in memory; a backend
+only has to load every route once at startup and persist single-route
+mutations. Backends are selected with the ROUTES_DB_BACKEND setting.
+"""
+from tinydb import TinyDB, Query
+from tinydb.storages import Storage
+from tinydb.table import Table
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - snapshots fall back to compact JSON
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no cross-process locking on Windows
+    fcntl = None
+
+
+BACKENDS = ('tinydb', 'sqlite', 'journal')
+
+
+def atomic_write_text(path: Path, text: str):
+    """Replace ``path`` with ``text`` without ever exposing a partial file."""
+    atomic_write_bytes(path, text.encode('utf-8'))
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Binary variant of :func:`atomic_write_text`."""
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _path_key(path: str) -> str:
+    """Normalize a path for index lookups (trailing slashes are ignored)."""
+    return path.rstrip('/') or '/'
+
+
+class AtomicJSONStorage(Storage):
+    """TinyDB storage that replaces the JSON file atomically on every write.
+
+    The document is written to a temporary file in the same directory and
+    moved over the original with ``os.replace``, so a crash mid-write can
+    never leave a truncated ``routes.json`` behind.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__()
+        self._path = Path(path)
+        self.kwargs = kwargs
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        try:
+            raw = self._path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        if not raw.strip():
+            return None
+        return json.loads(raw)
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        atomic_write_text(self._path, json.dumps(data, **self.kwargs))
+
+    def close(self) -> None:
+        pass
+
+
+class RouteStorage(ABC):
+    """Interface every RouteManager persistence backend implements.
+
+    ``update`` receives both the complete new document and the fields that
+    changed, so each backend can persist whichever is cheaper for it. A
+    backend missing one of the abstract methods cannot be instantiated.
+    """
+
+    path: Path
+    # True when every write rewrites the whole file, so batching writes
+    # costs nothing and splitting them multiplies the I/O
+    rewrites_whole_file: bool = False
+
+    @abstractmethod
+    def load_all(self) -> List[Dict]:
+        """Every stored route document, in insertion order."""
+
+    @abstractmethod
+    def insert(self, route: Dict):
+        """Persist a new route."""
+
+    @abstractmethod
+    def update(self, route: Dict, changes: Dict):
+        """Persist a changed route."""
+
+    @abstractmethod
+    def delete(self, route_id: str):
+        """Remove a route."""
+
+    def write_batch(self, changes: List[Tuple]):
+        """Persist several changes at once.
+
+        Each change is ``('insert', route)``, ``('update', route, changes)``
+        or ``('delete', route_id)``. Backends override this to write the
+        whole batch in a single transaction.
+        """
+        for kind, *args in changes:
+            getattr(self, kind)(*args)
+
+    def reload(self):
+        """Drop any state cached from disk so changes made by another
+        process become visible to the next ``load_all``."""
+
+    def watch_paths(self) -> List[Path]:
+        """Files whose modification means the stored routes changed."""
+        return [self.path]
+
+    def close(self):
+        pass
+
+
+class TinyDBStorage(RouteStorage):
+    """Routes stored as a TinyDB JSON document (the default backend)."""
+
+    rewrites_whole_file = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        if not path.exists():
+            path.write_text('{"_default": {}}', encoding='utf-8')
+
+        self.db = TinyDB(str(path), storage=AtomicJSONStorage)
+        self.routes = self.db.table('routes')
+        self.Route = Query()
+
+    def load_all(self) -> List[Dict]:
+        return [dict(doc) for doc in self.routes.all()]
+
+    def insert(self, route: Dict):
+        self.routes.insert(route)
+
+    def update(self, route: Dict, changes: Dict):
+        def replace(doc):
+            # Rewrite the whole document so fields dropped from the
+            # in-memory copy disappear from disk as well
+            doc.clear()
+            doc.update(route)
+
+        self.routes.update(replace, self.Route.id == route['id'])
+
+    def delete(self, route_id: str):
+        self.routes.remove(self.Route.id == route_id)
+
+    def write_batch(self, changes: List[Tuple]):
+        # One read-modify-write of the file instead of one per change
+        data = self.db.storage.read() or {}
+        table = data.setdefault('routes', {})
+        doc_ids = {doc.get('id'): doc_id for doc_id, doc in table.items()}
+        next_id = max((int(doc_id) for doc_id in table), default=0) + 1
+
+        for kind, *args in changes:
+            if kind == 'insert':
+                doc_ids[args[0]['id']] = str(next_id)
+                table[str(next_id)] = args[0]
+                next_id += 1
+            elif kind == 'update':
+                table[doc_ids[args[0]['id']]] = args[0]
+            elif kind == 'delete':
+                doc_id = doc_ids.pop(args[0], None)
+                if doc_id is not None:
+                    del table[doc_id]
+
+        self.db.storage.write(data)
+        self.reload()
+
+    def reload(self):
+        # TinyDB caches the next document id per table; a fresh table
+        # recomputes it so we never reuse an id another process assigned
+        self.routes = Table(self.db.storage, 'routes')
+
+    def close(self):
+        self.db.close()
+
+
+class SQLiteStorage(RouteStorage):
+    """Routes stored one row per route in an SQLite database in WAL mode.
+
+    WAL gives concurrent readers alongside a single writer, and every
+    mutation touches exactly one row instead of rewriting the whole file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS routes ('
+                ' id TEXT PRIMARY KEY,'
+                ' path TEXT NOT NULL,'
+                ' doc TEXT NOT NULL)'
+            )
+            self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS routes_path ON routes (path)')
+
+    def load_all(self) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute('SELECT doc FROM routes ORDER BY rowid').fetchall()
+        return [json.loads(doc) for (doc,) in rows]
+
+    def insert(self, route: Dict):
+        self.insert_many([route])
+
+    def insert_many(self, routes: List[Dict]):
+        """Insert several routes in a single transaction."""
+        rows = [(r['id'], _path_key(r['path']), json.dumps(r)) for r in routes]
+        with self._lock, self.conn:
+            self.conn.executemany('INSERT INTO routes (id, path, doc) VALUES (?, ?, ?)', rows)
+
+    def update(self, route: Dict, changes: Dict):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE routes SET path = ?, doc = ? WHERE id = ?',
+                (_path_key(route['path']), json.dumps(route), route['id']),
+            )
+
+    def delete(self, route_id: str):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM routes WHERE id = ?', (route_id,))
+
+    def watch_paths(self) -> List[Path]:
+        # Committed changes land in the WAL before they are checkpointed
+        return [self.path, self.path.with_name(self.path.name + '-wal')]
+
+    def write_batch(self, changes: List[Tuple]):
+        with self._lock, self.conn:
+            for kind, *args in changes:
+                if kind == 'insert':
+                    route = args[0]
+                    self.conn.execute(
+                        'INSERT INTO routes (id, path, doc) VALUES (?, ?, ?)',
+                        (route['id'], _path_key(route['path']), json.dumps(route)),
+                    )
+                elif kind == 'update':
+                    route = args[0]
+                    self.conn.execute(
+                        'UPDATE routes SET path = ?, doc = ? WHERE id = ?',
+                        (_path_key(route['path']), json.dumps(route), route['id']),
+                    )
+                elif kind == 'delete':
+                    self.conn.execute('DELETE FROM routes WHERE id = ?', (args[0],))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class JournalStorage(RouteStorage):
+    """Routes stored as a compact snapshot plus an append-only journal.
+
+    Every mutation appends one JSON line describing only the change, so a
+    write costs O(size of change) rather than O(size of database). Lines are
+    flushed immediately and fsync'd in batches (at most ``fsync_interval``
+    apart). Once the journal holds ``compact_every`` records it is folded
+    into a new snapshot (msgpack when available, compact JSON otherwise) and
+    truncated. All records are idempotent, so a crash between writing the
+    snapshot and truncating the journal is harmless, and a torn final line
+    only loses that one record.
+    """
+
+    def __init__(self, path: Path, fsync_interval: float = 0.05, compact_every: int = 500):
+        self.path = path
+        self.snapshot_path = path.with_suffix('.snapshot')
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._routes: Dict[str, Dict] = {}
+        self._records = 0
+        self._last_fsync = 0.0
+        self._fsync_timer: Optional[threading.Timer] = None
+
+        self._load_snapshot()
+        self._replay_journal()
+        self._journal = open(self.path, 'ab')
+
+    def _load_snapshot(self):
+        try:
+            raw = self.snapshot_path.read_bytes()
+        except FileNotFoundError:
+            return
+        if not raw:
+            return
+        if raw[:1] == b'{':
+            data = json.loads(raw.decode('utf-8'))
+        else:
+            if msgpack is None:
+                raise RuntimeError(f"{self.snapshot_path} is msgpack encoded but msgpack is not installed")
+            data = msgpack.unpackb(raw, raw=False)
+        for route in data.get('routes', []):
+            self._routes[route['id']] = route
+
+    def _replay_journal(self):
+        try:
+            handle = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+
+        good_offset = 0
+        with handle:
+            for line in handle:
+                if not line.endswith(b'\n'):
+                    # Torn write at the tail; everything before it is intact
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                self._records += 1
+                good_offset += len(line)
+
+        if good_offset != self.path.stat().st_size:
+            with open(self.path, 'r+b') as handle:
+                handle.truncate(good_offset)
+
+    def _apply(self, record: Dict):
+        op = record.get('op')
+        if op == 'add':
+            self._routes[record['route']['id']] = record['route']
+        elif op == 'update':
+            if record['id'] in self._routes:
+                self._routes[record['id']] = {**self._routes[record['id']], **record['changes']}
+        elif op == 'delete':
+            self._routes.pop(record['id'], None)
+        elif op == 'batch':
+            for item in record['records']:
+                self._apply(item)
+
+    def _append(self, record: Dict):
+        with self._lock:
+            self._apply(record)
+            self._journal.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+            self._journal.flush()
+            self._records += 1
+
+            if self._records >= self.compact_every:
+                self.compact()
+            else:
+                self._schedule_fsync()
+
+    def _schedule_fsync(self):
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+        elif self._fsync_timer is None:
+            # Another record was synced moments ago; batch this one with
+            # whatever arrives before the window closes
+            self._fsync_timer = threading.Timer(self.fsync_interval, self._fsync)
+            self._fsync_timer.daemon = True
+            self._fsync_timer.start()
+
+    def _fsync(self):
+        with self._lock:
+            self._fsync_timer = None
+            if self._journal.closed:
+                return
+            os.fsync(self._journal.fileno())
+            self._last_fsync = time.monotonic()
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and truncate it."""
+        with self._lock:
+            payload = {'routes': list(self._routes.values())}
+            if msgpack is not None:
+                data = msgpack.packb(payload, use_bin_type=True)
+            else:
+                data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            atomic_write_bytes(self.snapshot_path, data)
+
+            self._journal.truncate(0)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._records = 0
+            self._last_fsync = time.monotonic()
+
+    def seed(self, routes: List[Dict]):
+        """Bulk-load routes straight into a new snapshot."""
+        with self._lock:
+            for route in routes:
+                self._routes[route['id']] = route
+            self.compact()
+
+    def load_all(self) -> List[Dict]:
+        with self._lock:
+            return [dict(route) for route in self._routes.values()]
+
+    def watch_paths(self) -> List[Path]:
+        return [self.path, self.snapshot_path]
+
+    def reload(self):
+        with self._lock:
+            self._routes = {}
+            self._records = 0
+            self._load_snapshot()
+            self._replay_journal()
+
+    def insert(self, route: Dict):
+        self._append({'op': 'add', 'route': route})
+
+    def update(self, route: Dict, changes: Dict):
+        self._append(self._update_record(route, changes))
+
+    def _update_record(self, route: Dict, changes: Dict) -> Dict:
+        if set(self._routes.get(route['id'], ())) - set(route):
+            # Keys were dropped; only a full document can express that
+            return {'op': 'add', 'route': route}
+        return {'op': 'update', 'id': route['id'], 'changes': changes}
+
+    def delete(self, route_id: str):
+        self._append({'op': 'delete', 'id': route_id})
+
+    def write_batch(self, changes: List[Tuple]):
+        # A single journal line, so a torn write drops the whole batch
+        records = []
+        for kind, *args in changes:
+            if kind == 'insert':
+                records.append({'op': 'add', 'route': args[0]})
+            elif kind == 'update':
+                records.append(self._update_record(*args))
+            elif kind == 'delete':
+                records.append({'op': 'delete', 'id': args[0]})
+        self._append({'op': 'batch', 'records': records})
+
+    def close(self):
+        with self._lock:
+            if self._fsync_timer is not None:
+                self._fsync_timer.cancel()
+                self._fsync_timer = None
+            if not self._journal.closed:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+
+
+class FileWatcher:
+    """Poll a set of files and report changes once they have settled.
+
+    ``poll`` returns True when the files differ from the last reported
+    state and were unchanged since the previous poll, so a burst of writes
+    (an editor saving, a backup being copied back) is reported once.
+    """
+
+    def __init__(self, paths: List[Path]):
+        self.paths = list(paths)
+        self._reported = self._pending = self.stamp()
+
+    def stamp(self) -> Tuple:
+        stamps = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                stamps.append(None)
+            else:
+                stamps.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(stamps)
+
+    def poll(self) -> bool:
+        current = self.stamp()
+        settled = current == self._pending
+        self._pending = current
+        if settled and current != self._reported:
+            self._reported = current
+            return True
+        return False
+
+
+class StoreCoordinator:
+    """Coordinate several processes sharing one route store.
+
+    Writers hold an exclusive ``flock`` on ``<stem>.lock`` while they modify
+    the store and then replace ``<stem>.version`` with a new token. Readers
+    compare the stamp file's identity (inode, mtime, size) with the one they
+    last loaded, so checking for changes costs a single ``stat``. Reloads
+    take the lock shared so they never observe a half-written change.
+    Without ``fcntl`` (Windows) locking is limited to the current process.
+    """
+
+    def __init__(self, path: Path):
+        self.lock_path = path.with_name(f'{path.stem}.lock')
+        self.stamp_path = path.with_name(f'{path.stem}.version')
+        self._handle = open(self.lock_path, 'a')
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._seen = self.stamp()
+
+    def stamp(self) -> Optional[Tuple[int, int, int]]:
+        """Identity of the current version stamp (None before the first write)."""
+        try:
+            st = os.stat(self.stamp_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def changed(self) -> bool:
+        """Whether another process committed a write since ``mark_seen``."""
+        return self.stamp() != self._seen
+
+    def mark_seen(self, stamp: Optional[Tuple[int, int, int]]):
+        self._seen = stamp
+
+    @contextlib.contextmanager
+    def locked(self, exclusive: bool = True):
+        """Hold the cross-process lock; re-entrant within this process."""
+        with self._thread_lock:
+            self._depth += 1
+            try:
+                if self._depth == 1 and fcntl is not None:
+                    fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and fcntl is not None:
+                    fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+
+    def publish(self):
+        """Announce a committed write (call while holding the lock)."""
+        # Replacing the file gives it a new inode, so even writes within the
+        # same mtime tick are detected
+        atomic_write_text(self.stamp_path, f'{os.getpid()}-{uuid.uuid4().hex}')
+        self._seen = self.stamp()
+
+    def close(self):
+        self._handle.close()
+
+
+def sqlite_path_for(path: Path) -> Path:
+    """Map a configured routes path onto the SQLite database file."""
+    return path.with_suffix('.sqlite3') if path.suffix == '.json' else path
+
+
+def journal_path_for(path: Path) -> Path:
+    """Map a configured routes path onto the journal file."""
+    return path.with_suffix('.journal') if path.suffix == '.json' else path
+
+
+def _importable_routes(source: RouteStorage, taken: Optional[Dict[str, str]] = None) -> List[Dict]:
+    """Routes worth carrying over from ``source`` into a new backend.
+
+    Documents are copied as they are and upgraded lazily by RouteManager,
+    except that the oldest ones name their mount ``route_path``; the new
+    backends index the mount, so it is moved to ``path`` here. The new
+    backends also need unique mounts: a route whose normalized path (e.g.
+    ``/x/`` for ``/x``) is already in ``taken`` or was seen earlier in the
+    file is skipped and logged with both ids.
+    """
+    taken = dict(taken or {})
+    routes = []
+    for route in source.load_all():
+        if not route.get('path') and route.get('route_path'):
+            route = dict(route)
+            route['path'] = route.pop('route_path')
+        if not (route.get('id') and isinstance(route.get('path'), str)):
+            continue
+        key = _path_key(route['path'])
+        owner = taken.get(key)
+        if owner is not None and owner != route['id']:
+            log.warning(
+                "Skipping route %s (%s) during import: path %s is already used by route %s",
+                route['id'], route['path'], key, owner,
+            )
+            continue
+        taken[key] = route['id']
+        routes.append(route)
+    return routes
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path) -> int:
+    """Copy every route from a TinyDB routes.json into an SQLite database.
+
+    Returns the number of routes migrated. Routes whose id already exists
+    in the target are left untouched, so running it twice is harmless.
+    Routes whose normalized path duplicates an earlier one are skipped and
+    logged (see ``_importable_routes``).
+    """
+    target = SQLiteStorage(Path(sqlite_path))
+    try:
+        existing = target.load_all()
+        source = TinyDBStorage(Path(json_path))
+        try:
+            routes = _importable_routes(source, {_path_key(r['path']): r['id'] for r in existing})
+        finally:
+            source.close()
+
+        existing_ids = {r['id'] for r in existing}
+        fresh = [r for r in routes if r['id'] not in existing_ids]
+        target.insert_many(fresh)
+    finally:
+        target.close()
+    return len(fresh)
+
+
+def open_storage(backend: str, path: Path) -> RouteStorage:
+    """Create the storage backend named by ``backend`` for ``path``."""
+    backend = (backend or 'tinydb').strip().lower()
+    if backend == 'tinydb':
+        return TinyDBStorage(path)
+    if backend == 'sqlite':
+        sqlite_path = sqlite_path_for(path)
+        if not sqlite_path.exists() and sqlite_path != path and path.is_file():
+            # First start on SQLite: carry the existing routes over once
+            migrate_json_to_sqlite(path, sqlite_path)
+        return SQLiteStorage(sqlite_path)
+    if backend == 'journal':
+        journal_path = journal_path_for(path)
+        fresh = not journal_path.exists() and not journal_path.with_suffix('.snapshot').exists()
+        storage = JournalStorage(journal_path)
+        if fresh and journal_path != path and path.is_file():
+            # First start on the journal: import the existing routes once
+            source = TinyDBStorage(path)
+            try:
+                storage.seed(_importable_routes(source))
+            finally:
+                source.close()
+        return storage
+    raise ValueError(f"Unknown routes storage backend '{backend}' (expected one of: {', '.join(BACKENDS)})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Migrate routes.json into an SQLite route database.')
+    parser.add_argument('json_path', help='Existing TinyDB routes.json')
+    parser.add_argument('sqlite_path', nargs='?', help='Target database (default: <json_path>.sqlite3)')
+    args = parser.parse_args(argv)
+
+    json_path = Path(args.json_path)
+    sqlite_path = Path(args.sqlite_path) if args.sqlite_path else sqlite_path_for(json_path)
+    count = migrate_json_to_sqlite(json_path, sqlite_path)
+    print(f'Migrated {count} routes from {json_path} to {sqlite_path}')
+
+
+if __name__ == '__main__':
+    main()
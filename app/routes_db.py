@@ -1,20 +1,565 @@
 """
-TinyDB Route Manager - Database wrapper for managing reverse proxy routes
+Route Manager - In-memory route cache over a pluggable storage backend
 """
-from tinydb import TinyDB, Query
-from typing import List, Dict, Optional
+from typing import Any, Iterable, Iterator, List, Dict, Mapping, NamedTuple, Optional, Set, Tuple
+import base64
+import bisect
+import collections
+import contextlib
+import dataclasses
+import itertools
+import json
+import sys
+import time
 import uuid
+from dataclasses import dataclass
 from datetime import datetime
+from types import MappingProxyType
 import ipaddress
+import logging
 import re
 import threading
 from pathlib import Path
 
+from route_storage import StoreCoordinator, atomic_write_text, open_storage
+
+log = logging.getLogger(__name__)
+
+
+# Probe results tracked per route. They are stored by HealthStateStore and
+# joined onto the route configuration at read time.
+HEALTH_FIELDS = (
+    'status',        # Legacy field, kept for backward compat
+    'state',         # UP, DEGRADED, DOWN, UNKNOWN
+    'reason',        # Detailed reason
+    'http_status',   # HTTP status code if available
+    'duration_ms',   # Response time in milliseconds
+    'last_error',    # Last error message
+    'last_check',
+    'retries_used',  # Number of retries used
+)
+
+# Health fields with a small set of enum-like values; they are interned so
+# thousands of routes share one string object per value
+INTERNED_HEALTH_FIELDS = ('status', 'state', 'reason')
+
+# (state, reason) implied by a legacy ``status`` reported without a state
+LEGACY_STATUS_STATES = {
+    'online': ('UP', 'online'),
+    'slow': ('DEGRADED', 'slow'),
+    'offline': ('DOWN', 'offline_conn'),
+    'timeout': ('DOWN', 'timeout'),
+    'error': ('DOWN', 'error_exc'),
+    'unknown': ('UNKNOWN', 'unknown'),
+}
+
+HEALTH_DEFAULTS = {
+    'status': 'unknown',
+    'state': 'UNKNOWN',
+    'reason': 'unknown',
+    'http_status': None,
+    'duration_ms': None,
+    'last_error': None,
+    'last_check': None,
+    'retries_used': 0,
+}
+
+
+class HealthStateStore:
+    """Volatile per-route health state, kept apart from route configuration.
+
+    Probe results change far more often than the configuration does, so they
+    live in memory and are only snapshotted to their own file (when a
+    snapshot path is given). Losing the snapshot only loses the last known
+    probe results, never a route.
+    """
+
+    def __init__(self, snapshot_path: Optional[Path] = None):
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._states: Dict[str, Dict] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if self.snapshot_path is None:
+            return
+        try:
+            data = json.loads(self.snapshot_path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            # A damaged snapshot is not fatal; the next sweep repopulates it
+            return
+
+        states = data.get('routes') if isinstance(data, dict) else None
+        if not isinstance(states, dict):
+            return
+        for route_id, fields in states.items():
+            if isinstance(fields, dict):
+                self._states[route_id] = self._normalize({k: v for k, v in fields.items() if k in HEALTH_FIELDS})
+
+    @staticmethod
+    def _normalize(fields: Dict) -> Dict:
+        """Fill in state/reason for legacy status-only results and intern values."""
+        if 'state' not in fields and fields.get('status') in LEGACY_STATUS_STATES:
+            state, reason = LEGACY_STATUS_STATES[fields['status']]
+            fields['state'] = state
+            fields.setdefault('reason', reason)
+        for field in INTERNED_HEALTH_FIELDS:
+            if isinstance(fields.get(field), str):
+                fields[field] = sys.intern(fields[field])
+        return fields
+
+    def has(self, route_id: str) -> bool:
+        with self._lock:
+            return route_id in self._states
+
+    def get(self, route_id: str) -> Dict:
+        """Return the health fields of a route, defaults filled in."""
+        with self._lock:
+            return {**HEALTH_DEFAULTS, **self._states.get(route_id, {})}
+
+    def update(self, route_id: str, fields: Dict):
+        with self._lock:
+            self._states.setdefault(route_id, {}).update(self._normalize(dict(fields)))
+            self._dirty = True
+
+    def remove(self, route_id: str):
+        with self._lock:
+            if self._states.pop(route_id, None) is not None:
+                self._dirty = True
+
+    def snapshot(self) -> bool:
+        """Write the current state to the snapshot file if it changed."""
+        with self._lock:
+            if self.snapshot_path is None or not self._dirty:
+                return False
+            payload = json.dumps({'routes': self._states})
+            self._dirty = False
+        try:
+            atomic_write_text(self.snapshot_path, payload)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+        return True
+
+
+# Layout version of stored route documents. Older documents are upgraded
+# in memory when read and written back lazily (RouteManager.persist_upgrades).
+ROUTE_SCHEMA_VERSION = 2
+
+
+def _upgrade_v1(doc: Dict) -> Dict:
+    """v1 -> v2: ``route_path`` was renamed to ``path``."""
+    legacy_path = doc.pop('route_path', None)
+    if legacy_path and not doc.get('path'):
+        doc['path'] = legacy_path
+    return doc
+
+
+# Upgrade step from each schema version to the next
+ROUTE_UPGRADES = {
+    1: _upgrade_v1,
+}
+
+
+def upgrade_route_doc(doc: Dict) -> Tuple[Dict, bool]:
+    """Bring a stored document up to ROUTE_SCHEMA_VERSION.
+
+    Returns the (possibly new) document and whether it was upgraded.
+    Documents without a version predate versioning and count as v1.
+    """
+    version = doc.get('schema_version', 1)
+    if version >= ROUTE_SCHEMA_VERSION:
+        return doc, False
+
+    doc = dict(doc)
+    while version < ROUTE_SCHEMA_VERSION:
+        doc = ROUTE_UPGRADES[version](doc)
+        version += 1
+    doc['schema_version'] = ROUTE_SCHEMA_VERSION
+    return doc, True
+
+
+class Upstream(NamedTuple):
+    """One backend of a load-balanced route."""
+
+    ip: str
+    port: int
+    weight: int = 1
+
+
+def _decode_upstreams(value) -> Tuple[Upstream, ...]:
+    """Stored/sanitized upstream dicts -> immutable Upstream tuples."""
+    return tuple(
+        u if isinstance(u, Upstream) else Upstream(u['ip'], int(u['port']), int(u.get('weight', 1)))
+        for u in value or ()
+    )
+
+
+# Load-balancing selection policies a route may use
+LB_POLICIES = ('round_robin', 'least_conn', 'weighted', 'ip_hash')
+
+# Route fields describing how traffic is spread over several upstreams
+LOAD_BALANCING_FIELDS = ('upstreams', 'lb_policy', 'lb_try_duration', 'lb_retries', 'fail_duration', 'max_fails')
+
+MAX_UPSTREAMS = 32
+
+# HTTP versions Caddy may speak to a route's upstreams ('2' is h2c for http, h2 for https)
+UPSTREAM_HTTP_VERSIONS = ('auto', '1.1', '2')
+
+# Route fields tuning Caddy's HTTP transport to the upstreams (0 = Caddy default)
+TRANSPORT_FIELDS = (
+    'dial_timeout', 'response_header_timeout', 'keepalive', 'keepalive_idle_conns_per_host',
+    'max_conns_per_host', 'upstream_http_version', 'max_request_body_mb',
+)
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Route(Mapping):
+    """Immutable route configuration.
+
+    Slots keep each route compact, and since instances never change they
+    can be shared by the cache, snapshots and indexes without copying.
+    Routes behave as read-only mappings, so ``route['path']`` and
+    ``route.get(...)`` work as they did on plain dicts. Changes produce a
+    new instance (``with_changes``). Keys that are not known fields are
+    kept in ``extra`` so nothing stored by other versions is lost.
+
+    ``upstreams`` is empty for single-backend routes; when set, it lists
+    every backend and ``target_ip``/``target_port`` mirror the first one.
+    It reads as a list of ``{'ip', 'port', 'weight'}`` dicts.
+
+    The TRANSPORT_FIELDS tune how Caddy connects to the upstreams; ``0``
+    leaves a limit at Caddy's default.
+    """
+
+    id: str
+    path: str = ''
+    name: str = ''
+    target_ip: str = ''
+    target_port: int = 0
+    target_path: str = ''
+    protocol: str = 'http'
+    enabled: bool = True
+    health_check: bool = True
+    timeout: int = 30
+    preserve_host: bool = False
+    websocket: bool = False
+    upstreams: Tuple[Upstream, ...] = ()
+    lb_policy: str = 'round_robin'
+    lb_try_duration: int = 0
+    lb_retries: int = 0
+    fail_duration: int = 0
+    max_fails: int = 1
+    dial_timeout: int = 0
+    response_header_timeout: int = 0
+    keepalive: bool = True
+    keepalive_idle_conns_per_host: int = 0
+    max_conns_per_host: int = 0
+    upstream_http_version: str = 'auto'
+    max_request_body_mb: int = 0
+    created_at: str = ''
+    updated_at: str = ''
+    schema_version: int = ROUTE_SCHEMA_VERSION
+    extra: Tuple[Tuple[str, Any], ...] = ()
+
+    @classmethod
+    def from_dict(cls, doc: Mapping) -> 'Route':
+        """Build a route from an up-to-date document, dropping health fields."""
+        known = {k: v for k, v in doc.items() if k in ROUTE_FIELD_SET}
+        if isinstance(known.get('protocol'), str):
+            known['protocol'] = sys.intern(known['protocol'])
+        if 'upstreams' in known:
+            known['upstreams'] = _decode_upstreams(known['upstreams'])
+        extra = tuple((k, v) for k, v in doc.items() if k not in ROUTE_FIELD_SET and k not in HEALTH_FIELDS)
+        return cls(extra=extra, **known)
+
+    def to_dict(self) -> Dict:
+        doc = {field: getattr(self, field) for field in ROUTE_FIELDS}
+        doc['upstreams'] = [u._asdict() for u in self.upstreams]
+        doc.update(self.extra)
+        return doc
+
+    def with_changes(self, changes: Mapping) -> 'Route':
+        """Return a copy with ``changes`` applied."""
+        known = {k: v for k, v in changes.items() if k in ROUTE_FIELD_SET}
+        unknown = {k: v for k, v in changes.items() if k not in ROUTE_FIELD_SET}
+        if 'upstreams' in known:
+            known['upstreams'] = _decode_upstreams(known['upstreams'])
+        if unknown:
+            known['extra'] = tuple({**dict(self.extra), **unknown}.items())
+        return dataclasses.replace(self, **known)
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'upstreams':
+            return [u._asdict() for u in self.upstreams]
+        if key in ROUTE_FIELD_SET:
+            return getattr(self, key)
+        for name, value in self.extra:
+            if name == key:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from ROUTE_FIELDS
+        for name, _ in self.extra:
+            yield name
+
+    def __len__(self) -> int:
+        return len(ROUTE_FIELDS) + len(self.extra)
+
+
+ROUTE_FIELDS = tuple(field.name for field in dataclasses.fields(Route) if field.name != 'extra')
+ROUTE_FIELD_SET = frozenset(ROUTE_FIELDS)
+
+
+# Top-level paths served by the Flask portal. Backend routes are placed
+# before the portal in Caddy, so mounting one of these would shadow it.
+RESERVED_PATHS = frozenset({
+    'admin', 'api', 'static', 'health', 'logs', 'emails',
+    'route-disabled', 'unauthorized', 'favicon.ico',
+})
+
+
+class _PathNode:
+    __slots__ = ('children', 'route_id')
+
+    def __init__(self):
+        self.children: Dict[str, '_PathNode'] = {}
+        self.route_id: Optional[str] = None
+
+
+class RoutePathIndex:
+    """Segment trie over route mounts.
+
+    Exact and longest-prefix lookups cost O(path depth), independent of the
+    number of routes, so ``/jellyfin/web/index.html`` resolves to the
+    ``/jellyfin`` mount without scanning every route.
+    """
+
+    def __init__(self):
+        self._root = _PathNode()
+
+    @staticmethod
+    def segments(path: str) -> List[str]:
+        return [segment for segment in path.split('/') if segment]
+
+    def insert(self, path: str, route_id: str):
+        node = self._root
+        for segment in self.segments(path):
+            node = node.children.setdefault(segment, _PathNode())
+        node.route_id = route_id
+
+    def remove(self, path: str, route_id: Optional[str] = None):
+        """Remove a mount (only if it still belongs to ``route_id`` when given)."""
+        trail = [self._root]
+        for segment in self.segments(path):
+            node = trail[-1].children.get(segment)
+            if node is None:
+                return
+            trail.append(node)
+        if route_id is not None and trail[-1].route_id != route_id:
+            return
+        trail[-1].route_id = None
+
+        # Prune branches that no longer lead to any mount
+        segments = self.segments(path)
+        for depth in range(len(segments), 0, -1):
+            node = trail[depth]
+            if node.route_id is not None or node.children:
+                break
+            del trail[depth - 1].children[segments[depth - 1]]
+
+    def exact(self, path: str) -> Optional[str]:
+        node = self._root
+        for segment in self.segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node.route_id
+
+    def longest_prefix(self, path: str) -> Optional[str]:
+        """Return the route whose mount is the longest prefix of ``path``."""
+        node = self._root
+        best = node.route_id
+        for segment in self.segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.route_id is not None:
+                best = node.route_id
+        return best
+
+    def overlaps(self, path: str) -> Tuple[List[str], List[str]]:
+        """Return (mounts above ``path``, mounts below ``path``) as route ids."""
+        ancestors: List[str] = []
+        node = self._root
+        for segment in self.segments(path):
+            if node.route_id is not None:
+                ancestors.append(node.route_id)
+            node = node.children.get(segment)
+            if node is None:
+                return ancestors, []
+
+        descendants: List[str] = []
+        stack = list(node.children.values())
+        while stack:
+            child = stack.pop()
+            if child.route_id is not None:
+                descendants.append(child.route_id)
+            stack.extend(child.children.values())
+        return ancestors, descendants
+
+
+# Searchable route fields and their ranking weight
+SEARCH_FIELDS = (
+    ('name', 4),
+    ('path', 3),
+    ('target_ip', 2),
+    ('target_port', 1),
+)
+
+
+class RouteSearchIndex:
+    """Trigram index over the searchable fields of every route.
+
+    Query terms of three or more characters are narrowed through the
+    trigram postings and then verified; shorter terms scan the per-route
+    field texts directly. Every term must match (AND) and routes are
+    ranked by field weight and match quality (exact > word prefix > substring).
+    """
+
+    def __init__(self):
+        self._texts: Dict[str, Tuple[str, ...]] = {}
+        self._postings: Dict[str, Set[str]] = collections.defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    @staticmethod
+    def trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _grams(self, texts: Tuple[str, ...]) -> Set[str]:
+        grams: Set[str] = set()
+        for text in texts:
+            grams |= self.trigrams(text)
+        return grams
+
+    def add(self, route: Dict):
+        """Index (or re-index) a route."""
+        route_id = route['id']
+        self.remove(route_id)
+        texts = tuple(str(route.get(field, '')).lower() for field, _ in SEARCH_FIELDS)
+        self._texts[route_id] = texts
+        for gram in self._grams(texts):
+            self._postings[gram].add(route_id)
+
+    def remove(self, route_id: str):
+        texts = self._texts.pop(route_id, None)
+        if texts is None:
+            return
+        for gram in self._grams(texts):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(route_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def _candidates(self, term: str) -> Iterable[str]:
+        grams = self.trigrams(term)
+        if not grams:
+            return list(self._texts)
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+    @staticmethod
+    def _score(term: str, texts: Tuple[str, ...]) -> int:
+        best = 0
+        for text, (_, weight) in zip(texts, SEARCH_FIELDS):
+            index = text.find(term)
+            if index < 0:
+                continue
+            if text == term or text.strip('/') == term.strip('/'):
+                quality = 3
+            elif index == 0 or not text[index - 1].isalnum():
+                quality = 2
+            else:
+                quality = 1
+            best = max(best, weight * quality)
+        return best
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Return route ids matching every term of ``query``, best first."""
+        scores: Optional[Dict[str, int]] = None
+        for term in query.lower().split():
+            matched = {}
+            for route_id in (self._candidates(term) if scores is None else scores):
+                score = self._score(term, self._texts[route_id])
+                if score:
+                    matched[route_id] = score + (scores[route_id] if scores else 0)
+            scores = matched
+            if not scores:
+                break
+        if not scores:
+            return []
+
+        ranked = sorted(scores, key=lambda route_id: (-scores[route_id], self._texts[route_id][0]))
+        return ranked[:limit] if limit else ranked
+
+
+# Fields the route list can be sorted by
+ROUTE_SORT_FIELDS = ('name', 'path', 'state', 'duration_ms', 'last_check')
+
+# Sort fields holding numbers; the others sort as (lowercased) strings
+NUMERIC_SORT_FIELDS = frozenset({'duration_ms'})
+
+
+class _Descending:
+    """Sort key wrapper that inverts the ordering of its value."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class RouteConflictError(Exception):
+    """Raised when an If-Match precondition no longer holds."""
+
+
+class RouteSnapshot(NamedTuple):
+    """Immutable view of every route at one version of the manager."""
+
+    version: int
+    etag: str
+    routes: Tuple[Mapping, ...]
+
+
+class RoutePage(NamedTuple):
+    """One page of a sorted, filtered route listing."""
+
+    routes: List[Mapping]
+    next_cursor: Optional[str]
+    total: int
+
 
 class RouteManager:
-    """Manage reverse proxy routes using TinyDB"""
+    """Manage reverse proxy routes on top of a pluggable storage backend"""
     
-    def __init__(self, db_path='routes.json'):
+    def __init__(self, db_path='routes.json', status_flush_interval: float = 0.0,
+                 health_snapshot: bool = True, backend: str = 'tinydb',
+                 changelog_size: int = 1000, multiprocess: bool = False,
+                 background_upgrades: bool = True):
         original_path = Path(db_path)
         path = original_path
 
@@ -30,23 +575,469 @@ class RouteManager:
 
         path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not path.exists():
-            path.write_text('{"_default": {}}', encoding='utf-8')
-
+        self.db_path = path
         self._lock = threading.RLock()
-        self.db = TinyDB(str(path))
-        self.routes = self.db.table('routes')
-        self.Route = Query()
+
+        # Several worker processes may share the store; they then serialize
+        # writes with a file lock and reload when another one has written
+        self._coordinator = StoreCoordinator(path) if multiprocess else None
+        with self._writer_lock():
+            self.storage = open_storage(backend, path)
+
+        # Health state lives outside routes.json so probe results never
+        # rewrite the configuration. It is snapshotted at most once per
+        # status_flush_interval (0 snapshots on every update).
+        snapshot_path = path.with_name(f'{path.stem}.health.json') if health_snapshot else None
+        self.health = HealthStateStore(snapshot_path)
+        self.status_flush_interval = max(0.0, float(status_flush_interval))
+        self._last_status_flush = time.monotonic()
+
+        # Authoritative in-memory copy of the routes table. The storage
+        # backend is only touched on mutation (write-through), never on reads.
+        self._by_id: Dict[str, Route] = {}
+        self._paths = RoutePathIndex()
+        self._search = RouteSearchIndex()
+
+        # Every mutation bumps the version. Snapshots are versioned by the
+        # last config change only; ETags add the last health change and a
+        # per-process epoch so a restart never reuses an old tag.
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+        self._config_version = 0
+        self._health_version = 0
+        self._config_revs: Dict[str, int] = {}
+        self._health_revs: Dict[str, int] = {}
+        self._snapshot: Optional[RouteSnapshot] = None
+        # Route id -> (route, health revision, view) the view was built from
+        self._views: Dict[str, Tuple[Route, int, Mapping]] = {}
+        self._sorted: Dict[Tuple[str, bool], Tuple[str, List[Dict]]] = {}
+
+        # Bounded log of (version, route_id, op) for incremental clients.
+        # Versions at or above _changelog_floor are fully covered by it.
+        self._changelog = collections.deque(maxlen=max(1, changelog_size))
+        self._changelog_floor = 0
+
+        # Routes whose stored document predates ROUTE_SCHEMA_VERSION. They
+        # are upgraded in memory on load and written back in small batches.
+        self._stale: Set[str] = set()
+        self._load_cache()
+        if self._stale and background_upgrades:
+            threading.Thread(target=self._persist_upgrades_worker, daemon=True).start()
+
+    def _load_cache(self):
+        """(Re)build the in-memory indexes from the database file."""
+        with self._lock:
+            self._by_id = {}
+            self._paths = RoutePathIndex()
+            self._search = RouteSearchIndex()
+            for doc in self.storage.load_all():
+                route_id = doc.get('id')
+                if not route_id:
+                    continue
+                # Older databases stored probe results inline; adopt them
+                legacy = {k: v for k, v in doc.items() if k in HEALTH_FIELDS}
+                if legacy and not self.health.has(route_id):
+                    self.health.update(route_id, legacy)
+                doc, upgraded = upgrade_route_doc(doc)
+                if upgraded:
+                    self._stale.add(route_id)
+                route = Route.from_dict(doc)
+                self._by_id[route_id] = route
+                if route.get('path'):
+                    self._paths.insert(route['path'], route_id)
+                self._search.add(route)
+            self._config_revs = {route_id: 0 for route_id in self._by_id}
+            self._health_revs = {}
+            self._views = {}
+            self._changelog.clear()
+            self._changelog_floor = self._bump()
+
+    def _writer_lock(self):
+        """The cross-process lock in multi-process mode, else a no-op."""
+        if self._coordinator is None:
+            return contextlib.nullcontext()
+        return self._coordinator.locked()
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Hold the locks needed to change the store.
+
+        In multi-process mode this also takes the file lock, first pulls in
+        changes committed by other processes and afterwards tells them
+        about this write.
+        """
+        with self._lock, self._writer_lock():
+            self._refresh()
+            version = self._version
+            yield
+            if self._coordinator is not None and self._version != version:
+                self._coordinator.publish()
+
+    def _refresh(self):
+        """Reload routes if another process changed the store (cheap when not)."""
+        coordinator = self._coordinator
+        if coordinator is None or not coordinator.changed():
+            return
+        with self._lock, coordinator.locked(exclusive=False):
+            if not coordinator.changed():
+                return
+            stamp = coordinator.stamp()
+            self.storage.reload()
+            self._merge(self.storage.load_all())
+            coordinator.mark_seen(stamp)
+
+    def reload(self) -> List[Tuple[str, str]]:
+        """Re-read the store, e.g. after routes.json was edited by hand.
+
+        Returns the ``(route_id, op)`` changes that were picked up.
+        """
+        with self._lock, self._writer_lock():
+            self.storage.reload()
+            return self._merge(self.storage.load_all())
+
+    def _merge(self, docs: List[Dict]) -> List[Tuple[str, str]]:
+        """Apply the difference between ``docs`` and the cache (caller holds the lock).
+
+        Changed routes get a new config revision and changelog entry, so
+        ETags and the change feed stay correct across processes. Returns
+        the ``(route_id, op)`` changes applied.
+        """
+        routes = {}
+        for doc in docs:
+            if doc.get('id'):
+                doc, upgraded = upgrade_route_doc(doc)
+                if upgraded:
+                    self._stale.add(doc['id'])
+                routes[doc['id']] = Route.from_dict(doc)
+
+        removed = [route_id for route_id in self._by_id if route_id not in routes]
+        changed = [
+            route_id for route_id, route in routes.items()
+            if route_id not in self._by_id or self._by_id[route_id].to_dict() != route.to_dict()
+        ]
+        if not removed and not changed:
+            return []
+
+        version = self._bump()
+        applied: List[Tuple[str, str]] = []
+        for route_id in removed:
+            route = self._by_id.pop(route_id)
+            self._paths.remove(route.get('path', ''), route_id)
+            self._search.remove(route_id)
+            self._config_revs.pop(route_id, None)
+            self._health_revs.pop(route_id, None)
+            self._views.pop(route_id, None)
+            self._stale.discard(route_id)
+            self.health.remove(route_id)
+            self._log_change(route_id, 'deleted')
+            applied.append((route_id, 'deleted'))
+        for route_id in changed:
+            current = self._by_id.get(route_id)
+            route = routes[route_id]
+            if current is not None:
+                self._paths.remove(current.get('path', ''), route_id)
+            self._by_id[route_id] = route
+            if route.get('path'):
+                self._paths.insert(route['path'], route_id)
+            self._search.add(route)
+            self._config_revs[route_id] = version
+            op = 'updated' if current is not None else 'added'
+            self._log_change(route_id, op)
+            applied.append((route_id, op))
+        return applied
+
+    def _check_mount(self, path: str, route_id: Optional[str] = None,
+                     taken: Optional[Dict[Tuple[str, ...], str]] = None) -> List[str]:
+        """Reject mounts that collide with another route or the portal.
+
+        ``taken`` maps path segments to route ids and replaces the live
+        index while a batch is being planned. Returns warnings for mounts
+        that nest inside or around other routes (allowed; the longer one
+        takes precedence).
+        """
+        segments = RoutePathIndex.segments(path)
+        if taken is None:
+            owner = self._paths.exact(path)
+        else:
+            owner = taken.get(tuple(segments))
+        if owner is not None and owner != route_id:
+            raise ValueError(f"Route with path '{path}' already exists")
+
+        if segments and segments[0] in RESERVED_PATHS:
+            raise ValueError(f"Path '/{segments[0]}' is reserved for the portal")
+        if taken is not None:
+            return []
+        return self._mount_overlaps(path, route_id)
+
+    def _mount_overlaps(self, path: str, route_id: Optional[str] = None) -> List[str]:
+        """Warnings for mounts above or below ``path`` (caller holds the lock)."""
+        warnings: List[str] = []
+        ancestors, descendants = self._paths.overlaps(path)
+        for other in ancestors:
+            if other != route_id:
+                warnings.append(f"Path '{path}' is inside '{self._by_id[other].get('path')}' and takes precedence for its subpaths")
+        for other in descendants:
+            if other != route_id:
+                warnings.append(f"Path '{path}' contains '{self._by_id[other].get('path')}', which takes precedence for its subpaths")
+        for warning in warnings:
+            log.info("Route overlap: %s", warning)
+        return warnings
+
+    def mount_warnings(self, path: str, route_id: Optional[str] = None) -> List[str]:
+        """Overlap warnings for a mount, e.g. ``/app`` around ``/app/api``."""
+        self._refresh()
+        with self._lock:
+            return self._mount_overlaps(path, route_id)
+
+    def _view(self, route: Route) -> Mapping:
+        """Read-only join of a route's configuration and current health state.
+
+        Views are cached until the route is replaced or its health changes.
+        """
+        health_rev = self._health_revs.get(route.id, 0)
+        cached = self._views.get(route.id)
+        if cached is not None and cached[0] is route and cached[1] == health_rev:
+            return cached[2]
+        view = route.to_dict()
+        view.update(self.health.get(route.id))
+        view = MappingProxyType(view)
+        self._views[route.id] = (route, health_rev, view)
+        return view
+
+    def _bump(self, config: bool = True) -> int:
+        """Advance the version after a mutation (caller holds the lock).
+
+        Health updates pass ``config=False`` and leave the config version,
+        which snapshots are versioned by, unchanged.
+        """
+        self._version += 1
+        if config:
+            self._config_version = self._version
+        else:
+            self._health_version = self._version
+        return self._version
+
+    def _log_change(self, route_id: str, op: str):
+        """Record a change at the current version (caller holds the lock)."""
+        if len(self._changelog) == self._changelog.maxlen:
+            # The oldest entry falls off; clients behind it must reload
+            self._changelog_floor = self._changelog[0][0]
+        self._changelog.append((self._version, route_id, op))
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get_changes(self, since: int) -> Dict:
+        """Return the routes added, updated or deleted after ``since``.
+
+        Each route appears at most once with its latest operation. When the
+        changelog no longer reaches back to ``since`` (or ``since`` is from
+        the future, e.g. before a restart) ``full_reload`` is set and the
+        client should fetch the complete list instead.
+        """
+        self._refresh()
+        with self._lock:
+            result = {'version': self._version, 'epoch': self._epoch, 'full_reload': False, 'changes': []}
+            if since > self._version or since < self._changelog_floor:
+                result['full_reload'] = True
+                return result
+
+            latest: Dict[str, str] = {}
+            for version, route_id, op in self._changelog:
+                if version <= since:
+                    continue
+                if latest.get(route_id) == 'added' and op == 'updated':
+                    continue  # still new to this client
+                latest.pop(route_id, None)
+                latest[route_id] = op
+
+            for route_id, op in latest.items():
+                route = self._by_id.get(route_id)
+                if route is None or op == 'deleted':
+                    result['changes'].append({'op': 'deleted', 'id': route_id})
+                else:
+                    result['changes'].append({'op': op, 'id': route_id, 'route': self._view(route)})
+            return result
+
+    def _snapshot_etag(self) -> str:
+        return f'{self._epoch}-{self._config_version}-{self._health_version}'
+
+    def snapshot(self) -> RouteSnapshot:
+        """Return an immutable snapshot of all routes at the current version.
+
+        ``version`` only moves with configuration changes; the ETag also
+        changes with health. Snapshots are rebuilt at most once per ETag,
+        reusing the cached view of every route that did not change; while
+        nothing changes, readers get the cached tuple without taking the
+        lock. Treat the contained dicts as read-only.
+        """
+        self._refresh()
+        snap = self._snapshot
+        if snap is not None and snap.etag == self._snapshot_etag():
+            return snap
+
+        with self._lock:
+            snap = self._snapshot
+            etag = self._snapshot_etag()
+            if snap is None or snap.etag != etag:
+                snap = RouteSnapshot(
+                    version=self._config_version,
+                    etag=etag,
+                    routes=tuple(self._view(r) for r in self._by_id.values()),
+                )
+                self._snapshot = snap
+            return snap
+
+    @staticmethod
+    def _sort_key(route: Dict, field: str, descending: bool) -> Tuple:
+        value = route.get(field)
+        if isinstance(value, str):
+            value = value.lower()
+        missing = value is None
+        if missing:
+            value = ''
+        return (missing, _Descending(value) if descending else value, route['id'])
+
+    def _sorted_routes(self, field: str, descending: bool) -> List[Dict]:
+        """Routes of the current snapshot in sort order, cached per snapshot."""
+        snap = self.snapshot()
+        cached = self._sorted.get((field, descending))
+        if cached is not None and cached[0] == snap.etag:
+            return cached[1]
+        ordered = sorted(snap.routes, key=lambda r: self._sort_key(r, field, descending))
+        self._sorted[(field, descending)] = (snap.etag, ordered)
+        return ordered
+
+    def list_routes(self, sort: str = 'name', state: Optional[Iterable[str]] = None,
+                    enabled: Optional[bool] = None, cursor: Optional[str] = None,
+                    limit: Optional[int] = None) -> RoutePage:
+        """Return one page of routes in sort order.
+
+        ``sort`` is one of ROUTE_SORT_FIELDS, prefixed with ``-`` for
+        descending order; routes without a value sort last. Cursors are
+        keyset based, so paging stays consistent while routes change.
+        The returned dicts belong to the snapshot; treat them as read-only.
+        """
+        descending = sort.startswith('-')
+        field = sort[1:] if descending else sort
+        if field not in ROUTE_SORT_FIELDS:
+            raise ValueError(f"Cannot sort by '{field}'. Must be one of: {', '.join(ROUTE_SORT_FIELDS)}")
+
+        routes = self._sorted_routes(field, descending)
+        if state:
+            states = {str(s).upper() for s in state}
+            routes = [r for r in routes if str(r.get('state', '')).upper() in states]
+        if enabled is not None:
+            routes = [r for r in routes if bool(r.get('enabled', True)) == enabled]
+
+        start = 0
+        if cursor:
+            key = lambda r: self._sort_key(r, field, descending)
+            start = bisect.bisect_right(routes, self._decode_cursor(cursor, sort), key=key)
+
+        end = len(routes) if limit is None else start + limit
+        page = routes[start:end]
+        next_cursor = None
+        if page and end < len(routes):
+            next_cursor = self._encode_cursor(page[-1], field, sort)
+        return RoutePage(page, next_cursor, len(routes))
+
+    @staticmethod
+    def _encode_cursor(route: Dict, field: str, sort: str) -> str:
+        missing, value, route_id = RouteManager._sort_key(route, field, False)
+        raw = json.dumps([sort, missing, value, route_id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str) -> Tuple:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            cursor_sort, missing, value, route_id = json.loads(raw)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+        if cursor_sort != sort:
+            raise ValueError("Cursor was issued for a different sort order")
+        # The key is compared against real sort keys, so its types must match them
+        if not isinstance(missing, bool):
+            raise ValueError("Invalid cursor")
+        if missing:
+            valid_value = value == ''
+        elif sort.lstrip('-') in NUMERIC_SORT_FIELDS:
+            valid_value = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            valid_value = isinstance(value, str)
+        if not valid_value or not isinstance(route_id, str):
+            raise ValueError("Invalid cursor")
+        return (missing, _Descending(value) if sort.startswith('-') else value, route_id)
+
+    def route_etag(self, route_id: str) -> Optional[str]:
+        """Entity tag of a single route (configuration and health)."""
+        self._refresh()
+        with self._lock:
+            if route_id not in self._by_id:
+                return None
+            return f'{self._epoch}-{self._config_revs.get(route_id, 0)}-{self._health_revs.get(route_id, 0)}'
+
+    def _check_if_match(self, route_id: str, if_match: Optional[Iterable[str]]):
+        """Raise RouteConflictError unless ``if_match`` names the current config.
+
+        Only the configuration part of the tag is compared, so a health probe
+        landing between a read and a write never causes a spurious conflict.
+        """
+        if if_match is None:
+            return
+        tags = set(if_match)
+        if '*' in tags:
+            return
+        current = f'{self._epoch}-{self._config_revs.get(route_id, 0)}'
+        if not any(tag.rsplit('-', 1)[0] == current for tag in tags if tag.count('-') == 2):
+            raise RouteConflictError('Route was modified by someone else; reload and try again')
     
     def add_route(self, path: str, name: str, target_ip: str,
                   target_port: int, protocol: str = 'http',
                   enabled: bool = True, health_check: bool = True,
                   timeout: int = 30, preserve_host: bool = False,
-                  websocket: bool = False, target_path: str = '') -> Dict:
-        """Add a new route"""
-        # Validate inputs
+                  websocket: bool = False, target_path: str = '',
+                  **options) -> Mapping:
+        """Add a new route
+
+        ``options`` takes the LOAD_BALANCING_FIELDS (``upstreams``,
+        ``lb_policy``, ...) for routes served by several backends and the
+        TRANSPORT_FIELDS (``dial_timeout``, ``max_conns_per_host``, ...).
+        """
+        route = self._build_route(
+            path=path, name=name, target_ip=target_ip, target_port=target_port,
+            protocol=protocol, enabled=enabled, health_check=health_check,
+            timeout=timeout, preserve_host=preserve_host, websocket=websocket,
+            target_path=target_path, **options,
+        )
+        
+        with self._writing():
+            self._check_mount(route['path'])
+
+            self.storage.insert(route.to_dict())
+            self._by_id[route['id']] = route
+            self._paths.insert(route['path'], route['id'])
+            self._search.add(route)
+            self._config_revs[route['id']] = self._bump()
+            self._log_change(route['id'], 'added')
+            return self._view(route)
+    
+    def _build_route(self, path: str = None, name: str = None, target_ip: str = None,
+                     target_port: int = None, protocol: str = 'http',
+                     enabled: bool = True, health_check: bool = True,
+                     timeout: int = 30, preserve_host: bool = False,
+                     websocket: bool = False, target_path: str = '', **extra) -> Route:
+        """Validate route fields and build a new route."""
         path = self.validate_path(path)
         name = self.validate_name(name)
+        load_balancing = self._sanitize_load_balancing(extra)
+        transport = self._sanitize_transport(extra)
+        if load_balancing.get('upstreams'):
+            # The first upstream is the primary target (health checks, listings)
+            primary = load_balancing['upstreams'][0]
+            target_ip, target_port = primary['ip'], primary['port']
         self.validate_ip(target_ip)
         target_port = self.validate_port(target_port)
         protocol = self.validate_protocol(protocol)
@@ -57,60 +1048,238 @@ class RouteManager:
         health_check = self._coerce_bool(health_check)
         target_path = str(target_path).strip()
         
-        # Check for duplicate path
-        if self.get_route_by_path(path):
-            raise ValueError(f"Route with path '{path}' already exists")
-        
-        route = {
-            'id': str(uuid.uuid4()),
-            'path': path,
-            'name': name,
-            'target_ip': target_ip,
-            'target_port': target_port,
-            'target_path': target_path,
-            'protocol': protocol,
-            'enabled': enabled,
-            'health_check': health_check,
-            'timeout': timeout,
-            'preserve_host': preserve_host,
-            'websocket': websocket,
-            'status': 'unknown',  # Legacy field, kept for backward compat
-            'state': 'UNKNOWN',   # New field: UP, DEGRADED, DOWN, UNKNOWN
-            'reason': 'unknown',  # New field: detailed reason
-            'http_status': None,  # HTTP status code if available
-            'duration_ms': None,  # Response time in milliseconds
-            'last_error': None,   # Last error message
-            'last_check': None,
-            'retries_used': 0,    # Number of retries used
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
-        }
-        
-        with self._lock:
-            self.routes.insert(route)
-            return route
-    
-    def get_all_routes(self, enabled_only: bool = False) -> List[Dict]:
+        return Route(
+            id=str(uuid.uuid4()),
+            path=path,
+            name=name,
+            target_ip=target_ip,
+            target_port=target_port,
+            target_path=target_path,
+            protocol=sys.intern(protocol),
+            enabled=enabled,
+            health_check=health_check,
+            timeout=timeout,
+            preserve_host=preserve_host,
+            websocket=websocket,
+            created_at=datetime.now().isoformat(),
+            updated_at=datetime.now().isoformat(),
+        ).with_changes({**load_balancing, **transport})
+
+    def apply_batch(self, operations: List[Dict]) -> Tuple[bool, List[Dict]]:
+        """Validate and apply a batch of route operations atomically.
+
+        Each operation is ``{'op': 'create', 'route': {...}}``,
+        ``{'op': 'update', 'id': ..., 'changes': {...}}``,
+        ``{'op': 'toggle', 'id': ...}`` or ``{'op': 'delete', 'id': ...}``,
+        optionally with an ``if_match`` ETag. Operations are checked in
+        order against the state the earlier ones leave behind. If any of
+        them fails nothing is written; otherwise the whole batch is
+        persisted in one storage transaction.
+
+        Returns ``(applied, results)`` with one result per operation.
+        """
+        with self._writing():
+            planned, results = self._plan_batch(operations)
+            if any(result['status'] == 'error' for result in results):
+                for result in results:
+                    if result['status'] != 'error':
+                        result['status'] = 'skipped'
+                return False, results
+
+            if planned:
+                self._commit_batch(planned)
+            for result in results:
+                route = self._by_id.get(result['id'])
+                if route is not None:
+                    result['route'] = self._view(route)
+            return True, results
+
+    def _plan_batch(self, operations: List[Dict]) -> Tuple[List[Tuple], List[Dict]]:
+        """Validate a batch against a working copy (caller holds the lock)."""
+        routes = dict(self._by_id)
+        taken = {tuple(RoutePathIndex.segments(r.get('path', ''))): route_id for route_id, r in routes.items()}
+        planned: List[Tuple] = []
+        results: List[Dict] = []
+
+        for index, operation in enumerate(operations):
+            result: Dict = {'index': index}
+            try:
+                if not isinstance(operation, dict):
+                    raise ValueError("Operation must be a JSON object")
+                op = result['op'] = operation.get('op')
+
+                if op == 'create':
+                    fields = operation.get('route')
+                    if not isinstance(fields, dict):
+                        raise ValueError("'route' must be a JSON object")
+                    route = self._build_route(**fields)
+                    self._check_mount(route['path'], taken=taken)
+                    routes[route['id']] = route
+                    taken[tuple(RoutePathIndex.segments(route['path']))] = route['id']
+                    planned.append(('insert', route))
+                    result.update(status='created', id=route['id'])
+                    results.append(result)
+                    continue
+
+                if op not in ('update', 'toggle', 'delete'):
+                    raise ValueError(f"Unknown operation '{op}'. Must be create, update, toggle or delete")
+
+                route_id = result['id'] = operation.get('id')
+                if not isinstance(route_id, str):
+                    raise ValueError("'id' must be a string")
+                current = routes.get(route_id)
+                if current is None:
+                    raise ValueError("Route not found")
+                if operation.get('if_match'):
+                    if not isinstance(operation['if_match'], str):
+                        raise ValueError("'if_match' must be a string")
+                    self._check_if_match(route_id, [operation['if_match']])
+
+                if op == 'delete':
+                    del routes[route_id]
+                    taken.pop(tuple(RoutePathIndex.segments(current.get('path', ''))), None)
+                    planned.append(('delete', route_id))
+                    result['status'] = 'deleted'
+                    results.append(result)
+                    continue
+
+                if op == 'toggle':
+                    changes = {'enabled': not current.get('enabled', True)}
+                else:
+                    updates = operation.get('changes')
+                    if not isinstance(updates, dict):
+                        raise ValueError("'changes' must be a JSON object")
+                    changes = {
+                        k: v for k, v in self._sanitize_updates(updates).items()
+                        if k not in HEALTH_FIELDS
+                    }
+                    if not changes:
+                        raise ValueError("No valid fields provided")
+                    changes = self._mirror_primary_upstream(current, changes)
+
+                if 'path' in changes:
+                    self._check_mount(changes['path'], route_id, taken=taken)
+                    taken.pop(tuple(RoutePathIndex.segments(current.get('path', ''))), None)
+                    taken[tuple(RoutePathIndex.segments(changes['path']))] = route_id
+                changes['updated_at'] = datetime.now().isoformat()
+                routes[route_id] = current.with_changes(changes)
+                planned.append(('update', routes[route_id], changes))
+                result['status'] = 'updated'
+            except (ValueError, RouteConflictError) as e:
+                result.update(status='error', error=str(e))
+            except (TypeError, AttributeError) as e:
+                # A field of the wrong JSON type that no validator anticipated
+                result.update(status='error', error=f"Malformed operation: {e}")
+            results.append(result)
+
+        return planned, results
+
+    def _commit_batch(self, planned: List[Tuple]):
+        """Persist a planned batch and apply it to the cache (caller holds the lock)."""
+        self.storage.write_batch([
+            (kind, *(arg.to_dict() if isinstance(arg, Route) else arg for arg in args))
+            for kind, *args in planned
+        ])
+
+        version = self._bump()
+        for kind, *args in planned:
+            if kind == 'insert':
+                route = args[0]
+                self._by_id[route['id']] = route
+                self._paths.insert(route['path'], route['id'])
+                self._search.add(route)
+                self._config_revs[route['id']] = version
+                self._log_change(route['id'], 'added')
+            elif kind == 'update':
+                route, changes = args
+                if 'path' in changes:
+                    self._paths.remove(self._by_id[route['id']].get('path', ''), route['id'])
+                    self._paths.insert(route['path'], route['id'])
+                self._by_id[route['id']] = route
+                self._search.add(route)
+                self._stale.discard(route['id'])
+                self._config_revs[route['id']] = version
+                self._log_change(route['id'], 'updated')
+            else:
+                route_id = args[0]
+                route = self._by_id.pop(route_id)
+                self._paths.remove(route.get('path', ''), route_id)
+                self._search.remove(route_id)
+                self._config_revs.pop(route_id, None)
+                self._health_revs.pop(route_id, None)
+                self._views.pop(route_id, None)
+                self._stale.discard(route_id)
+                self.health.remove(route_id)
+                self._log_change(route_id, 'deleted')
+
+    def persist_upgrades(self, batch_size: Optional[int] = None) -> int:
+        """Write up to ``batch_size`` upgraded documents back to storage.
+
+        By default TinyDB gets every stale document in one batch, since each
+        of its writes rewrites the whole file; SQLite and the journal write
+        200 per batch so request handlers get the lock in between.
+
+        Returns how many were written; 0 once every document is current.
+        The in-memory routes are already upgraded, so this only changes
+        what is on disk and does not bump versions or ETags.
+        """
+        if batch_size is None:
+            batch_size = len(self._stale) if self.storage.rewrites_whole_file else 200
+        with self._writing():
+            route_ids = [route_id for route_id in itertools.islice(self._stale, batch_size)]
+            docs = [self._by_id[route_id].to_dict() for route_id in route_ids if route_id in self._by_id]
+            if docs:
+                self.storage.write_batch([('update', doc, doc) for doc in docs])
+            self._stale.difference_update(route_ids)
+            return len(docs)
+
+    def _persist_upgrades_worker(self):
+        log.info("Upgrading %d stored routes to schema v%d in the background", len(self._stale), ROUTE_SCHEMA_VERSION)
+        try:
+            while self.persist_upgrades():
+                time.sleep(0.05)  # leave the lock to request handlers between batches
+        except Exception as e:
+            log.error("Background route upgrade failed: %s", e)
+
+    def get_all_routes(self, enabled_only: bool = False) -> List[Mapping]:
         """Get all routes"""
-        with self._lock:
-            if enabled_only:
-                return self.routes.search(self.Route.enabled == True)
-            return self.routes.all()
+        routes = self.snapshot().routes
+        if enabled_only:
+            return [r for r in routes if r.get('enabled') == True]
+        return list(routes)
     
-    def get_route_by_path(self, path: str) -> Optional[Dict]:
+    def get_route_by_path(self, path: str) -> Optional[Mapping]:
         """Get route by path"""
+        if not path:
+            return None
+        self._refresh()
         with self._lock:
-            result = self.routes.search(self.Route.path == path)
-            return result[0] if result else None
+            route_id = self._paths.exact(path)
+            return self._view(self._by_id[route_id]) if route_id else None
+
+    def match_route(self, path: str) -> Optional[Mapping]:
+        """Get the route whose mount is the longest prefix of ``path``"""
+        if not path:
+            return None
+        self._refresh()
+        with self._lock:
+            route_id = self._paths.longest_prefix(path)
+            return self._view(self._by_id[route_id]) if route_id else None
     
-    def get_route_by_id(self, route_id: str) -> Optional[Dict]:
+    def get_route_by_id(self, route_id: str) -> Optional[Mapping]:
         """Get route by ID"""
+        self._refresh()
         with self._lock:
-            result = self.routes.search(self.Route.id == route_id)
-            return result[0] if result else None
+            route = self._by_id.get(route_id)
+            return self._view(route) if route else None
     
-    def update_route(self, route_id: str, updates: Dict) -> bool:
-        """Update a route"""
+    def update_route(self, route_id: str, updates: Dict,
+                     if_match: Optional[Iterable[str]] = None) -> bool:
+        """Update a route
+
+        When ``if_match`` is given the update only happens if it contains the
+        route's current ETag (or ``*``); otherwise RouteConflictError is raised.
+        """
         if not updates:
             return False
 
@@ -118,17 +1287,65 @@ class RouteManager:
         if not sanitized:
             return False
 
-        sanitized['updated_at'] = datetime.now().isoformat()
+        health = {k: v for k, v in sanitized.items() if k in HEALTH_FIELDS}
+        config = {k: v for k, v in sanitized.items() if k not in HEALTH_FIELDS}
 
-        with self._lock:
-            result = self.routes.update(sanitized, self.Route.id == route_id)
-            return len(result) > 0
+        with self._writing() if config else self._lock:
+            current = self._by_id.get(route_id)
+            if current is None:
+                return False
+            self._check_if_match(route_id, if_match)
+
+            if config:
+                self._write_config(route_id, current, config)
+            if health:
+                self._store_health(route_id, health)
+            return True
+
+    def _write_config(self, route_id: str, current: Route, config: Dict):
+        """Write configuration changes through to disk and the cache."""
+        config = self._mirror_primary_upstream(current, config)
+        config['updated_at'] = datetime.now().isoformat()
+
+        new_path = config.get('path')
+        if new_path is not None:
+            self._check_mount(new_path, route_id)
+
+        # The cached copy never carries health fields, so writing it back
+        # also drops probe results left inline by older versions
+        updated = current.with_changes(config)
+        self.storage.update(updated.to_dict(), config)
+        self._stale.discard(route_id)
+
+        if new_path is not None:
+            self._paths.remove(current.get('path', ''), route_id)
+            self._paths.insert(new_path, route_id)
+        self._by_id[route_id] = updated
+        if any(field in config for field, _ in SEARCH_FIELDS):
+            self._search.add(updated)
+        self._config_revs[route_id] = self._bump()
+        self._log_change(route_id, 'updated')
     
-    def delete_route(self, route_id: str) -> bool:
+    def delete_route(self, route_id: str, if_match: Optional[Iterable[str]] = None) -> bool:
         """Delete a route"""
-        with self._lock:
-            result = self.routes.remove(self.Route.id == route_id)
-            return len(result) > 0
+        with self._writing():
+            current = self._by_id.get(route_id)
+            if current is None:
+                return False
+            self._check_if_match(route_id, if_match)
+
+            self.storage.delete(route_id)
+            del self._by_id[route_id]
+            self._stale.discard(route_id)
+            self._config_revs.pop(route_id, None)
+            self._health_revs.pop(route_id, None)
+            self._views.pop(route_id, None)
+            self._bump()
+            self._log_change(route_id, 'deleted')
+            self.health.remove(route_id)
+            self._paths.remove(current.get('path', ''), route_id)
+            self._search.remove(route_id)
+            return True
     
     def update_route_status(self, route_id: str, status: str = None, last_check: str = None,
                             state: str = None, reason: str = None, http_status: int = None,
@@ -155,23 +1372,51 @@ class RouteManager:
             updates['last_error'] = last_error
         if retries_used is not None:
             updates['retries_used'] = retries_used
-            
-        return self.update_route(route_id, updates)
+
+        with self._lock:
+            if route_id not in self._by_id:
+                return False
+            self._store_health(route_id, self._sanitize_updates(updates))
+            return True
+
+    def _store_health(self, route_id: str, fields: Dict):
+        """Record health fields and snapshot them once the window elapsed."""
+        self.health.update(route_id, fields)
+        self._health_revs[route_id] = self._bump(config=False)
+        self._log_change(route_id, 'updated')
+        if time.monotonic() - self._last_status_flush >= self.status_flush_interval:
+            self.flush_status()
+
+    def flush_status(self) -> bool:
+        """Snapshot buffered health state in one atomic write.
+
+        Returns True if a snapshot was written.
+        """
+        with self._lock:
+            self._last_status_flush = time.monotonic()
+            return self.health.snapshot()
+
+    def close(self):
+        """Flush buffered writes and release the database."""
+        with self._lock:
+            self.flush_status()
+            self.storage.close()
+            if self._coordinator is not None:
+                self._coordinator.close()
     
-    def search_routes(self, query: str) -> List[Dict]:
-        """Search routes by name or path"""
-        query = query.lower()
+    def search_routes(self, query: str, limit: Optional[int] = None) -> List[Mapping]:
+        """Search routes by name, path, target IP or port, best matches first"""
+        self._refresh()
         with self._lock:
-            return self.routes.search(
-                (self.Route.name.search(query, flags=re.IGNORECASE)) |
-                (self.Route.path.search(query, flags=re.IGNORECASE))
-            )
+            return [self._view(self._by_id[route_id]) for route_id in self._search.search(query, limit)]
     
     @staticmethod
     def validate_path(path: str) -> str:
         """Validate and sanitize route path"""
         if not path:
             raise ValueError("Path cannot be empty")
+        if not isinstance(path, str):
+            raise ValueError("Path must be a string")
         
         # Ensure path starts with /
         if not path.startswith('/'):
@@ -252,9 +1497,145 @@ class RouteManager:
             raise ValueError("Protocol must be either 'http' or 'https'")
         return value
 
+    @classmethod
+    def validate_upstreams(cls, upstreams) -> List[Dict]:
+        """Validate a list of upstreams (``{'ip', 'port', 'weight'}`` dicts or
+        ``"ip:port"`` strings) and return them as plain dicts.
+
+        Every upstream must pass the same private-IP rules as ``target_ip``.
+        """
+        if not isinstance(upstreams, (list, tuple)):
+            raise ValueError("Upstreams must be a list")
+        if len(upstreams) > MAX_UPSTREAMS:
+            raise ValueError(f"A route can have at most {MAX_UPSTREAMS} upstreams")
+
+        cleaned: List[Dict] = []
+        seen = set()
+        for upstream in upstreams:
+            if isinstance(upstream, str):
+                ip, sep, port = upstream.rpartition(':')
+                if not sep:
+                    raise ValueError(f"Upstream '{upstream}' must be ip:port")
+                upstream = {'ip': ip.strip('[]'), 'port': port}
+            if not isinstance(upstream, Mapping):
+                raise ValueError("Each upstream must be an object with ip and port")
+
+            ip = upstream.get('ip', upstream.get('target_ip'))
+            cls.validate_ip(ip)
+            port = cls.validate_port(upstream.get('port', upstream.get('target_port')))
+            try:
+                weight = int(upstream.get('weight', 1))
+            except (TypeError, ValueError):
+                raise ValueError("Upstream weight must be an integer between 1 and 100") from None
+            if not 1 <= weight <= 100:
+                raise ValueError("Upstream weight must be an integer between 1 and 100")
+
+            key = (str(ipaddress.ip_address(ip)), port)
+            if key in seen:
+                raise ValueError(f"Duplicate upstream {ip}:{port}")
+            seen.add(key)
+            cleaned.append({'ip': str(ip), 'port': port, 'weight': weight})
+        return cleaned
+
+    @staticmethod
+    def validate_lb_policy(policy: str) -> str:
+        """Ensure the load-balancing selection policy is supported."""
+        value = str(policy or '').strip().lower()
+        if value not in LB_POLICIES:
+            raise ValueError(f"Load balancing policy must be one of: {', '.join(LB_POLICIES)}")
+        return value
+
+    @staticmethod
+    def _validate_bounded_int(value, label: str, minimum: int, maximum: int) -> int:
+        try:
+            coerced = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{label} must be an integer between {minimum} and {maximum}") from None
+        if not minimum <= coerced <= maximum:
+            raise ValueError(f"{label} must be an integer between {minimum} and {maximum}")
+        return coerced
+
+    def _sanitize_load_balancing(self, fields: Mapping) -> Dict:
+        """Validate the LOAD_BALANCING_FIELDS present in ``fields``."""
+        sanitized: Dict = {}
+
+        if 'upstreams' in fields:
+            sanitized['upstreams'] = self.validate_upstreams(fields['upstreams'])
+
+        if 'lb_policy' in fields:
+            sanitized['lb_policy'] = self.validate_lb_policy(fields['lb_policy'])
+
+        if 'lb_try_duration' in fields:
+            sanitized['lb_try_duration'] = self._validate_bounded_int(fields['lb_try_duration'], "lb_try_duration (seconds)", 0, 300)
+
+        if 'lb_retries' in fields:
+            sanitized['lb_retries'] = self._validate_bounded_int(fields['lb_retries'], "lb_retries", 0, 10)
+
+        if 'fail_duration' in fields:
+            sanitized['fail_duration'] = self._validate_bounded_int(fields['fail_duration'], "fail_duration (seconds)", 0, 3600)
+
+        if 'max_fails' in fields:
+            sanitized['max_fails'] = self._validate_bounded_int(fields['max_fails'], "max_fails", 1, 100)
+
+        return sanitized
+
+    @staticmethod
+    def validate_upstream_http_version(version: str) -> str:
+        """Ensure the upstream HTTP version is supported."""
+        value = str(version or 'auto').strip().lower()
+        if value not in UPSTREAM_HTTP_VERSIONS:
+            raise ValueError(f"Upstream HTTP version must be one of: {', '.join(UPSTREAM_HTTP_VERSIONS)}")
+        return value
+
+    def _sanitize_transport(self, fields: Mapping) -> Dict:
+        """Validate the TRANSPORT_FIELDS present in ``fields``."""
+        sanitized: Dict = {}
+
+        if 'dial_timeout' in fields:
+            sanitized['dial_timeout'] = self._validate_bounded_int(fields['dial_timeout'], "dial_timeout (seconds)", 0, 60)
+
+        if 'response_header_timeout' in fields:
+            sanitized['response_header_timeout'] = self._validate_bounded_int(fields['response_header_timeout'], "response_header_timeout (seconds)", 0, 3600)
+
+        if 'keepalive' in fields:
+            sanitized['keepalive'] = self._coerce_bool(fields['keepalive'])
+
+        if 'keepalive_idle_conns_per_host' in fields:
+            sanitized['keepalive_idle_conns_per_host'] = self._validate_bounded_int(fields['keepalive_idle_conns_per_host'], "keepalive_idle_conns_per_host", 0, 1024)
+
+        if 'max_conns_per_host' in fields:
+            sanitized['max_conns_per_host'] = self._validate_bounded_int(fields['max_conns_per_host'], "max_conns_per_host", 0, 10000)
+
+        if 'upstream_http_version' in fields:
+            sanitized['upstream_http_version'] = self.validate_upstream_http_version(fields['upstream_http_version'])
+
+        if 'max_request_body_mb' in fields:
+            sanitized['max_request_body_mb'] = self._validate_bounded_int(fields['max_request_body_mb'], "max_request_body_mb", 0, 10240)
+
+        return sanitized
+
+    @staticmethod
+    def _mirror_primary_upstream(current: Route, changes: Dict) -> Dict:
+        """Keep ``target_ip``/``target_port`` and the first upstream in step."""
+        changes = dict(changes)
+        upstreams = changes.get('upstreams')
+        if upstreams:
+            changes['target_ip'] = upstreams[0]['ip']
+            changes['target_port'] = upstreams[0]['port']
+        elif upstreams is None and current.upstreams and ('target_ip' in changes or 'target_port' in changes):
+            first = current.upstreams[0]
+            primary = {
+                'ip': changes.get('target_ip', first.ip),
+                'port': changes.get('target_port', first.port),
+                'weight': first.weight,
+            }
+            changes['upstreams'] = [primary] + [u._asdict() for u in current.upstreams[1:]]
+        return changes
+
     def _sanitize_updates(self, updates: Dict) -> Dict:
         """Whitelist and validate update fields."""
-        sanitized: Dict = {}
+        sanitized: Dict = self._sanitize_load_balancing(updates)
+        sanitized.update(self._sanitize_transport(updates))
 
         if 'path' in updates:
             sanitized['path'] = self.validate_path(updates['path'])
@@ -117,7 +117,8 @@ function renderRoutes(routesList) {
             if (route.state === 'UP') {
                 badgeText = route.http_status ? `OK — ${route.http_status}` : 'OK';
             } else if (route.state === 'DEGRADED') {
-                badgeText = route.duration_ms ? `SLOW — ${(route.duration_ms / 1000).toFixed(1)}s` : 'SLOW';
+                if (route.reason === 'partial') badgeText = 'DEGRADED — Upstreams';
+                else badgeText = route.duration_ms ? `SLOW — ${(route.duration_ms / 1000).toFixed(1)}s` : 'SLOW';
             } else if (route.state === 'DOWN') {
                 if (route.reason === 'offline_dns') badgeText = 'DOWN — DNS';
                 else if (route.reason === 'offline_conn') badgeText = 'DOWN — Connect';
@@ -125,6 +126,7 @@ function renderRoutes(routesList) {
                 else if (route.reason === 'error_5xx') badgeText = route.http_status ? `DOWN — ${route.http_status}` : 'DOWN — 5xx';
                 else if (route.reason === 'error_exc') badgeText = 'DOWN — Error';
                 else if (route.reason === 'misconfig') badgeText = 'DOWN — Config';
+                else if (route.reason === 'unhealthy') badgeText = 'DOWN — Health check';
                 else badgeText = 'DOWN';
             } else {
                 badgeText = 'UNKNOWN';
@@ -171,13 +173,8 @@ function renderRoutes(routesList) {
 // Update Stats
 function updateStats(routesList) {
     const total = routesList.length;
-    // Handle both old status and new state systems
-    const online = routesList.filter(r => 
-        (r.state === 'UP') || (r.status === 'online')
-    ).length;
-    const offline = routesList.filter(r => 
-        (r.state === 'DOWN') || (r.status === 'offline')
-    ).length;
+    const online = routesList.filter(r => r.state === 'UP').length;
+    const offline = routesList.filter(r => r.state === 'DOWN').length;
     const enabled = routesList.filter(r => r.enabled).length;
     
     const statElements = {
@@ -194,22 +191,35 @@ function updateStats(routesList) {
     if (statElements.enabled) statElements.enabled.textContent = enabled;
 }
 
-// Search/Filter Routes with debouncing
-const debouncedFilterRoutes = Utils.debounce(function() {
-    const searchTerm = document.getElementById('search-input').value.toLowerCase();
+// Search/Filter Routes with debouncing (ranked server-side search)
+let searchSequence = 0;
+
+const debouncedFilterRoutes = Utils.debounce(async function() {
+    const searchTerm = document.getElementById('search-input').value.trim();
+    const sequence = ++searchSequence;
     
     if (!searchTerm) {
         renderRoutes(routes);
         return;
     }
     
-    const filtered = routes.filter(route => 
-        route.path.toLowerCase().includes(searchTerm) ||
-        route.name.toLowerCase().includes(searchTerm) ||
-        route.target_ip.includes(searchTerm)
-    );
-    
-    renderRoutes(filtered);
+    try {
+        const params = new URLSearchParams({ q: searchTerm, limit: Config.UI.SEARCH_LIMIT });
+        const data = await Utils.apiRequest(`${Config.API.ENDPOINTS.ROUTES_SEARCH}?${params}`);
+        // Ignore responses that arrive after a newer search was started
+        if (sequence === searchSequence) {
+            renderRoutes(data.routes);
+        }
+    } catch (error) {
+        if (sequence !== searchSequence) return;
+        // Fall back to filtering the routes already loaded
+        const term = searchTerm.toLowerCase();
+        renderRoutes(routes.filter(route => 
+            route.path.toLowerCase().includes(term) ||
+            route.name.toLowerCase().includes(term) ||
+            route.target_ip.includes(term)
+        ));
+    }
 }, Config.UI.DEBOUNCE_DELAY);
 
 // Wrapper function for template compatibility
@@ -263,8 +273,16 @@ function editRoute(routeId) {
     document.getElementById('target_path').value = route.target_path || '/';
     document.getElementById('protocol').value = route.protocol;
     document.getElementById('timeout').value = route.timeout || 30;
+    document.getElementById('dial_timeout').value = route.dial_timeout || 0;
+    document.getElementById('response_header_timeout').value = route.response_header_timeout || 0;
+    document.getElementById('max_conns_per_host').value = route.max_conns_per_host || 0;
+    document.getElementById('keepalive_idle_conns_per_host').value = route.keepalive_idle_conns_per_host || 0;
+    document.getElementById('upstream_http_version').value = route.upstream_http_version || 'auto';
+    document.getElementById('max_request_body_mb').value = route.max_request_body_mb || 0;
+    document.getElementById('keepalive').checked = route.keepalive !== false;
     document.getElementById('enabled').checked = route.enabled;
     document.getElementById('health_check').checked = route.health_check;
+    document.getElementById('websocket').checked = !!route.websocket;
     
     document.getElementById('route-modal').classList.add('show');
 }
@@ -289,8 +307,16 @@ async function handleSubmit(event) {
         target_path: formData.get('target_path') || '/',
         protocol: formData.get('protocol'),
         timeout: parseInt(formData.get('timeout')),
+        dial_timeout: parseInt(formData.get('dial_timeout')) || 0,
+        response_header_timeout: parseInt(formData.get('response_header_timeout')) || 0,
+        max_conns_per_host: parseInt(formData.get('max_conns_per_host')) || 0,
+        keepalive_idle_conns_per_host: parseInt(formData.get('keepalive_idle_conns_per_host')) || 0,
+        upstream_http_version: formData.get('upstream_http_version') || 'auto',
+        max_request_body_mb: parseInt(formData.get('max_request_body_mb')) || 0,
+        keepalive: formData.get('keepalive') === 'on',
         enabled: formData.get('enabled') === 'on',
-        health_check: formData.get('health_check') === 'on'
+        health_check: formData.get('health_check') === 'on',
+        websocket: formData.get('websocket') === 'on'
     };
     
     try {
@@ -318,7 +344,12 @@ async function handleSubmit(event) {
             throw new Error(result.error || 'Failed to save route');
         }
         
-        showToast(routeId ? 'Route updated successfully' : 'Route created successfully', 'success');
+        const saved = routeId ? 'Route updated successfully' : 'Route created successfully';
+        if (result.warnings && result.warnings.length) {
+            showToast(`${saved}. ${result.warnings.join('. ')}`, 'info');
+        } else {
+            showToast(saved, 'success');
+        }
         closeModal();
         Utils.clearCache('routes'); // Clear cache to force refresh
         await loadRoutes();
@@ -8,6 +8,7 @@ window.Config = {
         BASE_URL: '',
         ENDPOINTS: {
             ROUTES: '/api/routes',
+            ROUTES_SEARCH: '/api/routes/search',
             EMAILS: '/api/emails',
             LOGS: '/api/logs'
         },
@@ -19,6 +20,7 @@ window.Config = {
     UI: {
         TOAST_DURATION: 3000,
         DEBOUNCE_DELAY: 300,
+        SEARCH_LIMIT: 100,
         CACHE_DURATION: 5 * 60 * 1000, // 5 minutes
         PARTICLE_COUNT: 50,
         MAX_LOG_ENTRIES: 200
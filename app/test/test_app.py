@@ -4,6 +4,7 @@ Unit tests for Flask app (Route Manager Control Plane)
 import pytest
 from unittest.mock import patch, Mock
 from app import app, AUTHORIZED_EMAILS
+import json
 import tempfile
 import os
 
@@ -317,3 +318,286 @@ def test_refresh_emails_endpoint(authorized_client):
         assert 'count' in data
     elif response.status_code == 404:
         pass  # Endpoint does not exist, acceptable
+
+
+def test_api_get_routes_etag(authorized_client):
+    """Unchanged route lists are answered with 304 Not Modified."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    first = authorized_client.get('/api/routes', headers=headers)
+    etag = first.headers['ETag']
+
+    cached = authorized_client.get('/api/routes', headers={**headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+    import app as app_module
+    app_module.route_manager.add_route('/etag', 'ETag', '10.0.0.100', 8080)
+    changed = authorized_client.get('/api/routes', headers={**headers, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_update_route_if_match(mock_sync, authorized_client):
+    """Updates with a stale If-Match are rejected with 412."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    import app as app_module
+    route = app_module.route_manager.add_route('/ifmatch', 'IfMatch', '10.0.0.100', 8080)
+
+    etag = authorized_client.get(f"/api/routes/{route['id']}", headers=headers).headers['ETag']
+
+    ok = authorized_client.put(f"/api/routes/{route['id']}", json={'name': 'One'},
+                               headers={**headers, 'If-Match': etag})
+    assert ok.status_code == 200
+
+    stale = authorized_client.put(f"/api/routes/{route['id']}", json={'name': 'Two'},
+                                  headers={**headers, 'If-Match': etag})
+    assert stale.status_code == 412
+
+    toggle = authorized_client.post(f"/api/routes/{route['id']}/toggle",
+                                    headers={**headers, 'If-Match': etag})
+    assert toggle.status_code == 412
+    assert app_module.route_manager.get_route_by_id(route['id'])['name'] == 'One'
+
+
+def test_api_route_changes(authorized_client):
+    """The change feed endpoint returns incremental changes."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    import app as app_module
+    start = authorized_client.get('/api/routes/changes?since=0', headers=headers).get_json()
+    assert start['full_reload'] is True
+
+    version = app_module.route_manager.version
+    route = app_module.route_manager.add_route('/feed', 'Feed', '10.0.0.100', 8080)
+
+    response = authorized_client.get(
+        f"/api/routes/changes?since={version}&epoch={start['epoch']}", headers=headers
+    )
+    data = response.get_json()
+    assert data['full_reload'] is False
+    assert data['changes'] == [{'op': 'added', 'id': route['id'], 'route': route}]
+
+    other_epoch = authorized_client.get(
+        f'/api/routes/changes?since={version}&epoch=deadbeef', headers=headers
+    ).get_json()
+    assert other_epoch['full_reload'] is True
+
+
+def test_api_route_status_prefix_match(client):
+    """Route status resolves nested paths to their mount."""
+    import app as app_module
+    app_module.route_manager.add_route('/jellyfin', 'Jellyfin', '10.0.0.100', 8096)
+
+    response = client.get('/api/route-status/jellyfin/web/index.html')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['name'] == 'Jellyfin'
+    assert data['path'] == '/jellyfin/web/index.html'
+
+    assert client.get('/api/route-status/jellyfinx').status_code == 404
+
+
+def test_api_search_routes(authorized_client):
+    """The search endpoint returns ranked, limited results."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    import app as app_module
+    app_module.route_manager.add_route('/jellyfin', 'Jellyfin', '10.0.0.100', 8096)
+    app_module.route_manager.add_route('/jelly2', 'Jelly Two', '10.0.0.101', 8097)
+
+    data = authorized_client.get('/api/routes/search?q=jelly&limit=1', headers=headers).get_json()
+    assert data['count'] == 1
+    assert data['routes'][0]['path'] == '/jelly2'
+
+    empty = authorized_client.get('/api/routes/search?q=', headers=headers).get_json()
+    assert empty['routes'] == []
+
+    bad = authorized_client.get('/api/routes/search?q=x&limit=abc', headers=headers)
+    assert bad.status_code == 400
+
+
+def test_api_get_routes_paginated(authorized_client, monkeypatch):
+    """Paged listings return an envelope, projected fields and stream large results."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    import app as app_module
+    for i in range(5):
+        app_module.route_manager.add_route(f'/page{i}', f'Page {i}', '10.0.0.100', 8080 + i)
+
+    data = authorized_client.get('/api/routes?limit=2&fields=name', headers=headers).get_json()
+    assert data['total'] == 5
+    assert data['routes'] == [
+        {'id': data['routes'][0]['id'], 'name': 'Page 0'},
+        {'id': data['routes'][1]['id'], 'name': 'Page 1'},
+    ]
+
+    rest = authorized_client.get(f"/api/routes?limit=10&cursor={data['next_cursor']}", headers=headers).get_json()
+    assert [r['name'] for r in rest['routes']] == ['Page 2', 'Page 3', 'Page 4']
+    assert rest['next_cursor'] is None
+
+    monkeypatch.setattr('app.ROUTES_STREAM_THRESHOLD', 1)
+    streamed = authorized_client.get('/api/routes?sort=-name&fields=path', headers=headers)
+    assert streamed.is_streamed
+    assert [r['path'] for r in streamed.get_json()] == ['/page4', '/page3', '/page2', '/page1', '/page0']
+
+    paged = authorized_client.get('/api/routes?limit=3', headers=headers)
+    assert paged.get_json()['count'] == 3
+
+    assert authorized_client.get('/api/routes?sort=bogus', headers=headers).status_code == 400
+    assert authorized_client.get('/api/routes?cursor=%%%', headers=headers).status_code == 400
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_batch_routes(mock_sync, authorized_client):
+    """A batch is applied with a single Caddy sync and per-item results."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    operations = [
+        {'op': 'create', 'route': {'path': f'/svc{i}', 'name': f'Service {i}',
+                                   'target_ip': '10.0.0.100', 'target_port': 8000 + i}}
+        for i in range(3)
+    ]
+    response = authorized_client.post('/api/routes/batch', json={'operations': operations}, headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['applied'] is True
+    assert [r['status'] for r in data['results']] == ['created'] * 3
+    assert mock_sync.call_count == 1
+
+    rejected = authorized_client.post('/api/routes/batch', json=[
+        {'op': 'delete', 'id': data['results'][0]['id']},
+        {'op': 'toggle', 'id': 'missing'},
+    ], headers=headers)
+    assert rejected.status_code == 400
+    assert [r['status'] for r in rejected.get_json()['results']] == ['skipped', 'error']
+    assert mock_sync.call_count == 1
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_route_upstreams(mock_sync, authorized_client):
+    """Routes accept several upstreams; public IPs are still rejected."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    route = {'path': '/pool', 'name': 'Pool', 'lb_policy': 'least_conn',
+             'upstreams': ['192.168.1.10:8000', '192.168.1.11:8000']}
+    created = authorized_client.post('/api/routes', json=route, headers=headers)
+    assert created.status_code == 201
+    data = created.get_json()
+    assert data['target_ip'] == '192.168.1.10'
+    assert len(data['upstreams']) == 2
+
+    rejected = authorized_client.put(f"/api/routes/{data['id']}", json={'upstreams': ['8.8.8.8:53']}, headers=headers)
+    assert rejected.status_code == 400
+
+    updated = authorized_client.put(f"/api/routes/{data['id']}", json={'lb_retries': 2}, headers=headers)
+    assert updated.get_json()['route']['lb_retries'] == 2
+
+    tuned = authorized_client.put(f"/api/routes/{data['id']}", json={'max_conns_per_host': 32, 'dial_timeout': 2}, headers=headers)
+    assert tuned.get_json()['route']['max_conns_per_host'] == 32
+    assert authorized_client.put(f"/api/routes/{data['id']}", json={'upstream_http_version': '3'}, headers=headers).status_code == 400
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_route_write_without_etag(mock_sync, authorized_client):
+    """A route deleted right after a write is answered without an ETag."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    route = {'path': '/gone', 'name': 'Gone', 'target_ip': '192.168.1.10', 'target_port': 8000}
+    route_id = authorized_client.post('/api/routes', json=route, headers=headers).get_json()['id']
+
+    with patch('app.route_manager.route_etag', return_value=None):
+        toggled = authorized_client.post(f'/api/routes/{route_id}/toggle', headers=headers)
+        updated = authorized_client.put(f'/api/routes/{route_id}', json={'name': 'Still gone'}, headers=headers)
+
+    assert toggled.status_code == 200 and 'ETag' not in toggled.headers
+    assert updated.status_code == 200 and 'ETag' not in updated.headers
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_route_overlap_warnings(mock_sync, authorized_client):
+    """Nested mounts are accepted but reported as warnings."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    outer = {'path': '/app', 'name': 'App', 'target_ip': '192.168.1.10', 'target_port': 8000}
+    created = authorized_client.post('/api/routes', json=outer, headers=headers)
+    assert created.status_code == 201 and 'warnings' not in created.get_json()
+
+    inner = dict(outer, path='/other', name='API')
+    nested = authorized_client.post('/api/routes', json=dict(inner, path='/app/api'), headers=headers)
+    assert nested.status_code == 201
+    assert nested.get_json()['warnings'] == ["Path '/app/api' is inside '/app' and takes precedence for its subpaths"]
+
+    moved = authorized_client.post('/api/routes', json=inner, headers=headers).get_json()
+    updated = authorized_client.put(f"/api/routes/{moved['id']}", json={'path': '/app/api/v2'}, headers=headers)
+    assert len(updated.get_json()['warnings']) == 2
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_caddy_sync_status(mock_sync, authorized_client):
+    """A failed sync stays pending and is reported until a later sync succeeds."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    assert authorized_client.get('/api/caddy/sync').status_code == 403
+
+    mock_sync.side_effect = Exception('connection refused')
+    route = {'path': '/svc', 'name': 'Service', 'target_ip': '10.0.0.100', 'target_port': 8000}
+    created = authorized_client.post('/api/routes', json=route, headers=headers)
+    assert created.status_code == 201
+
+    status = authorized_client.get('/api/caddy/sync', headers=headers).get_json()
+    assert status['pending'] is True
+    assert status['failures'] == 1
+    assert status['last_error'] == 'connection refused'
+    assert isinstance(status['admin_calls'], dict)
+
+    mock_sync.side_effect = None
+    mock_sync.return_value = {'ok': True, 'mode': 'full'}
+    authorized_client.post(f"/api/routes/{created.get_json()['id']}/toggle", headers=headers)
+
+    status = authorized_client.get('/api/caddy/sync', headers=headers).get_json()
+    assert status['pending'] is False
+    assert status['failures'] == 0
+    assert status['applied_generation'] == status['requested_generation']
+    assert mock_sync.call_count == 2
+
+
+@patch('app.caddy_mgr.sync')
+def test_api_export_import_routes(mock_sync, authorized_client):
+    """Exported NDJSON can be imported back; existing paths are updated."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    import app as app_module
+    app_module.route_manager.add_route('/export', 'Export', '10.0.0.100', 8080)
+
+    exported = authorized_client.get('/api/routes/export', headers=headers)
+    assert exported.mimetype == 'application/x-ndjson'
+    lines = exported.get_data(as_text=True).splitlines()
+    assert len(lines) == 1
+    assert 'status' not in json.loads(lines[0])
+
+    changed = json.loads(lines[0])
+    changed['name'] = 'Renamed'
+    body = json.dumps(changed) + '\n\n' + json.dumps({
+        'path': '/imported', 'name': 'Imported', 'target_ip': '10.0.0.101', 'target_port': 9000,
+    }) + '\n'
+    response = authorized_client.post('/api/routes/import', data=body,
+                                      content_type='application/x-ndjson', headers=headers)
+    assert response.status_code == 200
+    assert [r['status'] for r in response.get_json()['results']] == ['updated', 'created']
+    assert app_module.route_manager.get_route_by_path('/export')['name'] == 'Renamed'
+    assert mock_sync.call_count == 1
+
+    bad = authorized_client.post('/api/routes/import', data='{not json}\n', headers=headers)
+    assert bad.status_code == 400
+
+
+def test_api_get_routes_serialized_once_per_version(authorized_client, monkeypatch):
+    """The full route list is serialized once and reused until routes change."""
+    headers = {'X-Forwarded-Email': 'test@example.com'}
+    import app as app_module
+    app_module.route_manager.add_route('/cached', 'Cached', '10.0.0.100', 8080)
+
+    calls = []
+    dumps = app_module.app.json.dumps
+    monkeypatch.setattr(app_module.app.json, 'dumps', lambda obj, **kw: (isinstance(obj, list) and calls.append(1)) or dumps(obj, **kw))
+
+    first = authorized_client.get('/api/routes', headers=headers).get_json()
+    second = authorized_client.get('/api/routes', headers=headers).get_json()
+    assert first == second and first[0]['path'] == '/cached'
+    assert len(calls) == 1
+
+    app_module.route_manager.add_route('/fresh', 'Fresh', '10.0.0.100', 8081)
+    assert len(authorized_client.get('/api/routes', headers=headers).get_json()) == 2
+    assert len(calls) == 2
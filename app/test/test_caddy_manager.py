@@ -4,7 +4,14 @@ Unit tests for CaddyManager
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 import json
-from caddy_manager import CaddyManager
+import threading
+import time
+import requests
+from urllib.parse import urlparse
+from caddy_manager import (
+    CaddyManager, CaddyConfigError, CaddyMetricsCollector, CaddySyncWorker,
+    histogram_quantile, parse_admin_address, parse_prometheus_text,
+)
 
 
 @pytest.fixture
@@ -95,6 +102,146 @@ def test_subdir_reverse_proxy_route_with_preserve_host(caddy_manager):
     assert route["handle"][0]["headers"]["request"]["set"]["Host"] == ["{http.request.host}"]
 
 
+def test_subdir_reverse_proxy_route_load_balancing(caddy_manager):
+    """Test that several upstreams get a selection policy, retries and passive health"""
+    route = caddy_manager._subdir_reverse_proxy_route(
+        "/api", "http", "192.168.1.10:8080",
+        upstreams=[("192.168.1.10:8080", 3), ("192.168.1.11:8080", 1)],
+        lb_policy="weighted", lb_try_duration=5, lb_retries=2, fail_duration=30, max_fails=2,
+    )
+    handler = route["handle"][0]
+
+    assert handler["upstreams"] == [{"dial": "192.168.1.10:8080"}, {"dial": "192.168.1.11:8080"}]
+    assert handler["load_balancing"] == {
+        "selection_policy": {"policy": "weighted_round_robin", "weights": [3, 1]},
+        "try_duration": "5s",
+        "retries": 2,
+    }
+    assert handler["health_checks"] == {"passive": {"fail_duration": "30s", "max_fails": 2}}
+
+
+def test_single_upstream_route_has_no_load_balancing(caddy_manager, sample_routes):
+    """Test that single-backend routes are emitted exactly as before"""
+    routes = caddy_manager._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+    handler = routes[0]["handle"][0]
+
+    assert handler["upstreams"] == [{"dial": "192.168.1.100:8096"}]
+    assert "load_balancing" not in handler and "health_checks" not in handler
+
+
+def test_build_config_uses_route_upstreams(caddy_manager, sample_routes):
+    """Test that a route's upstream list replaces its single target"""
+    sample_routes[0] = dict(
+        sample_routes[0],
+        upstreams=[{"ip": "192.168.1.100", "port": 8096, "weight": 1}, {"ip": "192.168.1.105", "port": 8096, "weight": 1}],
+        lb_policy="least_conn",
+    )
+    routes = caddy_manager._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+    handler = routes[0]["handle"][0]
+
+    assert [u["dial"] for u in handler["upstreams"]] == ["192.168.1.100:8096", "192.168.1.105:8096"]
+    assert handler["load_balancing"]["selection_policy"] == {"policy": "least_conn"}
+
+
+def test_route_transport_tuning(caddy_manager, sample_routes):
+    """Test that timeouts, connection limits, versions and body limits reach the transport"""
+    sample_routes[0] = dict(
+        sample_routes[0], timeout=30, response_header_timeout=45, dial_timeout=2, keepalive_idle_conns_per_host=8,
+        max_conns_per_host=64, upstream_http_version="2", max_request_body_mb=16,
+    )
+    sample_routes[1] = dict(sample_routes[1], protocol="https", upstream_http_version="2", keepalive=False)
+    routes = caddy_manager._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+    by_path = {r["match"][0]["path"][0]: r for r in routes if r.get("match") and "path" in r["match"][0]}
+
+    body_limit, proxy = by_path["/jellyfin"]["handle"]
+    assert body_limit == {"handler": "request_body", "max_size": 16 * 1024 * 1024}
+    assert proxy["transport"] == {
+        "protocol": "http",
+        "dial_timeout": "2s",
+        "response_header_timeout": "45s",
+        "keep_alive": {"max_idle_conns_per_host": 8},
+        "max_conns_per_host": 64,
+        "versions": ["h2c", "2"],
+    }
+
+    transport = by_path["/grafana"]["handle"][0]["transport"]
+    assert transport["versions"] == ["2"] and transport["keep_alive"] == {"enabled": False}
+    assert "tls" in transport
+
+
+def test_route_timeout_is_not_a_proxy_deadline(caddy_manager, sample_routes):
+    """Test that the health-probe timeout alone adds no transport limits"""
+    route = dict(sample_routes[0], timeout=30)
+    handler = caddy_manager._route_fragment(route)["handle"][0]
+
+    assert "transport" not in handler
+
+
+def test_websocket_route_streams(sample_routes):
+    """Test that websocket routes flush immediately and outlive config reloads"""
+    mgr = CaddyManager(admin_url="http://localhost:2019", stream_close_delay=120)
+    sample_routes[0] = dict(sample_routes[0], websocket=True, timeout=30)
+    routes = mgr._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+    by_path = {r["match"][0]["path"][0]: r for r in routes if r.get("match") and "path" in r["match"][0]}
+
+    streaming = by_path["/jellyfin"]["handle"][0]
+    assert streaming["flush_interval"] == -1
+    assert streaming["stream_close_delay"] == "120s"
+    assert "transport" not in streaming
+
+    regular = by_path["/grafana"]["handle"][0]
+    assert "flush_interval" not in regular and "stream_close_delay" not in regular
+
+
+def test_build_config_active_health_checks(sample_routes):
+    """Test that Caddy health mode adds an active check per health-checked route"""
+    mgr = CaddyManager(admin_url="http://localhost:2019", active_health=True,
+                       health_interval=60, health_timeout=3, health_expect_status=200)
+    sample_routes[0] = dict(sample_routes[0], health_check=True, timeout=2, target_path="/health")
+    sample_routes[1] = dict(sample_routes[1], health_check=False)
+    routes = mgr._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+
+    assert routes[0]["handle"][0]["health_checks"] == {
+        "active": {"uri": "/health", "interval": "60s", "timeout": "2s", "expect_status": 200},
+    }
+    assert "health_checks" not in routes[1]["handle"][0]
+
+
+def test_classify_upstreams(caddy_manager):
+    """Test that Caddy's upstream state maps onto UP, DEGRADED and DOWN"""
+    route = {
+        "upstreams": [{"ip": "10.0.0.1", "port": 80, "weight": 1}, {"ip": "10.0.0.2", "port": 80, "weight": 1}],
+        "fail_duration": 30,
+    }
+    healthy = {"address": "10.0.0.1:80", "num_requests": 2, "fails": 0, "healthy": True}
+    failing = {"address": "10.0.0.2:80", "num_requests": 0, "fails": 3}
+
+    assert caddy_manager.classify_upstreams(route, {"10.0.0.1:80": healthy, "10.0.0.2:80": dict(healthy, address="10.0.0.2:80")})["state"] == "UP"
+
+    partial = caddy_manager.classify_upstreams(route, {"10.0.0.1:80": healthy, "10.0.0.2:80": failing})
+    assert (partial["state"], partial["reason"], partial["status"]) == ("DEGRADED", "partial", "slow")
+
+    down = caddy_manager.classify_upstreams(route, {"10.0.0.1:80": dict(healthy, healthy=False), "10.0.0.2:80": failing})
+    assert (down["state"], down["reason"], down["success"]) == ("DOWN", "unhealthy", False)
+
+    assert caddy_manager.classify_upstreams({"target_ip": "10.0.0.9", "target_port": 80}, {"10.0.0.1:80": healthy}) is None
+
+
+def test_classify_upstreams_without_health_signal():
+    """Test that zero fails without a health flag gives no verdict rather than UP"""
+    mgr = CaddyManager(admin_url="http://localhost:2019", active_health=True, health_interval=60)
+    route = {"target_ip": "10.0.0.1", "target_port": 80, "health_check": True}
+    idle = {"address": "10.0.0.1:80", "num_requests": 0, "fails": 0}
+
+    assert mgr.classify_upstreams(route, {"10.0.0.1:80": idle}) is None
+    assert mgr.classify_upstreams(dict(route, fail_duration=30), {"10.0.0.1:80": idle}) is None
+    assert mgr.classify_upstreams(route, {"10.0.0.1:80": dict(idle, fails=1)})["state"] == "DOWN"
+
+    # Active checks alone do not switch on passive health
+    handler = mgr._route_fragment(dict(route, id="1", path="/svc"))["handle"][0]
+    assert "passive" not in handler["health_checks"]
+
+
 def test_build_config_structure(caddy_manager, sample_routes):
     """Test full config structure"""
     config = caddy_manager._build_config(sample_routes)
@@ -198,6 +345,210 @@ def test_sync_http_error(mock_put, caddy_manager, sample_routes):
         caddy_manager.sync(sample_routes)
 
 
+def _response(status_code=200, body=None):
+    response = Mock()
+    response.ok = status_code < 400
+    response.status_code = status_code
+    response.text = "" if body is None else json.dumps(body)
+    response.json.return_value = body
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{status_code} Error")
+    return response
+
+
+@pytest.fixture
+def admin_api(caddy_manager):
+    """
+    Mocked admin API session. Live routes can't be read unless `state["live"]`
+    is set; methods (or "METHOD /path") listed in `state["fail"]` answer 404.
+    """
+    state = {"live": None, "config": None, "fail": set()}
+
+    def handle(method, url, **kwargs):
+        if method in state["fail"] or f"{method} {urlparse(url).path}" in state["fail"]:
+            return _response(404, {"error": "unknown object ID"})
+        if method == "GET" and url.endswith("/config/"):
+            return _response(200, state["config"])
+        if method == "GET":
+            if state["live"] is None:
+                raise requests.exceptions.ConnectionError("refused")
+            return _response(200, state["live"])
+        return _response(200)
+
+    with patch.object(caddy_manager.session, "request", side_effect=handle) as mock_request:
+        mock_request.state = state
+        yield mock_request
+
+
+def _writes(admin_api):
+    """(method, url) of every non-GET admin call"""
+    return [c[0][:2] for c in admin_api.call_args_list if c[0][0] != "GET"]
+
+
+ROUTES_URL = "http://localhost:2019/config/apps/http/servers/srv0/routes"
+
+
+def test_build_config_tags_routes_with_id(caddy_manager, sample_routes):
+    """Test that generated routes carry a stable @id derived from the route id"""
+    config = caddy_manager._build_config(sample_routes)
+    routes = config["apps"]["http"]["servers"]["srv0"]["routes"]
+
+    assert [r["@id"] for r in routes] == ["route-1", "route-3", "route-2", "flask-portal"]
+
+
+def test_build_config_reuses_unchanged_fragments(caddy_manager, sample_routes):
+    """Test that fragments are memoized by content and rebuilt only on change"""
+    first = caddy_manager._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+    sample_routes[0] = dict(sample_routes[0], target_port=9000)
+    second = caddy_manager._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+
+    assert second[2] is first[2]  # /grafana untouched
+    assert second[0] is not first[0]
+    assert second[0]["handle"][0]["upstreams"] == [{"dial": "192.168.1.100:9000"}]
+
+
+def test_sync_toggle_sends_single_targeted_call(caddy_manager, sample_routes, admin_api):
+    """Test that after a full sync, a toggle only patches that route by @id"""
+    assert caddy_manager.sync(sample_routes)["mode"] == "full"
+    assert _writes(admin_api) == [("PATCH", ROUTES_URL)]
+
+    sample_routes[2] = dict(sample_routes[2], enabled=True)
+    result = caddy_manager.sync(sample_routes)
+
+    assert (result["mode"], result["operations"]) == ("incremental", 1)
+    assert _writes(admin_api)[1:] == [("PATCH", "http://localhost:2019/id/route-3")]
+    assert admin_api.call_args[1]["json"]["handle"][0]["handler"] == "reverse_proxy"
+
+
+def test_sync_without_changes_sends_nothing(caddy_manager, sample_routes, admin_api):
+    """Test that a sync with an unchanged config fingerprint makes no admin calls"""
+    caddy_manager.sync(sample_routes)
+    calls = admin_api.call_count
+    result = caddy_manager.sync([dict(r) for r in sample_routes])
+
+    assert result["mode"] == "noop"
+    assert admin_api.call_count == calls
+
+
+def test_sync_add_and_delete_are_targeted(caddy_manager, sample_routes, admin_api):
+    """Test that removed routes are deleted by @id and new ones inserted in place"""
+    caddy_manager.sync(sample_routes)
+
+    routes = [r for r in sample_routes if r["id"] != "2"]
+    routes.append({"id": "4", "path": "/x", "target_ip": "10.0.0.1", "target_port": 80, "enabled": True})
+    caddy_manager.sync(routes)
+
+    assert _writes(admin_api)[1:] == [
+        ("DELETE", "http://localhost:2019/id/route-2"),
+        ("PUT", f"{ROUTES_URL}/2"),
+    ]
+
+
+def test_sync_reorder_falls_back_to_full(caddy_manager, sample_routes, admin_api):
+    """Test that a path edit changing route order replaces the whole array"""
+    caddy_manager.sync(sample_routes)
+
+    sample_routes[1] = dict(sample_routes[1], path="/grafana-dashboards")
+    assert caddy_manager.sync(sample_routes)["mode"] == "full"
+
+    assert _writes(admin_api) == [("PATCH", ROUTES_URL)] * 2
+
+
+def test_sync_targeted_failure_falls_back_to_full(caddy_manager, sample_routes, admin_api):
+    """Test that a failed targeted call (e.g. Caddy restarted) triggers a full sync"""
+    caddy_manager.sync(sample_routes)
+    admin_api.state["fail"].add("DELETE")
+
+    assert caddy_manager.sync(sample_routes[:2])["mode"] == "full"
+    assert _writes(admin_api)[1:] == [
+        ("DELETE", "http://localhost:2019/id/route-3"),
+        ("PATCH", ROUTES_URL),
+    ]
+
+
+def test_sync_missing_routes_key_loads_atomically(caddy_manager, sample_routes, admin_api):
+    """Test that a failed PATCH installs the routes with one /load, never DELETE+PUT"""
+    admin_api.state["fail"].add("PATCH")
+    admin_api.state["config"] = {"admin": {"listen": ":2019"}, "apps": {"tls": {"automation": {}}}}
+
+    assert caddy_manager.sync(sample_routes)["mode"] == "full"
+
+    assert _writes(admin_api) == [("PATCH", ROUTES_URL), ("POST", "http://localhost:2019/load")]
+    loaded = admin_api.call_args[1]["json"]
+    assert loaded["apps"]["tls"] == {"automation": {}}  # the rest of the running config is kept
+    server = loaded["apps"]["http"]["servers"]["srv0"]
+    assert server["listen"] == [":8080"]
+    assert [r["@id"] for r in server["routes"]] == ["route-1", "route-3", "route-2", "flask-portal"]
+
+
+def test_failed_apply_rolls_back_to_last_good(caddy_manager, sample_routes, admin_api):
+    """Test that a partly applied update is rolled back when the full apply fails"""
+    caddy_manager.sync(sample_routes)
+    good = caddy_manager.applied_fingerprint
+
+    # The DELETE lands, the insert and both full-replace paths fail
+    admin_api.state["fail"].update({"PUT", "POST"})
+    admin_api.state["fail"].add("PATCH /config/apps/http/servers/srv0/routes")
+    routes = sample_routes[1:] + [{"id": "4", "path": "/x", "target_ip": "10.0.0.1", "target_port": 80}]
+    with pytest.raises(requests.exceptions.HTTPError):
+        caddy_manager.sync(routes)
+
+    # Rollback: Caddy can't confirm it still runs the good config, so it is re-pushed
+    admin_api.state["fail"].clear()
+    assert caddy_manager._rollback() is True
+    assert admin_api.call_args[0][:2] == ("PATCH", ROUTES_URL)
+    assert [r["@id"] for r in admin_api.call_args[1]["json"]][:3] == ["route-1", "route-3", "route-2"]
+    assert caddy_manager.applied_fingerprint == good
+
+
+def test_invalid_routes_are_not_pushed(caddy_manager, sample_routes, admin_api):
+    """Test that a routes array failing validation never reaches Caddy"""
+    sample_routes[0] = dict(sample_routes[0], target_port=70000)
+
+    with pytest.raises(CaddyConfigError, match="invalid upstream"):
+        caddy_manager.sync(sample_routes)
+    assert admin_api.call_count == 0
+
+
+def test_applied_config_history_is_bounded(sample_routes, admin_api):
+    """Test that only the last N applied configs are kept, newest first"""
+    mgr = CaddyManager(admin_url="http://localhost:2019", history_size=2)
+    with patch.object(mgr.session, "request", side_effect=admin_api.side_effect):
+        for port in (1, 2, 3):
+            sample_routes[0] = dict(sample_routes[0], target_port=port)
+            mgr.sync(sample_routes)
+
+    history = mgr.history()
+    assert len(history) == 2
+    assert history[0]["fingerprint"] == mgr.applied_fingerprint
+    assert [h["mode"] for h in history] == ["incremental", "incremental"]
+
+
+def test_admin_calls_are_timed(caddy_manager, sample_routes, admin_api):
+    """Test that admin calls are recorded per method and path pattern"""
+    caddy_manager.sync(sample_routes)
+    sample_routes[0] = dict(sample_routes[0], target_port=1)
+    caddy_manager.sync(sample_routes)
+    sample_routes[1] = dict(sample_routes[1], target_port=2)
+    caddy_manager.sync(sample_routes)
+
+    stats = caddy_manager.admin_stats()
+    assert stats["PATCH /id/*"]["count"] == 2
+    assert stats["PATCH /config/apps/http/servers/srv0/routes"]["count"] == 1
+    assert stats["GET /config/apps/http/servers/srv0/routes"]["errors"] == 1
+    assert stats["PATCH /id/*"]["max_ms"] >= stats["PATCH /id/*"]["avg_ms"] >= 0
+
+
+def test_unix_socket_admin_address():
+    """Test that Caddy's unix//path admin notation uses a Unix socket session"""
+    mgr = CaddyManager(admin_url="unix//run/caddy/admin.sock")
+    assert (mgr.admin_base, mgr.admin_socket) == ("http://localhost", "/run/caddy/admin.sock")
+    assert mgr.session.get_adapter("http://localhost/config/").socket_path == "/run/caddy/admin.sock"
+
+    assert parse_admin_address("unix:///tmp/admin.sock") == ("http://localhost", "/tmp/admin.sock")
+    assert parse_admin_address("http://caddy:2019/") == ("http://caddy:2019", None)
+
+
 @patch('caddy_manager.requests.get')
 @patch('socket.create_connection')
 @patch('socket.getaddrinfo')
@@ -440,3 +791,210 @@ def test_sync_builds_valid_json(caddy_manager, sample_routes):
     # Should be parseable
     parsed = json.loads(json_str)
     assert parsed == config
+
+
+def test_sync_skips_push_when_caddy_already_matches(caddy_manager, sample_routes, admin_api):
+    """Test that after a restart, a Caddy already running our routes is not re-pushed"""
+    live = caddy_manager._build_config(sample_routes)["apps"]["http"]["servers"]["srv0"]["routes"]
+    admin_api.state["live"] = json.loads(json.dumps(live))
+
+    result = caddy_manager.sync(sample_routes)
+
+    assert result["mode"] == "noop"
+    assert result["fingerprint"] == caddy_manager.applied_fingerprint
+    assert _writes(admin_api) == []
+
+
+def test_check_drift_detects_lost_config(caddy_manager, sample_routes, admin_api):
+    """Test that a Caddy restarted without --resume is reported as drift and re-pushed"""
+    assert caddy_manager.check_drift() is None  # nothing applied yet
+    caddy_manager.sync(sample_routes)
+    applied = admin_api.call_args[1]["json"]
+
+    admin_api.state["live"] = applied
+    assert caddy_manager.check_drift() is False
+
+    admin_api.state["live"] = []
+    assert caddy_manager.check_drift() is True
+    assert caddy_manager.applied_fingerprint is None
+
+    assert caddy_manager.sync(sample_routes)["mode"] == "full"
+    assert _writes(admin_api) == [("PATCH", ROUTES_URL)] * 2
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_sync_worker_syncs_inline_until_started():
+    """Test that requests sync immediately when the worker thread is not running"""
+    manager = Mock()
+    manager.sync.return_value = {"ok": True, "mode": "full"}
+    worker = CaddySyncWorker(manager, lambda: [{"id": "1"}])
+
+    assert worker.request("add") == 1
+    manager.sync.assert_called_once_with([{"id": "1"}])
+    assert worker.status()["pending"] is False
+    assert worker.status()["last_mode"] == "full"
+
+
+def test_sync_worker_coalesces_bursts():
+    """Test that a burst of requests becomes a single sync"""
+    manager = Mock()
+    manager.sync.return_value = {"ok": True}
+    worker = CaddySyncWorker(manager, lambda: [], debounce=0.1)
+    worker.start()
+    try:
+        for _ in range(20):
+            generation = worker.request("toggle")
+        assert _wait_for(lambda: worker.status()["applied_generation"] == generation)
+    finally:
+        worker.stop()
+
+    assert manager.sync.call_count == 1
+    assert worker.status()["pending"] is False
+
+
+def test_sync_worker_retries_failures_with_backoff():
+    """Test that a failed sync stays pending and is retried"""
+    manager = Mock()
+    manager.sync.side_effect = [Exception("connection refused"), Exception("connection refused"), {"ok": True}]
+    worker = CaddySyncWorker(manager, lambda: [], debounce=0, retry_base=0.05)
+    worker.start()
+    try:
+        worker.request("startup")
+        assert _wait_for(lambda: worker.status()["failures"] == 1)
+        assert worker.status()["pending"] is True
+        assert worker.status()["last_error"] == "connection refused"
+        assert _wait_for(lambda: not worker.status()["pending"])
+    finally:
+        worker.stop()
+
+    assert manager.sync.call_count == 3
+    assert worker.status()["failures"] == 0
+
+
+def test_sync_worker_serializes_syncs():
+    """Test that syncs never overlap"""
+    active = []
+    overlaps = []
+
+    def slow_sync(routes):
+        active.append(1)
+        if len(active) > 1:
+            overlaps.append(True)
+        time.sleep(0.02)
+        active.pop()
+        return {"ok": True}
+
+    manager = Mock()
+    manager.sync.side_effect = slow_sync
+    worker = CaddySyncWorker(manager, lambda: [], debounce=0)
+    worker.start()
+    try:
+        threads = [threading.Thread(target=worker.request) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert _wait_for(lambda: not worker.status()["pending"])
+    finally:
+        worker.stop()
+
+    assert not overlaps
+
+
+def test_sync_worker_reconcile_repushes_on_drift():
+    """Test that the idle worker re-syncs when Caddy drifted"""
+    manager = Mock()
+    manager.sync.return_value = {"ok": True, "mode": "full", "fingerprint": "abc"}
+    manager.check_drift.side_effect = [True] + [False] * 1000
+    worker = CaddySyncWorker(manager, lambda: [], debounce=0, reconcile_interval=0.05)
+    worker.request("startup")  # inline, before start()
+    worker.start()
+    try:
+        assert _wait_for(lambda: manager.sync.call_count == 2)
+        assert _wait_for(lambda: not worker.status()["pending"])
+    finally:
+        worker.stop()
+
+    status = worker.status()
+    assert status["drift_detected"] == 1
+    assert status["fingerprint"] == "abc"
+    assert status["last_reconcile"] is not None
+
+
+METRICS_TEXT = """\
+# HELP caddy_http_request_duration_seconds Histogram of round-trip request durations.
+# TYPE caddy_http_request_duration_seconds histogram
+caddy_http_request_duration_seconds_bucket{code="200",handler="reverse_proxy",method="GET",server="srv0",le="0.1"} %(fast)d
+caddy_http_request_duration_seconds_bucket{code="200",handler="reverse_proxy",method="GET",server="srv0",le="1"} %(ok)d
+caddy_http_request_duration_seconds_bucket{code="200",handler="reverse_proxy",method="GET",server="srv0",le="+Inf"} %(ok)d
+caddy_http_request_duration_seconds_sum{code="200",handler="reverse_proxy",method="GET",server="srv0"} %(sum)f
+caddy_http_request_duration_seconds_count{code="200",handler="reverse_proxy",method="GET",server="srv0"} %(ok)d
+caddy_http_request_duration_seconds_bucket{code="502",handler="reverse_proxy",method="GET",server="srv0",le="0.1"} %(failed)d
+caddy_http_request_duration_seconds_bucket{code="502",handler="reverse_proxy",method="GET",server="srv0",le="1"} %(failed)d
+caddy_http_request_duration_seconds_bucket{code="502",handler="reverse_proxy",method="GET",server="srv0",le="+Inf"} %(failed)d
+caddy_http_request_duration_seconds_count{code="502",handler="reverse_proxy",method="GET",server="srv0"} %(failed)d
+caddy_http_response_size_bytes_sum{code="200",handler="reverse_proxy",method="GET",server="srv0"} %(bytes)d
+caddy_http_requests_in_flight{handler="reverse_proxy",server="srv0"} 2
+"""
+
+
+def test_parse_prometheus_text():
+    """Test parsing of samples, escaped label values, special floats and timestamps"""
+    samples = parse_prometheus_text(
+        '# TYPE x counter\n'
+        'x_total{path="/a\\"b",le="+Inf"} 3 1700000000000\n'
+        'up 1\n'
+        'not a sample\n'
+    )
+
+    assert [(s.name, s.labels, s.value) for s in samples] == [
+        ("x_total", {"path": '/a"b', "le": "+Inf"}, 3.0),
+        ("up", {}, 1.0),
+    ]
+
+
+def test_histogram_quantile():
+    """Test quantile estimation from cumulative buckets"""
+    buckets = [(0.1, 50.0), (1.0, 100.0), (float("inf"), 100.0)]
+
+    assert histogram_quantile(0.5, buckets) == 0.1
+    assert histogram_quantile(0.75, buckets) == pytest.approx(0.55)
+    assert histogram_quantile(0.5, [(float("inf"), 0.0)]) is None
+
+
+def test_metrics_collector_rates():
+    """Test that two scrapes become request, error, byte and latency figures"""
+    mgr = CaddyManager(admin_url="http://localhost:2019", metrics=True)
+    mgr.enable_metrics = Mock(return_value=True)
+    scrapes = [
+        dict(fast=0, ok=0, sum=0.0, failed=0, bytes=0),
+        dict(fast=80, ok=100, sum=12.0, failed=20, bytes=50000),
+    ]
+    mgr.scrape_metrics = Mock(side_effect=[parse_prometheus_text(METRICS_TEXT % v) for v in scrapes])
+    collector = CaddyMetricsCollector(mgr, interval=10)
+
+    with patch("caddy_manager.time.monotonic", side_effect=[100.0, 110.0]):
+        assert collector.collect() and collector.collect()
+
+    row = collector.status()["traffic"]["srv0/reverse_proxy"]
+    assert row["requests"] == 120
+    assert row["requests_per_sec"] == 12.0
+    assert row["error_rate"] == round(20 / 120, 4)
+    assert row["bytes_out_per_sec"] == 5000.0
+    assert row["in_flight"] == 2
+    assert row["latency_p50_ms"] == pytest.approx(60.0)  # rank 60 of the 100 requests under 100 ms
+    mgr.enable_metrics.assert_called_once()
+
+
+def test_build_config_enables_metrics(sample_routes):
+    """Test that HTTP metrics are switched on only when requested"""
+    assert CaddyManager(metrics=True)._build_config(sample_routes)["apps"]["http"]["metrics"] == {}
+    assert "metrics" not in CaddyManager()._build_config(sample_routes)["apps"]["http"]
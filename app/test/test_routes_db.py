@@ -2,9 +2,13 @@
 Unit tests for RouteManager (TinyDB wrapper)
 """
 import pytest
+import base64
+import dataclasses
+import json
 import os
 import tempfile
-from routes_db import RouteManager
+from routes_db import ROUTE_SCHEMA_VERSION, Route, RouteConflictError, RouteManager, RoutePathIndex, upgrade_route_doc
+from route_storage import FileWatcher, RouteStorage, migrate_json_to_sqlite
 
 
 @pytest.fixture
@@ -211,3 +215,751 @@ def test_directory_with_existing_content_uses_nested_file(tmp_path):
 
     manager.add_route('/nested', 'Nested', '192.168.0.12', 8080)
     assert manager.get_route_by_path('/nested') is not None
+
+
+def test_reads_served_from_memory(temp_db):
+    """Reads should not touch the TinyDB table once the cache is loaded."""
+    added = temp_db.add_route('/cached', 'Cached', '192.168.1.100', 8080)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("read hit the database")
+
+    temp_db.storage.load_all = fail
+
+    assert temp_db.get_route_by_id(added['id'])['path'] == '/cached'
+    assert temp_db.get_route_by_path('/cached/')['id'] == added['id']
+    assert len(temp_db.get_all_routes()) == 1
+
+
+def test_returned_routes_are_read_only(temp_db):
+    """Returned routes are read-only views that cannot corrupt the cache."""
+    added = temp_db.add_route('/copy', 'Copy', '192.168.1.100', 8080)
+    with pytest.raises(TypeError):
+        added['name'] = 'Changed'
+    with pytest.raises(TypeError):
+        temp_db.get_all_routes()[0]['name'] = 'Changed'
+
+    assert temp_db.get_route_by_id(added['id'])['name'] == 'Copy'
+    # List reads share the snapshot's views instead of copying them
+    assert temp_db.get_all_routes()[0] is temp_db.snapshot().routes[0]
+
+
+def test_route_model_round_trip():
+    """Route keeps unknown keys, drops health fields and never mutates."""
+    doc = {'id': 'r1', 'path': '/a', 'name': 'A', 'target_ip': '192.168.1.100',
+           'target_port': 80, 'custom': 1, 'status': 'online'}
+    route = Route.from_dict(doc)
+
+    assert route['custom'] == 1
+    assert 'status' not in route
+    assert route.to_dict() == {**Route(id='r1').to_dict(), **{k: v for k, v in doc.items() if k != 'status'}}
+
+    renamed = route.with_changes({'name': 'B', 'other': 2})
+    assert (route['name'], renamed['name'], renamed['other']) == ('A', 'B', 2)
+    assert not hasattr(route, '__dict__')
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        route.name = 'C'
+
+
+def test_mutations_written_through(temp_db):
+    """Changes must be persisted and visible to a fresh manager."""
+    first = temp_db.add_route('/one', 'One', '192.168.1.100', 8080)
+    second = temp_db.add_route('/two', 'Two', '192.168.1.101', 8081)
+    temp_db.update_route(first['id'], {'path': '/uno'})
+    temp_db.delete_route(second['id'])
+
+    reopened = RouteManager(str(temp_db.db_path))
+    assert reopened.get_route_by_path('/uno')['id'] == first['id']
+    assert reopened.get_route_by_path('/one') is None
+    assert reopened.get_route_by_id(second['id']) is None
+
+
+def test_update_to_existing_path_fails(temp_db):
+    """Renaming a route onto another route's path is rejected."""
+    temp_db.add_route('/one', 'One', '192.168.1.100', 8080)
+    second = temp_db.add_route('/two', 'Two', '192.168.1.101', 8081)
+
+    with pytest.raises(ValueError, match="already exists"):
+        temp_db.update_route(second['id'], {'path': '/one'})
+    assert temp_db.get_route_by_path('/two')['id'] == second['id']
+
+
+def test_status_updates_group_committed(tmp_path):
+    """Buffered status updates are snapshotted in a single write."""
+    manager = RouteManager(str(tmp_path / 'routes.json'), status_flush_interval=3600)
+    first = manager.add_route('/one', 'One', '192.168.1.100', 8080)
+    second = manager.add_route('/two', 'Two', '192.168.1.101', 8081)
+
+    manager.update_route_status(first['id'], state='UP', reason='online')
+    manager.update_route_status(second['id'], state='DOWN', reason='timeout')
+
+    snapshot = tmp_path / 'routes.health.json'
+    assert not snapshot.exists()
+    assert manager.get_route_by_id(first['id'])['state'] == 'UP'
+
+    assert manager.flush_status() is True
+    assert snapshot.exists()
+    assert manager.flush_status() is False
+
+    reopened = RouteManager(str(tmp_path / 'routes.json'))
+    assert reopened.get_route_by_id(second['id'])['reason'] == 'timeout'
+
+
+def test_close_flushes_pending_status(tmp_path):
+    """Closing the manager must not lose buffered status updates."""
+    manager = RouteManager(str(tmp_path / 'routes.json'), status_flush_interval=3600)
+    added = manager.add_route('/one', 'One', '192.168.1.100', 8080)
+    manager.update_route_status(added['id'], state='DEGRADED', reason='slow')
+    manager.close()
+
+    reopened = RouteManager(str(tmp_path / 'routes.json'))
+    assert reopened.get_route_by_id(added['id'])['state'] == 'DEGRADED'
+
+
+def test_status_updates_never_rewrite_config(tmp_path):
+    """Probe results go to the health store, not routes.json."""
+    manager = RouteManager(str(tmp_path / 'routes.json'))
+    added = manager.add_route('/one', 'One', '192.168.1.100', 8080)
+    config_before = (tmp_path / 'routes.json').read_text(encoding='utf-8')
+
+    manager.update_route_status(added['id'], status='online', state='UP', http_status=200)
+
+    assert (tmp_path / 'routes.json').read_text(encoding='utf-8') == config_before
+    assert 'state' not in json.loads(config_before)['routes']['1']
+    route = manager.get_route_by_id(added['id'])
+    assert route['state'] == 'UP'
+    assert route['http_status'] == 200
+
+
+def test_new_route_has_default_health(temp_db):
+    """Routes without probe results report the UNKNOWN defaults."""
+    route = temp_db.add_route('/fresh', 'Fresh', '192.168.1.100', 8080)
+    assert route['state'] == 'UNKNOWN'
+    assert route['status'] == 'unknown'
+    assert route['retries_used'] == 0
+
+
+def test_legacy_inline_health_adopted(tmp_path):
+    """Old databases with inline status fields keep their last results."""
+    db_file = tmp_path / 'routes.json'
+    db_file.write_text(json.dumps({'routes': {'1': {
+        'id': 'abc', 'path': '/old', 'name': 'Old', 'target_ip': '192.168.1.5',
+        'target_port': 80, 'enabled': True, 'state': 'DOWN', 'reason': 'timeout',
+    }}}), encoding='utf-8')
+
+    manager = RouteManager(str(db_file))
+    assert manager.get_route_by_id('abc')['reason'] == 'timeout'
+
+    # The next real config change drops the inline copy
+    manager.update_route('abc', {'name': 'Renamed'})
+    stored = json.loads(db_file.read_text(encoding='utf-8'))['routes']['1']
+    assert stored['name'] == 'Renamed'
+    assert 'state' not in stored
+    assert manager.get_route_by_id('abc')['reason'] == 'timeout'
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """RouteManager backed by SQLite"""
+    manager = RouteManager(str(tmp_path / 'routes.json'), backend='sqlite')
+    yield manager
+    manager.close()
+
+
+def test_sqlite_backend_crud(sqlite_db, tmp_path):
+    """The SQLite backend persists adds, updates and deletes."""
+    first = sqlite_db.add_route('/one', 'One', '192.168.1.100', 8080)
+    second = sqlite_db.add_route('/two', 'Two', '192.168.1.101', 8081)
+    sqlite_db.update_route(first['id'], {'name': 'Uno', 'path': '/uno'})
+    sqlite_db.delete_route(second['id'])
+
+    assert (tmp_path / 'routes.sqlite3').exists()
+    mode = sqlite_db.storage.conn.execute('PRAGMA journal_mode').fetchone()[0]
+    assert mode == 'wal'
+
+    reopened = RouteManager(str(tmp_path / 'routes.json'), backend='sqlite')
+    routes = reopened.get_all_routes()
+    assert [r['path'] for r in routes] == ['/uno']
+    assert routes[0]['name'] == 'Uno'
+    reopened.close()
+
+
+def test_sqlite_backend_rejects_duplicate_path(sqlite_db):
+    """Duplicate paths are rejected before reaching the database."""
+    sqlite_db.add_route('/dup', 'Dup', '192.168.1.100', 8080)
+    with pytest.raises(ValueError, match="already exists"):
+        sqlite_db.add_route('/dup/', 'Dup 2', '192.168.1.101', 8081)
+
+
+def test_sqlite_backend_migrates_existing_json(tmp_path):
+    """Switching to SQLite carries existing routes over once."""
+    json_manager = RouteManager(str(tmp_path / 'routes.json'))
+    added = json_manager.add_route('/legacy', 'Legacy', '192.168.1.100', 8080)
+    json_manager.close()
+
+    manager = RouteManager(str(tmp_path / 'routes.json'), backend='sqlite')
+    assert manager.get_route_by_path('/legacy')['id'] == added['id']
+    manager.close()
+
+    # Running the migrator again does not duplicate anything
+    assert migrate_json_to_sqlite(tmp_path / 'routes.json', tmp_path / 'routes.sqlite3') == 0
+
+
+def test_unknown_backend_rejected(tmp_path):
+    """An unsupported backend name is a configuration error."""
+    with pytest.raises(ValueError, match="Unknown routes storage backend"):
+        RouteManager(str(tmp_path / 'routes.json'), backend='mongo')
+
+
+def test_journal_backend_replays_changes(tmp_path):
+    """Journal mutations survive a restart without a compaction."""
+    manager = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    first = manager.add_route('/one', 'One', '192.168.1.100', 8080)
+    second = manager.add_route('/two', 'Two', '192.168.1.101', 8081)
+    manager.update_route(first['id'], {'name': 'Uno'})
+    manager.delete_route(second['id'])
+    manager.close()
+
+    lines = (tmp_path / 'routes.journal').read_bytes().splitlines()
+    assert len(lines) == 4
+    record = json.loads(lines[2])
+    assert (record['op'], record['id']) == ('update', first['id'])
+    assert 'target_ip' not in record['changes']  # only the change is logged
+
+    reopened = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    routes = reopened.get_all_routes()
+    assert [(r['path'], r['name']) for r in routes] == [('/one', 'Uno')]
+    reopened.close()
+
+
+def test_journal_backend_ignores_torn_tail(tmp_path):
+    """A partially written last record only loses that record."""
+    manager = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    added = manager.add_route('/one', 'One', '192.168.1.100', 8080)
+    manager.close()
+
+    with open(tmp_path / 'routes.journal', 'ab') as handle:
+        handle.write(b'{"op":"delete","id":"' + added['id'].encode())
+
+    reopened = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    assert reopened.get_route_by_id(added['id']) is not None
+    reopened.add_route('/two', 'Two', '192.168.1.101', 8081)
+    reopened.close()
+
+    again = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    assert len(again.get_all_routes()) == 2
+    again.close()
+
+
+def test_journal_backend_compacts(tmp_path):
+    """Reaching the record threshold folds the journal into a snapshot."""
+    manager = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    manager.storage.compact_every = 3
+    added = manager.add_route('/one', 'One', '192.168.1.100', 8080)
+    manager.update_route(added['id'], {'name': 'Uno'})
+    manager.update_route(added['id'], {'target_port': 9090})
+    manager.close()
+
+    assert (tmp_path / 'routes.snapshot').stat().st_size > 0
+    assert (tmp_path / 'routes.journal').read_bytes() == b''
+
+    reopened = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    route = reopened.get_route_by_id(added['id'])
+    assert route['name'] == 'Uno'
+    assert route['target_port'] == 9090
+    reopened.close()
+
+
+def test_incomplete_storage_backend_fails_at_creation(tmp_path):
+    """A backend missing part of the interface cannot be instantiated."""
+    class NoDelete(RouteStorage):
+        def load_all(self):
+            return []
+
+        def insert(self, route):
+            pass
+
+        def update(self, route, changes):
+            pass
+
+    with pytest.raises(TypeError, match="delete"):
+        NoDelete()
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'journal'])
+def test_import_skips_duplicate_legacy_paths(tmp_path, backend, caplog):
+    """A legacy file with both /x and /x/ still boots; the later route is skipped and logged."""
+    legacy = {'routes': {
+        '1': {'id': 'first', 'path': '/x', 'name': 'X', 'target_ip': '192.168.1.100', 'target_port': 80},
+        '2': {'id': 'second', 'path': '/x/', 'name': 'X again', 'target_ip': '192.168.1.101', 'target_port': 80},
+    }}
+    (tmp_path / 'routes.json').write_text(json.dumps(legacy))
+
+    with caplog.at_level('WARNING', logger='route_storage'):
+        manager = RouteManager(str(tmp_path / 'routes.json'), backend=backend)
+    assert [r['id'] for r in manager.get_all_routes()] == ['first']
+    assert 'second' in caplog.text and 'first' in caplog.text
+    manager.close()
+
+
+def test_journal_backend_imports_existing_json(tmp_path):
+    """Switching to the journal carries existing routes over once."""
+    json_manager = RouteManager(str(tmp_path / 'routes.json'))
+    added = json_manager.add_route('/legacy', 'Legacy', '192.168.1.100', 8080)
+    json_manager.close()
+
+    manager = RouteManager(str(tmp_path / 'routes.json'), backend='journal')
+    assert manager.get_route_by_path('/legacy')['id'] == added['id']
+    manager.close()
+
+
+def test_snapshot_reused_until_mutation(temp_db):
+    """Snapshots are cached per ETag and rebuilt after any change."""
+    added = temp_db.add_route('/snap', 'Snap', '192.168.1.100', 8080)
+    temp_db.add_route('/other', 'Other', '192.168.1.100', 8081)
+    first = temp_db.snapshot()
+    assert temp_db.snapshot() is first
+
+    # Health moves the ETag but not the config version, and only the
+    # changed route's view is rebuilt
+    temp_db.update_route_status(added['id'], state='UP')
+    second = temp_db.snapshot()
+    assert second.version == first.version
+    assert second.etag != first.etag
+    assert second.routes[0]['state'] == 'UP'
+    assert second.routes[1] is first.routes[1]
+
+    temp_db.update_route(added['id'], {'name': 'Renamed'})
+    third = temp_db.snapshot()
+    assert third.version > second.version
+    assert third.routes[0]['name'] == 'Renamed'
+    assert third.routes[0]['state'] == 'UP'
+
+
+def test_if_match_guards_config_changes(temp_db):
+    """Stale ETags are rejected; health updates do not invalidate them."""
+    added = temp_db.add_route('/guard', 'Guard', '192.168.1.100', 8080)
+    etag = temp_db.route_etag(added['id'])
+
+    temp_db.update_route_status(added['id'], state='UP')
+    assert temp_db.update_route(added['id'], {'name': 'First'}, if_match=[etag])
+
+    with pytest.raises(RouteConflictError):
+        temp_db.update_route(added['id'], {'name': 'Second'}, if_match=[etag])
+    with pytest.raises(RouteConflictError):
+        temp_db.delete_route(added['id'], if_match=[etag])
+
+    assert temp_db.get_route_by_id(added['id'])['name'] == 'First'
+    assert temp_db.delete_route(added['id'], if_match=['*'])
+
+
+def test_changes_since_version(temp_db):
+    """The change feed reports each touched route once with its latest op."""
+    kept = temp_db.add_route('/kept', 'Kept', '192.168.1.100', 8080)
+    gone = temp_db.add_route('/gone', 'Gone', '192.168.1.101', 8081)
+    since = temp_db.version
+
+    fresh = temp_db.add_route('/fresh', 'Fresh', '192.168.1.102', 8082)
+    temp_db.update_route(fresh['id'], {'name': 'Fresh 2'})
+    temp_db.update_route_status(kept['id'], state='UP')
+    temp_db.delete_route(gone['id'])
+
+    feed = temp_db.get_changes(since)
+    assert feed['full_reload'] is False
+    assert feed['version'] == temp_db.version
+    ops = {c['id']: c['op'] for c in feed['changes']}
+    assert ops == {fresh['id']: 'added', kept['id']: 'updated', gone['id']: 'deleted'}
+    added = next(c for c in feed['changes'] if c['id'] == fresh['id'])
+    assert added['route']['name'] == 'Fresh 2'
+
+    assert temp_db.get_changes(temp_db.version)['changes'] == []
+
+
+def test_changes_truncated_log_requests_reload(tmp_path):
+    """Clients behind the bounded changelog are told to reload."""
+    manager = RouteManager(str(tmp_path / 'routes.json'), changelog_size=2)
+    since = manager.version
+    for i in range(3):
+        manager.add_route(f'/r{i}', f'R{i}', '192.168.1.100', 8080 + i)
+
+    assert manager.get_changes(since)['full_reload'] is True
+    assert manager.get_changes(manager.version - 1)['full_reload'] is False
+    assert manager.get_changes(manager.version + 5)['full_reload'] is True
+
+
+def test_path_index_longest_prefix():
+    """The trie resolves nested paths to the deepest mount."""
+    index = RoutePathIndex()
+    index.insert('/media', 'media')
+    index.insert('/media/jellyfin', 'jellyfin')
+
+    assert index.exact('/media/') == 'media'
+    assert index.longest_prefix('/media/jellyfin/web/index.html') == 'jellyfin'
+    assert index.longest_prefix('/media/other') == 'media'
+    assert index.longest_prefix('/mediaserver') is None
+    assert index.overlaps('/media') == ([], ['jellyfin'])
+    assert index.overlaps('/media/jellyfin/x') == (['media', 'jellyfin'], [])
+
+    index.remove('/media/jellyfin', 'not-the-owner')
+    assert index.exact('/media/jellyfin') == 'jellyfin'
+    index.remove('/media/jellyfin')
+    assert index.longest_prefix('/media/jellyfin/web') == 'media'
+
+
+def test_match_route(temp_db):
+    """match_route follows the index after adds, renames and deletes."""
+    added = temp_db.add_route('/jellyfin', 'Jellyfin', '192.168.1.100', 8096)
+    assert temp_db.match_route('/jellyfin/web/index.html')['id'] == added['id']
+
+    temp_db.update_route(added['id'], {'path': '/media'})
+    assert temp_db.match_route('/jellyfin/web') is None
+    assert temp_db.match_route('/media/web')['id'] == added['id']
+
+    temp_db.delete_route(added['id'])
+    assert temp_db.match_route('/media/web') is None
+
+
+def test_reserved_portal_paths_rejected(temp_db):
+    """Mounts that would shadow the portal are refused."""
+    with pytest.raises(ValueError, match="reserved"):
+        temp_db.add_route('/api', 'API', '192.168.1.100', 8080)
+    with pytest.raises(ValueError, match="reserved"):
+        temp_db.add_route('/static/assets', 'Assets', '192.168.1.100', 8080)
+
+    added = temp_db.add_route('/apis', 'APIs', '192.168.1.100', 8080)
+    with pytest.raises(ValueError, match="reserved"):
+        temp_db.update_route(added['id'], {'path': '/admin'})
+
+
+def test_search_routes_ranked(temp_db):
+    """Search matches name, path, IP and port and ranks the best match first."""
+    jelly = temp_db.add_route('/jellyfin', 'Jellyfin', '192.168.1.100', 8096)
+    media = temp_db.add_route('/media', 'Media Jellyfin Mirror', '192.168.1.101', 8080)
+    other = temp_db.add_route('/grafana', 'Grafana', '10.0.0.5', 3000)
+
+    results = temp_db.search_routes('jellyfin')
+    assert [r['id'] for r in results] == [jelly['id'], media['id']]
+
+    assert [r['id'] for r in temp_db.search_routes('10.0.0')] == [other['id']]
+    assert [r['id'] for r in temp_db.search_routes('3000')] == [other['id']]
+    assert [r['id'] for r in temp_db.search_routes('jelly mirror')] == [media['id']]
+    assert len(temp_db.search_routes('a', limit=2)) == 2
+    assert temp_db.search_routes('nothing') == []
+
+
+def test_search_index_follows_updates(temp_db):
+    """Renames and deletes are reflected in search results."""
+    route = temp_db.add_route('/sonarr', 'Sonarr', '192.168.1.100', 8989)
+    temp_db.update_route(route['id'], {'name': 'Series'})
+
+    assert temp_db.search_routes('sonarr')[0]['name'] == 'Series'  # still matches on path
+    assert temp_db.search_routes('series')[0]['id'] == route['id']
+
+    temp_db.update_route(route['id'], {'path': '/tv'})
+    assert temp_db.search_routes('sonarr') == []
+
+    temp_db.delete_route(route['id'])
+    assert temp_db.search_routes('series') == []
+
+
+def test_list_routes_sort_filter_and_cursor(temp_db):
+    """Routes page in sort order with keyset cursors and filters."""
+    ids = {}
+    for name, port in (('Charlie', 8003), ('alpha', 8001), ('Bravo', 8002), ('Delta', 8004)):
+        ids[name] = temp_db.add_route(f'/{name.lower()}', name, '192.168.1.100', port)['id']
+    temp_db.update_route_status(ids['Bravo'], 'online', state='UP', duration_ms=40)
+    temp_db.update_route_status(ids['Delta'], 'online', state='UP', duration_ms=10)
+    temp_db.update_route(ids['Charlie'], {'enabled': False})
+
+    first = temp_db.list_routes(limit=2)
+    assert [r['name'] for r in first.routes] == ['alpha', 'Bravo']
+    assert first.total == 4
+
+    # A route added before the cursor does not shift the next page
+    temp_db.add_route('/aardvark', 'Aardvark', '192.168.1.100', 8000)
+    second = temp_db.list_routes(cursor=first.next_cursor, limit=2)
+    assert [r['name'] for r in second.routes] == ['Charlie', 'Delta']
+    assert second.next_cursor is None
+
+    slowest = temp_db.list_routes(sort='-duration_ms')
+    assert [r['name'] for r in slowest.routes[:2]] == ['Bravo', 'Delta']
+
+    assert {r['name'] for r in temp_db.list_routes(state=['up']).routes} == {'Bravo', 'Delta'}
+    assert [r['name'] for r in temp_db.list_routes(enabled=False).routes] == ['Charlie']
+
+    with pytest.raises(ValueError):
+        temp_db.list_routes(sort='target_ip')
+    with pytest.raises(ValueError):
+        temp_db.list_routes(sort='path', cursor=first.next_cursor)
+
+
+def test_list_routes_rejects_tampered_cursor(temp_db):
+    """Cursor values of the wrong type are rejected, not compared."""
+    temp_db.add_route('/alpha', 'alpha', '192.168.1.100', 8001)
+    temp_db.add_route('/bravo', 'bravo', '192.168.1.100', 8002)
+
+    def cursor(*parts):
+        return base64.urlsafe_b64encode(json.dumps(list(parts)).encode()).decode()
+
+    for tampered in (cursor('path', False, 123, 'x'), cursor('path', 0, '/a', 'x'), cursor('path', False, '/a', 7),
+                     cursor('duration_ms', False, 'slow', 'x'), cursor('path', True, 5, 'x'), cursor('path')):
+        sort = json.loads(base64.urlsafe_b64decode(tampered))[0]
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            temp_db.list_routes(sort=sort, cursor=tampered, limit=1)
+
+    assert [r['name'] for r in temp_db.list_routes(cursor=cursor('name', False, 'alpha', '~'), limit=1).routes] == ['bravo']
+
+
+@pytest.mark.parametrize('backend', ['tinydb', 'sqlite', 'journal'])
+def test_multiprocess_managers_stay_coherent(tmp_path, backend):
+    """Managers sharing a store see each other's writes and reject stale ones."""
+    db_path = str(tmp_path / 'routes.json')
+    first = RouteManager(db_path, backend=backend, multiprocess=True)
+    second = RouteManager(db_path, backend=backend, multiprocess=True)
+
+    route = first.add_route('/shared', 'Shared', '192.168.1.100', 8080)
+    assert second.get_route_by_path('/shared')['id'] == route['id']
+    etag = second.route_etag(route['id'])
+
+    first.update_route(route['id'], {'name': 'Renamed'})
+    assert second.get_route_by_id(route['id'])['name'] == 'Renamed'
+    with pytest.raises(RouteConflictError):
+        second.update_route(route['id'], {'name': 'Stale'}, if_match=[etag])
+    with pytest.raises(ValueError, match="already exists"):
+        second.add_route('/shared', 'Duplicate', '192.168.1.101', 8080)
+
+    # Interleaved inserts from both sides must not overwrite each other
+    first.add_route('/one', 'One', '192.168.1.100', 8081)
+    second.add_route('/two', 'Two', '192.168.1.100', 8082)
+    second.delete_route(route['id'])
+    for manager in (first, second):
+        assert sorted(r['path'] for r in manager.get_all_routes()) == ['/one', '/two']
+
+    first.close()
+    second.close()
+    reopened = RouteManager(db_path, backend=backend)
+    assert sorted(r['path'] for r in reopened.get_all_routes()) == ['/one', '/two']
+    reopened.close()
+
+
+@pytest.mark.parametrize('backend', ['tinydb', 'sqlite', 'journal'])
+def test_apply_batch(tmp_path, backend):
+    """A valid batch is applied in order and persisted by every backend."""
+    db_path = str(tmp_path / 'routes.json')
+    manager = RouteManager(db_path, backend=backend)
+    keep = manager.add_route('/keep', 'Keep', '192.168.1.100', 8080)
+    drop = manager.add_route('/drop', 'Drop', '192.168.1.100', 8081)
+
+    applied, results = manager.apply_batch([
+        {'op': 'create', 'route': {'path': '/new', 'name': 'New', 'target_ip': '192.168.1.101', 'target_port': 9000}},
+        {'op': 'delete', 'id': drop['id']},
+        # The path freed by the delete can be reused within the same batch
+        {'op': 'update', 'id': keep['id'], 'changes': {'path': '/drop', 'name': 'Moved'}},
+        {'op': 'toggle', 'id': keep['id']},
+    ])
+    assert applied is True
+    assert [r['status'] for r in results] == ['created', 'deleted', 'updated', 'updated']
+    assert results[3]['route']['enabled'] is False
+    assert manager.match_route('/drop/x')['name'] == 'Moved'
+    manager.close()
+
+    reopened = RouteManager(db_path, backend=backend)
+    assert sorted((r['path'], r['enabled']) for r in reopened.get_all_routes()) == [('/drop', False), ('/new', True)]
+    reopened.close()
+
+
+def test_apply_batch_is_all_or_nothing(temp_db):
+    """One invalid operation rejects the whole batch."""
+    route = temp_db.add_route('/app', 'App', '192.168.1.100', 8080)
+    version = temp_db.version
+
+    applied, results = temp_db.apply_batch([
+        {'op': 'create', 'route': {'path': '/other', 'name': 'Other', 'target_ip': '192.168.1.100', 'target_port': 8081}},
+        {'op': 'create', 'route': {'path': '/other', 'name': 'Clash', 'target_ip': '192.168.1.100', 'target_port': 8082}},
+        {'op': 'update', 'id': route['id'], 'changes': {'target_port': 0}},
+        {'op': 'delete', 'id': 'missing'},
+        {'op': 'rename'},
+    ])
+    assert applied is False
+    assert [r['status'] for r in results] == ['skipped', 'error', 'error', 'error', 'error']
+    assert 'already exists' in results[1]['error']
+    assert temp_db.version == version
+    assert [r['path'] for r in temp_db.get_all_routes()] == ['/app']
+
+
+def test_apply_batch_reports_malformed_items(temp_db):
+    """Fields of the wrong JSON type become per-item errors, not exceptions."""
+    route = temp_db.add_route('/app', 'App', '192.168.1.100', 8080)
+
+    applied, results = temp_db.apply_batch([
+        {'op': 'create', 'route': {'path': 5, 'name': 'Five', 'target_ip': '192.168.1.100', 'target_port': 8081}},
+        {'op': 'update', 'id': ['not', 'hashable'], 'changes': {'name': 'x'}},
+        {'op': 'toggle', 'id': route['id'], 'if_match': 7},
+        {'op': 'update', 'id': route['id'], 'changes': {'target_ip': ['192.168.1.1']}},
+    ])
+    assert applied is False
+    assert [r['status'] for r in results] == ['error'] * 4
+    assert all(r['error'] for r in results)
+    assert temp_db.get_route_by_id(route['id'])['enabled'] is True
+
+
+def test_file_watcher_reports_settled_changes(tmp_path):
+    """The watcher reports a change once, after the file stopped changing."""
+    path = tmp_path / 'routes.json'
+    path.write_text('{}')
+    watcher = FileWatcher([path, tmp_path / 'missing'])
+
+    assert watcher.poll() is False
+    path.write_text('{"a": 1}')
+    assert watcher.poll() is False  # still changing
+    assert watcher.poll() is True
+    assert watcher.poll() is False
+
+
+def test_reload_picks_up_out_of_band_edits(temp_db):
+    """Hand edits to routes.json are merged into the cache on reload."""
+    kept = temp_db.add_route('/kept', 'Kept', '192.168.1.100', 8080)
+    removed = temp_db.add_route('/removed', 'Removed', '192.168.1.100', 8081)
+    assert temp_db.reload() == []
+
+    data = json.loads(temp_db.db_path.read_text())
+    docs = data['routes']
+    for doc_id, doc in list(docs.items()):
+        if doc['id'] == kept['id']:
+            doc['name'] = 'Edited'
+        else:
+            del docs[doc_id]
+    docs['99'] = {**docs[next(iter(docs))], 'id': 'restored', 'path': '/restored', 'name': 'Restored'}
+    temp_db.db_path.write_text(json.dumps(data))
+
+    changes = temp_db.reload()
+    assert sorted(changes) == sorted([(removed['id'], 'deleted'), (kept['id'], 'updated'), ('restored', 'added')])
+    assert temp_db.get_route_by_id(kept['id'])['name'] == 'Edited'
+    assert temp_db.match_route('/restored/x')['id'] == 'restored'
+    assert temp_db.get_route_by_path('/removed') is None
+
+    # Later writes must not reuse the restored document's id
+    temp_db.add_route('/after', 'After', '192.168.1.100', 8082)
+    assert {r['path'] for r in RouteManager(str(temp_db.db_path)).get_all_routes()} == {'/kept', '/restored', '/after'}
+
+
+@pytest.mark.parametrize('backend', ['tinydb', 'journal'])
+def test_legacy_documents_upgraded_lazily(tmp_path, backend):
+    """Old documents are upgraded on read and only written back in batches."""
+    legacy = [
+        {'id': f'r{i}', 'route_path': f'/legacy{i}', 'name': f'Legacy {i}',
+         'target_ip': '192.168.1.5', 'target_port': 80, 'enabled': True, 'status': 'online'}
+        for i in range(3)
+    ]
+    db_file = tmp_path / 'routes.json'
+    db_file.write_text(json.dumps({'routes': {str(i + 1): doc for i, doc in enumerate(legacy)}}))
+    before = db_file.read_text()
+
+    manager = RouteManager(str(db_file), backend=backend, background_upgrades=False)
+    route = manager.get_route_by_path('/legacy0')
+    assert route['schema_version'] == ROUTE_SCHEMA_VERSION
+    assert 'route_path' not in route
+    assert (route['state'], route['reason']) == ('UP', 'online')  # derived from legacy status
+    if backend == 'tinydb':
+        assert db_file.read_text() == before  # startup never rewrites the database
+
+    assert manager.persist_upgrades(batch_size=2) == 2
+    assert manager.persist_upgrades(batch_size=2) == 1
+    assert manager.persist_upgrades() == 0
+    manager.close()
+
+
+    stored = RouteManager(str(db_file), backend=backend).storage.load_all()
+    assert sorted(doc['path'] for doc in stored) == ['/legacy0', '/legacy1', '/legacy2']
+    assert all('route_path' not in doc and doc['schema_version'] == ROUTE_SCHEMA_VERSION for doc in stored)
+
+
+@pytest.mark.parametrize('backend, batches', [('tinydb', [250]), ('journal', [200, 50])])
+def test_persist_upgrades_batches_per_backend(tmp_path, monkeypatch, backend, batches):
+    """TinyDB writes every upgraded document in one batch, the others 200 at a time."""
+    legacy = {
+        str(i + 1): {'id': f'r{i}', 'route_path': f'/legacy{i}', 'name': f'Legacy {i}',
+                     'target_ip': '192.168.1.5', 'target_port': 80}
+        for i in range(250)
+    }
+    db_file = tmp_path / 'routes.json'
+    db_file.write_text(json.dumps({'routes': legacy}))
+    manager = RouteManager(str(db_file), backend=backend, background_upgrades=False)
+
+    sizes = []
+    write_batch = manager.storage.write_batch
+    monkeypatch.setattr(manager.storage, 'write_batch', lambda changes: (sizes.append(len(changes)), write_batch(changes)))
+    while manager.persist_upgrades():
+        pass
+    assert sizes == batches
+    manager.close()
+
+
+def test_upgrade_route_doc_leaves_current_documents_alone():
+    """Current documents are returned as-is without copying."""
+    doc = {'id': 'x', 'path': '/x', 'schema_version': ROUTE_SCHEMA_VERSION}
+    assert upgrade_route_doc(doc) == (doc, False)
+    assert upgrade_route_doc(doc)[0] is doc
+
+
+@pytest.mark.parametrize('backend', ['tinydb', 'sqlite', 'journal'])
+def test_route_with_multiple_upstreams(tmp_path, backend):
+    """Upstreams are validated, persisted and kept in step with target_ip/target_port."""
+    db_path = str(tmp_path / 'routes.json')
+    manager = RouteManager(db_path, backend=backend)
+    route = manager.add_route(
+        '/api-pool', 'API pool', None, None,
+        upstreams=[{'ip': '192.168.1.10', 'port': 8080, 'weight': 3}, '192.168.1.11:8080'],
+        lb_policy='weighted', fail_duration=30, max_fails=2,
+    )
+    assert (route['target_ip'], route['target_port']) == ('192.168.1.10', 8080)
+    assert route['upstreams'] == [
+        {'ip': '192.168.1.10', 'port': 8080, 'weight': 3},
+        {'ip': '192.168.1.11', 'port': 8080, 'weight': 1},
+    ]
+    assert route['lb_policy'] == 'weighted'
+
+    # Editing the primary target edits the first upstream
+    manager.update_route(route['id'], {'target_ip': '192.168.1.12'})
+    assert [u['ip'] for u in manager.get_route_by_id(route['id'])['upstreams']] == ['192.168.1.12', '192.168.1.11']
+    manager.close()
+
+    reopened = RouteManager(db_path, backend=backend)
+    stored = reopened.get_route_by_id(route['id'])
+    assert stored['upstreams'][0] == {'ip': '192.168.1.12', 'port': 8080, 'weight': 3}
+    assert (stored['fail_duration'], stored['max_fails']) == (30, 2)
+    reopened.close()
+
+
+def test_route_transport_options(temp_db):
+    """Transport tuning is validated, defaults to Caddy's behaviour and can be updated."""
+    route = temp_db.add_route('/tuned', 'Tuned', '192.168.1.10', 80, dial_timeout=2,
+                              max_conns_per_host='64', upstream_http_version='2', keepalive='false')
+    assert (route['dial_timeout'], route['max_conns_per_host'], route['upstream_http_version']) == (2, 64, '2')
+    assert route['keepalive'] is False
+    assert (route['response_header_timeout'], route['max_request_body_mb']) == (0, 0)
+
+    for bad in ({'dial_timeout': 61}, {'max_conns_per_host': -1}, {'upstream_http_version': '3'},
+                {'max_request_body_mb': 'lots'}):
+        with pytest.raises(ValueError):
+            temp_db.update_route(route['id'], bad)
+
+    temp_db.update_route(route['id'], {'max_request_body_mb': 16, 'keepalive_idle_conns_per_host': 8})
+    updated = temp_db.get_route_by_id(route['id'])
+    assert (updated['max_request_body_mb'], updated['keepalive_idle_conns_per_host']) == (16, 8)
+
+
+def test_upstreams_follow_private_ip_rules(temp_db):
+    """Every upstream must pass the same checks as target_ip."""
+    for bad in (['8.8.8.8:80'], ['127.0.0.1:80'], ['169.254.169.254:80'], [{'ip': '192.168.1.10', 'port': 0}],
+                ['192.168.1.10:80', '192.168.1.10:80'], [{'ip': '192.168.1.10', 'port': 80, 'weight': 0}]):
+        with pytest.raises(ValueError):
+            temp_db.add_route('/bad', 'Bad', None, None, upstreams=bad)
+
+    with pytest.raises(ValueError, match="policy"):
+        temp_db.add_route('/bad', 'Bad', '192.168.1.10', 80, lb_policy='fastest')
+
+    route = temp_db.add_route('/single', 'Single', '192.168.1.10', 80)
+    assert route['upstreams'] == [] and route['lb_policy'] == 'round_robin'
+    with pytest.raises(ValueError):
+        temp_db.update_route(route['id'], {'upstreams': ['10.0.0.1:80', '1.1.1.1:80']})